@@ -0,0 +1,82 @@
+import json
+import logging
+import re
+
+# Structured levels requested from GPT next to the Farsi prose.
+# The answer ends with one line `LEVELS_JSON: {...}` that is cut off before the text is published,
+# so the levels do not have to be recovered from the prose with regular expressions.
+
+LEVELS_MARKER = 'LEVELS_JSON:'
+
+LEVELS_INSTRUCTION = f"""
+        After the analysis add one last line that starts with {LEVELS_MARKER} followed by a single-line JSON object with the keys
+        "supports" and "resistances" (lists of prices), "direction" ("long", "short" or "none"), "entry", "target", "stop_loss" and "leverage"
+        (numbers, or null when there is no signal). Use English digits in the JSON.
+        """
+
+PRICE_KEYS = ('entry', 'target', 'stop_loss', 'leverage')
+DIRECTIONS = ('long', 'short', 'none')
+
+def _number(value):
+    if value is None or isinstance(value, bool):
+        return None
+    if isinstance(value, str):
+        value = value.replace(',', '').strip()
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+def normalize_levels(levels):
+    """Levels with the expected keys and types, missing or malformed values become empty or None."""
+    normalized = {}
+    for key in ('supports', 'resistances'):
+        values = levels.get(key) or []
+        values = values if isinstance(values, list) else [values]
+        normalized[key] = [number for number in map(_number, values) if number is not None]
+    direction = str(levels.get('direction') or 'none').lower()
+    normalized['direction'] = direction if direction in DIRECTIONS else 'none'
+    for key in PRICE_KEYS:
+        normalized[key] = _number(levels.get(key))
+    return normalized
+
+def _remove_suffix(text, suffix):
+    # str.removesuffix needs Python 3.9
+    return text[:-len(suffix)] if text.endswith(suffix) else text
+
+def strip_levels(text):
+    """The prose of an answer, without the levels line (also while the answer is still being streamed)."""
+    index = text.find(LEVELS_MARKER)
+    return text if index < 0 else _remove_suffix(_remove_suffix(text[:index].rstrip(), '```json'), '```').rstrip()
+
+def split_levels(text):
+    """
+    Separate an answer into its prose and its structured levels.
+
+    Returns:
+    str, dict or None: The prose, and the normalized levels or None when the answer has no valid levels line.
+    """
+    index = text.find(LEVELS_MARKER)
+    if index < 0:
+        return text, None
+    match = re.search(r'\{.*\}', text[index + len(LEVELS_MARKER):], re.DOTALL)
+    levels = None
+    if match:
+        try:
+            levels = normalize_levels(json.loads(match.group(0)))
+        except (ValueError, AttributeError) as e:
+            logging.warning(f"Could not parse the levels of the analysis: {e}")
+    return strip_levels(text), levels
+
+def test():
+    answer = "تحلیل ...\n- سطح حمایت: 60000\n\n```json\nLEVELS_JSON: {\"supports\": [60000, \"58,500\"], \"resistances\": [65000], " \
+             "\"direction\": \"Long\", \"entry\": 61000, \"target\": \"65000\", \"stop_loss\": 59000, \"leverage\": 5}\n```"
+    prose, levels = split_levels(answer)
+    assert prose == "تحلیل ...\n- سطح حمایت: 60000", repr(prose)
+    assert levels == {'supports': [60000.0, 58500.0], 'resistances': [65000.0], 'direction': 'long',
+                      'entry': 61000.0, 'target': 65000.0, 'stop_loss': 59000.0, 'leverage': 5.0}, levels
+    assert split_levels("no levels") == ("no levels", None)
+    assert strip_levels(answer[:answer.index('LEVELS_JSON') + 15]) == prose
+    print(levels)
+
+# test()
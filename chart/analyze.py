@@ -1,28 +1,42 @@
 import pandas as pd
 from datetime import datetime, timedelta
 import logging
-from sqlalchemy import create_engine, Column, String, Float, DateTime, Integer, Text
+from sqlalchemy import create_engine, Column, String, Float, DateTime, Integer, Text, Index, and_, inspect, text
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
-from openai import OpenAI
+from sqlalchemy.orm import sessionmaker, scoped_session
 import base64
+import json
 import os
 import re
-from telegram_bot import send_message
+import sys
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from telegram_bot import send_message, send_photo_to_telegram, replace_photo_in_telegram, delete_from_telegram, StreamingMessage
 from credentials import openai_api_key
-from plot_chart import generate_chart_PNG_mpl_finance
+from plot_chart import generate_chart_PNG_mpl_finance, parse_support_resistance
 from dateutil.relativedelta import relativedelta
+from columnar_store import get_columnar_store
+from prompt_compaction import compact_prompt_data
+from change_detection import assess_change, MAX_ANALYSIS_AGE, FULL, BRIEF, SKIP
+from analysis_levels import LEVELS_INSTRUCTION, normalize_levels, split_levels, strip_levels
+# The shared llm package lives at the repository root
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from llm.gateway import get_gateway
+from llm.batch import OpenAIBatchTransport, batch_request, write_batch_file, FAILED_STATUSES
+from messaging.outbox import PRIORITY_SIGNAL, PRIORITY_ANALYSIS
 
 # Database setup
 DATABASE_URL = 'sqlite:///indicators.db'
 engine = create_engine(DATABASE_URL)
 Session = sessionmaker(bind=engine)
-session = Session()
+# One session per thread, the stages of the analysis pipeline read and write from their own threads
+session = scoped_session(Session)
 Base = declarative_base()
 
 # Models for database tables
 class HistoricalData(Base):
     __tablename__ = 'historical_data'
+    __table_args__ = (Index('uq_historical_data_symbol_interval_timestamp', 'symbol', 'interval', 'timestamp', unique=True),)
     id = Column(Integer, primary_key=True)
     symbol = Column(String)
     interval = Column(String)
@@ -35,6 +49,7 @@ class HistoricalData(Base):
 
 class Indicators(Base):
     __tablename__ = 'indicators'
+    __table_args__ = (Index('uq_indicators_symbol_interval_timestamp', 'symbol', 'interval', 'timestamp', unique=True),)
     id = Column(Integer, primary_key=True)
     symbol = Column(String)
     interval = Column(String)
@@ -93,27 +108,106 @@ class Analysis(Base):
     analysis = Column(Text)
     image = Column(Text)
 
+class AnalysisLevels(Base):
+    """Structured levels and signal of an analysis, read by charting and the change gate instead of parsing the text."""
+    __tablename__ = 'analysis_levels'
+    __table_args__ = (Index('uq_analysis_levels_symbol_interval_timestamp', 'symbol', 'interval', 'timestamp', unique=True),)
+    id = Column(Integer, primary_key=True)
+    analysis_id = Column(Integer, index=True)
+    symbol = Column(String)
+    interval = Column(String)
+    timestamp = Column(DateTime)
+    supports = Column(Text)  # JSON list of prices
+    resistances = Column(Text)  # JSON list of prices
+    direction = Column(String)
+    entry = Column(Float)
+    target = Column(Float)
+    stop_loss = Column(Float)
+    leverage = Column(Float)
+
+class AnalysisBatch(Base):
+    __tablename__ = 'analysis_batch'
+    id = Column(Integer, primary_key=True)
+    batch_id = Column(String, index=True)
+    jobs = Column(Text)  # JSON list of [symbol, precision, interval]
+    submitted_at = Column(DateTime)
+    completed_at = Column(DateTime)
+    status = Column(String)
+    published = Column(Text)  # JSON list of the "symbol:interval" jobs published so far
+    attempts = Column(Integer)  # collections that left jobs unpublished
+
 # Table creation
 Base.metadata.create_all(engine)
 
-# OpenAI Authentication 
-client = OpenAI(api_key=openai_api_key)
+def ensure_batch_columns(bind):
+    """Add the columns declared after analysis_batch was created, create_all does not alter existing tables."""
+    existing = {column['name'] for column in inspect(bind).get_columns(AnalysisBatch.__tablename__)}
+    with bind.begin() as connection:
+        for name in ('published', 'attempts'):
+            if name not in existing:
+                column_type = AnalysisBatch.__table__.c[name].type.compile(bind.dialect)
+                connection.execute(text(f"ALTER TABLE {AnalysisBatch.__tablename__} ADD COLUMN {name} {column_type}"))
+
+ensure_batch_columns(engine)
+
+# Read history from the columnar store instead of the database where it covers the range,
+# enabled with columnar_store.COLUMNAR_STORE_DIR
+columnar_store = get_columnar_store()
+
+# OpenAI Authentication, requests of all pairs share the gateway's concurrency and rate limits
+gateway = get_gateway(openai_api_key)
+
+# Batch API for analyses that are not urgent, swap in llm.batch.LocalBatchTransport to run without OpenAI
+batch_transport = OpenAIBatchTransport(openai_api_key)
+BATCH_DIRECTORY = 'batches'
+# Collections of a completed batch before jobs that keep failing to publish are given up
+BATCH_PUBLISH_ATTEMPTS = 5
+
+ANALYSIS_MODEL = "gpt-4o"
+# Post the chart and the text of interactive analyses while GPT is still writing, instead of after it finished
+STREAM_ANALYSES = True
+# Candles sent to GPT
+ANALYSIS_ROWS = 400
+# Candles and answer length of a brief update, requested when the market changed only a little since the last analysis
+BRIEF_ANALYSIS_ROWS = 100
+BRIEF_MAX_TOKENS = 800
+ANALYSIS_ERROR = "Error generating analysis."
+
+HISTORICAL_COLUMNS = ['open', 'high', 'low', 'close', 'volume']
+INDICATOR_COLUMNS = [column.name for column in Indicators.__table__.columns if column.name not in ('id', 'symbol', 'interval', 'timestamp')]
+
+# Columns each consumer reads besides the timestamp
+ANALYSIS_COLUMNS = ['symbol', 'interval'] + HISTORICAL_COLUMNS + INDICATOR_COLUMNS
+CHART_COLUMNS = HISTORICAL_COLUMNS + [
+    'ema_50', 'ema_200', 'bollinger_hband', 'bollinger_mband', 'bollinger_lband',
+    'rsi', 'macd', 'macd_signal', 'macd_diff',
+]
+
+def get_start_time(interval, end_time):
+    # Data period based on interval
+    if interval == '4h':
+        return end_time - timedelta(weeks=24)
+    elif interval == '1d':
+        return end_time - relativedelta(months=34)
+    elif interval == '15m':
+        return end_time - relativedelta(weeks=2)
+    raise ValueError(f"Unsupported interval: {interval}")
 
 # Function to fetch data to send to send to chatgpt 
 def fetch_data(symbol, interval):
     try:
         end_time = datetime.utcnow()
+        start_time = get_start_time(interval, end_time)
         
-        # Data period based on interval
-        if interval == '4h':
-            start_time = end_time - timedelta(weeks=24)
-        elif interval == '1d':
-            start_time = end_time - relativedelta(months=34)
-        elif interval == '15m':
-            start_time = end_time - relativedelta(weeks=2)
-        else:
-            raise ValueError(f"Unsupported interval: {interval}")
-        
+        if columnar_store is not None and columnar_store.covers(symbol, interval, start_time):
+            data = columnar_store.read(symbol, interval, start=start_time, end=end_time)
+            data.insert(0, 'interval', interval)
+            data.insert(0, 'symbol', symbol)
+            historical_columns = ['symbol', 'interval', 'timestamp', 'open', 'high', 'low', 'close', 'volume']
+            indicators_columns = ['symbol', 'interval', 'timestamp'] + [c for c in data.columns if c not in historical_columns]
+            logging.info(f"Read data for {symbol} at interval {interval} from {start_time} to {end_time} from the columnar store")
+            return data[historical_columns], data[indicators_columns]
+
         historical_query = session.query(HistoricalData).filter(
             HistoricalData.symbol == symbol,
             HistoricalData.interval == interval,
@@ -134,6 +228,63 @@ def fetch_data(symbol, interval):
         logging.error(f"Error fetching data from database: {e}", exc_info=True)
         return pd.DataFrame(), pd.DataFrame()
 
+def fetch_joined_data(symbol, interval, columns, limit=None, start_time=None):
+    """
+    Read candles joined with their indicators in a single query.
+
+    The join, the ordering and the row limit run in the database on the unique
+    (symbol, interval, timestamp) indexes of both tables, so only the returned rows are read.
+
+    Parameters:
+    columns (list): Columns of historical_data or indicators to return besides 'timestamp'.
+    limit (int): Return only the newest `limit` rows.
+    start_time (datetime): Return only rows at or after this timestamp.
+
+    Returns:
+    DataFrame: Rows sorted by timestamp, empty on error.
+    """
+    try:
+        data = None
+        if columnar_store is not None:
+            data = columnar_store.read(symbol, interval, start=start_time, columns=columns, tail=limit)
+            # Fewer rows than asked for may be history the store does not hold yet, SQLite has all of it
+            if not (columnar_store.covers(symbol, interval, start_time) or (limit is not None and len(data) >= limit)):
+                logging.info(f"Columnar store does not cover {symbol} at interval {interval} yet, reading SQLite")
+                data = None
+        if data is not None:
+            if 'interval' in columns:
+                data.insert(0, 'interval', interval)
+            if 'symbol' in columns:
+                data.insert(0, 'symbol', symbol)
+            return data[['timestamp'] + [c for c in columns if c in data.columns]]
+
+        historical = HistoricalData.__table__.c
+        indicators = Indicators.__table__.c
+        selected = [historical[c] if c in historical else indicators[c].label(c) for c in columns]
+        query = session.query(historical.timestamp, *selected).join(
+            Indicators.__table__,
+            and_(
+                indicators.symbol == historical.symbol,
+                indicators.interval == historical.interval,
+                indicators.timestamp == historical.timestamp,
+            )
+        ).filter(
+            historical.symbol == symbol,
+            historical.interval == interval
+        )
+        if start_time is not None:
+            query = query.filter(historical.timestamp >= start_time)
+        query = query.order_by(historical.timestamp.desc())
+        if limit is not None:
+            query = query.limit(limit)
+
+        data = pd.read_sql(query.statement, session.bind)
+        logging.info(f"Fetched {len(data)} joined rows for {symbol} at interval {interval}")
+        return data.iloc[::-1].reset_index(drop=True)
+    except Exception as e:
+        logging.error(f"Error fetching data from database: {e}", exc_info=True)
+        return pd.DataFrame()
+
 def merge_data(historical_data, indicators_data):
     try:
         data = pd.merge(historical_data, indicators_data, on=['symbol', 'interval', 'timestamp'])
@@ -144,16 +295,15 @@ def merge_data(historical_data, indicators_data):
         return pd.DataFrame()
 
 
-def generate_analysis(symbol, precision, interval, data:pd.DataFrame):
-    
-    # select last 400 rows
-    gpt_data = data.iloc[-400:]
+def build_analysis_messages(symbol, precision, interval, data:pd.DataFrame, brief_reasons=None):
+    # select last 400 rows, or 100 for a brief update
+    gpt_data = data.iloc[-(BRIEF_ANALYSIS_ROWS if brief_reasons is not None else ANALYSIS_ROWS):]
+    prompt_data, _ = compact_prompt_data(gpt_data, precision)
     
     pair_name = {"BTCUSDT":"بیت کوین","ETHUSDT":"اتریوم"}[symbol]
     
-    try:
-        # ChatGPT Response Template
-        template = f"_تحلیل ارز دیجیتال {pair_name} توسط یک هوش مصنوعی_" + """
+    # ChatGPT Response Template
+    template = f"_تحلیل ارز دیجیتال {pair_name} توسط یک هوش مصنوعی_" + """
 
         نماد: *{symbol}*
         بازه زمانی: *{interval}*
@@ -191,9 +341,9 @@ def generate_analysis(symbol, precision, interval, data:pd.DataFrame):
         *هشدار: این تحلیل های هوش مصنوعی است. تنها یک ابزار است 
 
         """
-        
-        # Message Prompt to ChatGPT
-        message = f"""
+    
+    # Message Prompt to ChatGPT
+    message = f"""
         Provide a technical analysis in Farsi for the following data using this template.
         use price action and smart money in your analysis and signals.
         use integer numbers only.
@@ -205,81 +355,458 @@ def generate_analysis(symbol, precision, interval, data:pd.DataFrame):
         {template}
 
         Data:
-        {gpt_data.to_csv(index=False, float_format=f'%.{precision}f')}
+        {prompt_data}
+        """ + LEVELS_INSTRUCTION
+
+    if brief_reasons is not None:
+        message += f"""
+        The market changed only a little since the last analysis ({'; '.join(brief_reasons) or 'no notable change'}).
+        Keep every section of the template to one short line and focus on what changed.
         """
 
+    return [
+        {"role": "system", "content": "You are a master of Crypto Technical Analysis."},
+        {"role": "user", "content": message}
+    ]
+
+def clean_analysis(analysis):
+    # Replace Hashtags
+    analysis = re.sub(r'#(\w+)', lambda m: '#' + m.group(1).replace('_', '\\_'), analysis)
+    
+    
+    analysis = analysis \
+        .replace('```','') \
+        .replace('***','*') \
+        .replace('**','*') \
+        .replace('___','_') \
+        .replace('__','_') \
+        .replace('  ',' ') \
+        .replace('  ',' ') \
+        .replace('  ',' ') \
+        .replace('  ',' ') \
+        .replace('  ',' ') \
+        .replace('  ',' ') \
+        .replace('  ',' ') \
+        .replace('  ',' ') \
+        .replace('  ',' ') \
+        .replace('<mark>','_') \
+        .replace('</mark>','_') \
+        .strip()
+    return analysis
+
+def parse_analysis(symbol, answer):
+    """
+    Split a GPT answer into the formatted analysis and its levels.
+    Answers without a valid levels line fall back to the levels found in the text.
+    """
+    prose, levels = split_levels(answer)
+    if levels is None:
+        logging.warning(f"No structured levels in the analysis of {symbol}, reading them from the text")
+        try:
+            supports, resistances = parse_support_resistance(prose)
+            levels = normalize_levels({'supports': supports, 'resistances': resistances})
+        except Exception as e:
+            logging.error(f"Error reading levels from the analysis of {symbol}: {e}", exc_info=True)
+    return format_analysis(symbol, prose), levels
+
+def format_analysis(symbol, analysis):
+    pair_name = {"BTCUSDT":"بیت کوین","ETHUSDT":"اتریوم"}[symbol]
+    analysis = clean_analysis(analysis)
+
+    analysis +="\n\n\n _با ما همراه باشید برای تحلیل‌های بیشتر!_"
+    analysis +="\n#ارز\\_دیجیتال #تحلیل\\_تکنیکال #" + pair_name.replace(' ','\\_')
+    return analysis
+
+def check_market_change(symbol, interval, data):
+    """
+    Compare the market with the state at the last stored analysis.
+
+    Returns:
+    str, list[str]: FULL, BRIEF or SKIP, and the changes that led to it.
+    """
+    try:
+        last = session.query(Analysis).filter(
+            Analysis.symbol == symbol,
+            Analysis.interval == interval,
+            Analysis.analysis != ANALYSIS_ERROR
+        ).order_by(Analysis.timestamp.desc()).first()
+        if last is None:
+            decision, reasons = FULL, ["no previous analysis"]
+        elif datetime.utcnow() - last.timestamp > MAX_ANALYSIS_AGE.get(interval, timedelta(days=1)):
+            decision, reasons = FULL, [f"last analysis is from {last.timestamp:%Y-%m-%d %H:%M}"]
+        else:
+            levels = load_levels(symbol, interval, last.timestamp)
+            if levels is None:
+                # Analyses stored before the levels table
+                supports, resistances = parse_support_resistance(last.analysis)
+                levels = {'supports': supports, 'resistances': resistances}
+            decision, score, reasons = assess_change(data, last.timestamp, levels['supports'] + levels['resistances'])
+            reasons = [f"score {score:.1f}"] + reasons
+    except Exception as e:
+        logging.error(f"Error checking market change of {symbol} at interval {interval}: {e}", exc_info=True)
+        decision, reasons = FULL, ["change check failed"]
+    logging.info(f"Market change of {symbol} at interval {interval}: {decision} analysis ({'; '.join(reasons)})")
+    return decision, reasons
+
+def analysis_request(symbol, precision, interval, data:pd.DataFrame):
+    """Messages and extra parameters of the GPT request, None when the market did not change enough for an analysis."""
+    decision, reasons = check_market_change(symbol, interval, data)
+    if decision == SKIP:
+        return None
+    if decision == BRIEF:
+        return build_analysis_messages(symbol, precision, interval, data, brief_reasons=reasons), {'max_tokens': BRIEF_MAX_TOKENS}
+    return build_analysis_messages(symbol, precision, interval, data), {}
+
+def generate_analysis(symbol, precision, interval, data:pd.DataFrame):
+    """Returns the formatted analysis and its levels, or None when the market did not change enough since the last one."""
+    try:
+        request = analysis_request(symbol, precision, interval, data)
+        if request is None:
+            return None
+        messages, params = request
         # Generate the main analysis using GPT-4o
-        completion = client.chat.completions.create(
-            model="gpt-4o",
-            messages=[
-                {"role": "system", "content": "You are a master of Crypto Technical Analysis."},
-                {"role": "user", "content": message}
-            ]
+        analysis = gateway.chat_sync(
+            model=ANALYSIS_MODEL,
+            messages=messages,
+            **params
         )
-        analysis = completion.choices[0].message.content
-        
-        # Replace Hashtags
-        analysis = re.sub(r'#(\w+)', lambda m: '#' + m.group(1).replace('_', '\\_'), analysis)
-        
-        
-        analysis = analysis \
-            .replace('```','') \
-            .replace('***','*') \
-            .replace('**','*') \
-            .replace('___','_') \
-            .replace('__','_') \
-            .replace('  ',' ') \
-            .replace('  ',' ') \
-            .replace('  ',' ') \
-            .replace('  ',' ') \
-            .replace('  ',' ') \
-            .replace('  ',' ') \
-            .replace('  ',' ') \
-            .replace('  ',' ') \
-            .replace('  ',' ') \
-            .replace('<mark>','_') \
-            .replace('</mark>','_') \
-            .strip()
-            
-        analysis +="\n\n\n _با ما همراه باشید برای تحلیل‌های بیشتر!_"
-        analysis +="\n#ارز\\_دیجیتال #تحلیل\\_تکنیکال #" + pair_name.replace(' ','\\_')
+        analysis, levels = parse_analysis(symbol, analysis)
 
         print(analysis)
         logging.info("Generated analysis using GPT-4o")
-        return analysis
+        return analysis, levels
     except Exception as e:
         logging.error(f"Error generating analysis with GPT-4o: {e}", exc_info=True)
-        return "Error generating analysis."
+        return ANALYSIS_ERROR, None
 
-def store_analysis(symbol, interval, analysis, image_file_name):
+def store_analysis(symbol, interval, analysis, image_file_name, levels=None):
     try:
+        timestamp = datetime.utcnow()
         analysis_record = Analysis(
             symbol=symbol,
             interval=interval,
-            timestamp=datetime.utcnow(),
+            timestamp=timestamp,
             analysis=analysis,
             image=image_file_name
         )
         session.add(analysis_record)
+        if levels is not None:
+            session.flush()
+            session.add(AnalysisLevels(
+                analysis_id=analysis_record.id,
+                symbol=symbol,
+                interval=interval,
+                timestamp=timestamp,
+                supports=json.dumps(levels['supports']),
+                resistances=json.dumps(levels['resistances']),
+                direction=levels['direction'],
+                entry=levels['entry'],
+                target=levels['target'],
+                stop_loss=levels['stop_loss'],
+                leverage=levels['leverage']
+            ))
         session.commit()
         logging.info(f"Stored analysis for {symbol} at interval {interval} in database")
     except Exception as e:
+        session.rollback()
         logging.error(f"Error storing analysis in database: {e}", exc_info=True)
 
-def main(symbols, intervals):
+def load_levels(symbol, interval, timestamp=None):
+    """Levels of the analysis stored at `timestamp`, or of the latest one, None when there are none."""
+    query = session.query(AnalysisLevels).filter(AnalysisLevels.symbol == symbol, AnalysisLevels.interval == interval)
+    if timestamp is not None:
+        query = query.filter(AnalysisLevels.timestamp == timestamp)
+    record = query.order_by(AnalysisLevels.timestamp.desc()).first()
+    if record is None:
+        return None
+    return {
+        'supports': json.loads(record.supports),
+        'resistances': json.loads(record.resistances),
+        'direction': record.direction,
+        'entry': record.entry,
+        'target': record.target,
+        'stop_loss': record.stop_loss,
+        'leverage': record.leverage,
+    }
+
+def render_analysis_chart(symbol, interval, analysis, levels=None):
+    # Support and resistance zones are searched over the whole period, the chart only needs its own columns
+    chart_data = fetch_joined_data(symbol, interval, CHART_COLUMNS, start_time=get_start_time(interval, datetime.utcnow()))
+    return generate_chart_PNG_mpl_finance(symbol,'BINANCE',interval,analysis,chart_data,levels=levels)
+
+def send_analysis(symbol, interval, analysis, image_file_name, levels=None):
+    store_analysis(symbol, interval, analysis, image_file_name, levels)
+
+    # Sending chatgpt response to Telegram channel, analyses with a trade go ahead of the others
+    logging.info(f"Sending analysis to Telegram for {symbol}")
+    signal = levels is not None and levels.get('direction', 'none') != 'none'
+    send_message(analysis, symbol, interval, image_file_name, PRIORITY_SIGNAL if signal else PRIORITY_ANALYSIS)
+
+    print("Technical Analysis Done:")
+
+def publish_analysis(symbol, interval, analysis, levels=None):
+    send_analysis(symbol, interval, analysis, render_analysis_chart(symbol, interval, analysis, levels), levels)
+
+async def stream_analysis(symbol, precision, interval, data):
+    """
+    Generate an analysis and publish it while it is generated.
+
+    The chart goes out first without levels and the text follows as a reply that grows with the GPT stream.
+    Once the answer is complete the text is formatted and the chart is redrawn with the levels of the analysis.
+    When the stream fails, what was posted of it is deleted and the analysis is made without streaming.
+    """
+    generation = None
+    message = StreamingMessage()
+    photo_id = None
+    try:
+        request = analysis_request(symbol, precision, interval, data)
+        if request is None:
+            return
+        messages, params = request
+        chart_data = fetch_joined_data(symbol, interval, CHART_COLUMNS, start_time=get_start_time(interval, datetime.utcnow()))
+        photo_posted = asyncio.Event()
+        parts = []
+
+        async def generate():
+            async for delta in gateway.chat_stream(model=ANALYSIS_MODEL, messages=messages, **params):
+                parts.append(delta)
+                if photo_posted.is_set():
+                    await message.update(clean_analysis(strip_levels("".join(parts))))
+
+        generation = asyncio.create_task(generate())
+        # Drawn in the chart pool, waited for off the loop so the streams keep flowing
+        image_file_name = await asyncio.to_thread(generate_chart_PNG_mpl_finance, symbol, 'BINANCE', interval, "", chart_data)
+        photo_id = message.reply_to_message_id = await send_photo_to_telegram(symbol, interval, image_file_name)
+        photo_posted.set()
+
+        await generation
+        analysis, levels = parse_analysis(symbol, "".join(parts))
+        print(analysis)
+        logging.info("Generated analysis using GPT-4o")
+        await message.finish(analysis)
+    except Exception as e:
+        logging.error(f"Error streaming analysis of {symbol} at interval {interval}: {e}", exc_info=True)
+        if generation is not None and not generation.done():
+            generation.cancel()
+        # No chart without levels and no half-written reply stays in the channel
+        await delete_from_telegram(([photo_id] if photo_id is not None else []) + message.message_ids)
+        await asyncio.to_thread(publish_fallback, symbol, precision, interval, data)
+        return
+
+    try:
+        image_file_name = await asyncio.to_thread(generate_chart_PNG_mpl_finance, symbol, 'BINANCE', interval, analysis, chart_data, levels)
+        await replace_photo_in_telegram(photo_id, symbol, interval, image_file_name)
+    except Exception as e:
+        # The analysis is complete, it stays with the chart without levels
+        logging.error(f"Error replacing the chart of {symbol} at interval {interval}: {e}", exc_info=True)
+    store_analysis(symbol, interval, analysis, image_file_name, levels)
+    print("Technical Analysis Done:")
+
+def publish_fallback(symbol, precision, interval, data):
+    """Make and publish an analysis without streaming, after the streamed one failed."""
+    try:
+        result = generate_analysis(symbol, precision, interval, data)
+        if result is None or result[0] == ANALYSIS_ERROR:
+            return
+        publish_analysis(symbol, interval, *result)
+    except Exception as e:
+        logging.error(f"Error publishing analysis of {symbol} at interval {interval}: {e}", exc_info=True)
+
+async def stream_analyses(jobs):
+    await asyncio.gather(*[stream_analysis(*job) for job in jobs])
+
+def main(symbols, intervals, stream=None):
+    stream = STREAM_ANALYSES if stream is None else stream
+    jobs = []
+    for symbol, precision in symbols:
+        for interval in intervals:
+            data = fetch_joined_data(symbol, interval, ANALYSIS_COLUMNS, limit=ANALYSIS_ROWS)
+            if not data.empty:
+                jobs.append((symbol, precision, interval, data))
+
+    if stream:
+        asyncio.run(stream_analyses(jobs))
+        return
+
+    # The GPT requests of all pairs run concurrently, the database session stays on this thread
+    with ThreadPoolExecutor(max_workers=max(1, len(jobs))) as executor:
+        analyses = list(executor.map(lambda job: generate_analysis(*job), jobs))
+
+    for (symbol, precision, interval, data), result in zip(jobs, analyses):
+        if result is not None:
+            publish_analysis(symbol, interval, *result)
+
+def submit_analysis_batch(symbols, intervals, transport=None):
+    """
+    Submit the analyses of all (symbol, interval) pairs as one batch job instead of interactive requests.
+    collect_analysis_batches publishes them once the batch has completed.
+    """
+    transport = transport or batch_transport
+    jobs = []
+    requests = []
     for symbol, precision in symbols:
         for interval in intervals:
-            historical_data, indicators_data = fetch_data(symbol, interval)
-            if not historical_data.empty and not indicators_data.empty:
-                data = merge_data(historical_data, indicators_data)
-                analysis = generate_analysis(symbol, precision, interval, data)
-                
-                image_file_name = generate_chart_PNG_mpl_finance(symbol,'BINANCE',interval,analysis,data)
-                
-                store_analysis(symbol, interval, analysis, image_file_name)
-
-                # Sending chatgpt response to Telegram channel 
-                logging.info(f"Sending analysis to Telegram for {symbol}")
-                send_message(analysis, symbol, interval, image_file_name)
-
-                print("Technical Analysis Done:")
+            data = fetch_joined_data(symbol, interval, ANALYSIS_COLUMNS, limit=ANALYSIS_ROWS)
+            request = analysis_request(symbol, precision, interval, data) if not data.empty else None
+            if request is None:
+                continue
+            messages, params = request
+            jobs.append([symbol, precision, interval])
+            requests.append(batch_request(f"{symbol}:{interval}", ANALYSIS_MODEL, messages, **params))
+    if not requests:
+        return None
+
+    try:
+        os.makedirs(BATCH_DIRECTORY, exist_ok=True)
+        path = os.path.join(BATCH_DIRECTORY, f"analysis_{datetime.utcnow():%Y%m%d_%H%M%S}.jsonl")
+        write_batch_file(path, requests)
+        batch_id = transport.submit(path)
+        session.add(AnalysisBatch(batch_id=batch_id, jobs=json.dumps(jobs), submitted_at=datetime.utcnow(), status='submitted'))
+        session.commit()
+        logging.info(f"Submitted analysis batch {batch_id} for {len(jobs)} pairs")
+        return batch_id
+    except Exception as e:
+        session.rollback()
+        logging.error(f"Error submitting analysis batch: {e}", exc_info=True)
+        return None
+
+def collect_analysis_batches(transport=None):
+    """Publish the analyses of completed batches, to be called periodically."""
+    transport = transport or batch_transport
+    pending = session.query(AnalysisBatch).filter(AnalysisBatch.completed_at.is_(None)).all()
+    for batch in pending:
+        try:
+            status = transport.status(batch.batch_id)
+            if status in FAILED_STATUSES:
+                logging.error(f"Analysis batch {batch.batch_id} ended with status {status}")
+            elif status != 'completed':
+                continue
+            else:
+                results = transport.results(batch.batch_id)
+                published = set(json.loads(batch.published or '[]'))
+                failed = 0
+                for symbol, precision, interval in json.loads(batch.jobs):
+                    key = f"{symbol}:{interval}"
+                    if key in published:
+                        continue
+                    analysis = results.get(key)
+                    if analysis is None:
+                        logging.error(f"No analysis for {symbol} at interval {interval} in batch {batch.batch_id}")
+                        continue
+                    try:
+                        publish_analysis(symbol, interval, *parse_analysis(symbol, analysis))
+                    except Exception as e:
+                        session.rollback()
+                        failed += 1
+                        logging.error(f"Error publishing {symbol} at interval {interval} of batch {batch.batch_id}: {e}", exc_info=True)
+                        continue
+                    # Recorded at once, so a later failure never publishes this job again
+                    published.add(key)
+                    batch.published = json.dumps(sorted(published))
+                    session.commit()
+                if failed:
+                    batch.attempts = (batch.attempts or 0) + 1
+                    if batch.attempts < BATCH_PUBLISH_ATTEMPTS:
+                        # Only the failed jobs are published again on the next collection
+                        session.commit()
+                        continue
+                    logging.error(f"Giving up on {failed} jobs of batch {batch.batch_id} after {batch.attempts} collections")
+            batch.status = status
+            batch.completed_at = datetime.utcnow()
+            session.commit()
+        except Exception as e:
+            session.rollback()
+            logging.error(f"Error collecting analysis batch {batch.batch_id}: {e}", exc_info=True)
+
+def test_stream_failure(image_file_name='stream_failure_test.png'):
+    """
+    A GPT stream that fails after the chart and part of the text were posted to a local stand-in for the Bot API:
+    both are deleted again and the analysis is published without streaming.
+    """
+    import threading
+    import time
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+    import telegram_bot
+    from messaging import outbox
+    from messaging.sender import TelegramSender
+
+    calls = []
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def do_POST(self):
+            if self.headers['Content-Length']:
+                self.rfile.read(int(self.headers['Content-Length']))
+            else:
+                # Photo uploads are chunked
+                while (size := int(self.rfile.readline().strip(), 16)):
+                    self.rfile.read(size + 2)
+                self.rfile.readline()
+            calls.append(self.path.rsplit('/', 1)[-1])
+            result = True if calls[-1] == 'deleteMessage' else {
+                'message_id': len(calls), 'date': int(time.time()), 'chat': {'id': -100, 'type': 'channel'}, 'text': 'ok'}
+            body = json.dumps({'ok': True, 'result': result}).encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    class FailingGateway:
+        async def chat_stream(self, **params):
+            yield "BTC is ranging "
+            # Fails once part of the text is shown, the chart may take a while through the outbox
+            for _ in range(100):
+                if 'sendMessage' in calls:
+                    break
+                yield " "
+                await asyncio.sleep(0.1)
+            raise ConnectionError("stream interrupted")
+
+        def chat_sync(self, **params):
+            return "BTC is ranging between 60000 and 62000."
+
+    published = []
+    module = sys.modules[__name__]
+    replaced = {
+        'gateway': FailingGateway(),
+        'analysis_request': lambda *args: ([{'role': 'user', 'content': 'analyze'}], {}),
+        'fetch_joined_data': lambda *args, **kwargs: pd.DataFrame(),
+        'generate_chart_PNG_mpl_finance': lambda *args: image_file_name,
+        'publish_analysis': lambda symbol, interval, analysis, levels=None: published.append((symbol, interval, analysis)),
+    }
+    originals = {name: getattr(module, name) for name in replaced}
+    original_sender = telegram_bot.sender
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        with open(image_file_name, 'wb') as f:
+            f.write(b'\x89PNG\r\n\x1a\nchart')
+        for name, value in replaced.items():
+            setattr(module, name, value)
+        telegram_bot.sender = TelegramSender('123456:test', api_url=f"http://127.0.0.1:{server.server_port}")
+        # The chart goes through the outbox
+        outbox._outbox = outbox.Outbox('sqlite:///stream_failure_test.db')
+
+        asyncio.run(stream_analysis('BTCUSDT', 0, '4h', pd.DataFrame()))
+        assert calls == ['sendPhoto', 'sendMessage', 'deleteMessage', 'deleteMessage'], calls
+        assert len(published) == 1 and published[0][2].startswith("BTC is ranging between 60000 and 62000."), published
+        print(f"Failed stream: {calls}, then published without streaming")
+    finally:
+        telegram_bot.sender.close()
+        telegram_bot.sender = original_sender
+        for name, value in originals.items():
+            setattr(module, name, value)
+        server.shutdown()
+        os.unlink(image_file_name)
+        if outbox._outbox is not None:
+            outbox._outbox.engine.dispose()
+            outbox._outbox = None
+        if os.path.exists('stream_failure_test.db'):
+            os.unlink('stream_failure_test.db')
+
+# test_stream_failure()
@@ -0,0 +1,195 @@
+from datetime import timedelta
+
+import numpy as np
+import pandas as pd
+
+from prompt_compaction import EVENT_COLUMNS
+
+# Decide whether the market changed enough since the last analysis to ask GPT for a new one.
+# The state when the last analysis was made is read from the same candles and indicators as the
+# current state (the candle that was open at that time), so nothing extra has to be stored.
+# Changes are scored, roughly one point per notable change:
+#   - the price move since then, in ATRs
+#   - flips of indicator regimes (trend, EMA 50/200, MACD, RSI, Stochastic, Bollinger)
+#   - kinds of pattern or EMA cross events detected since then that the last analysis had not seen yet,
+#     kinds that fire on many candles (fair value gaps) count little or not at all
+#   - support and resistance levels of the last analysis that the price crossed
+# Below SKIP_THRESHOLD no analysis is made, below FULL_THRESHOLD a brief update is requested.
+
+SKIP_THRESHOLD = 1.0
+FULL_THRESHOLD = 2.5
+
+MOVE_WEIGHT = 1.0  # per ATR
+REGIME_WEIGHT = 1.0
+EVENT_WEIGHT = 1.0
+LEVEL_WEIGHT = 2.0
+# Fair value gaps are flagged on most candles of a steady trend
+EVENT_WEIGHTS = {'fvg_pattern': 0.25}
+# Candles before the last analysis whose events it already saw
+EVENT_MEMORY = 10
+# Event kinds flagged on a larger share of the candles before the last analysis are noise there
+MAX_EVENT_RATE = 0.2
+
+# A full analysis is made anyway once the last one is this old
+MAX_ANALYSIS_AGE = {
+    '15m': timedelta(hours=12),
+    '4h': timedelta(days=2),
+    '1d': timedelta(days=7),
+}
+
+FULL = 'full'
+BRIEF = 'brief'
+SKIP = 'skip'
+
+def _zone(value, low, high, names=('low', 'neutral', 'high')):
+    if value is None or pd.isna(value) or pd.isna(low) or pd.isna(high):
+        return None
+    return names[0] if value < low else names[2] if value > high else names[1]
+
+def market_regimes(row):
+    """Discrete state of the main indicators of one candle, None where an indicator is missing."""
+    get = lambda column: row.get(column, np.nan)
+    above = lambda a, b: None if pd.isna(get(a)) or pd.isna(get(b)) else bool(get(a) > get(b))
+    return {
+        'close_above_ema_200': above('close', 'ema_200'),
+        'ema_50_above_ema_200': above('ema_50', 'ema_200'),
+        'macd_above_signal': above('macd', 'macd_signal'),
+        'rsi': _zone(get('rsi'), 30, 70, ('oversold', 'neutral', 'overbought')),
+        'stoch': _zone(get('stoch_k'), 20, 80, ('oversold', 'neutral', 'overbought')),
+        'bollinger': _zone(get('close'), get('bollinger_lband'), get('bollinger_hband'), ('below', 'inside', 'above')),
+    }
+
+def new_events(data, since):
+    """
+    Event kinds flagged since `since` that were not flagged (with the same value, e.g. the same cross
+    direction) in the EVENT_MEMORY candles up to it, and are not flagged on most candles anyway.
+
+    Returns:
+    dict: Event column -> number of candles flagged since `since`.
+    """
+    before = data[data['timestamp'] <= pd.Timestamp(since)]
+    newer = data[data['timestamp'] > pd.Timestamp(since)]
+    events = {}
+    for column in [c for c in EVENT_COLUMNS if c in data.columns]:
+        values = pd.to_numeric(newer[column], errors='coerce').fillna(0)
+        history = pd.to_numeric(before[column], errors='coerce').fillna(0)
+        if len(history) and (history != 0).mean() > MAX_EVENT_RATE:
+            continue
+        seen = set(history.tail(EVENT_MEMORY)[history.tail(EVENT_MEMORY) != 0])
+        fresh = values[(values != 0) & ~values.isin(seen)]
+        if len(fresh):
+            events[column] = len(fresh)
+    return events
+
+def assess_change(data, since, levels=(), skip_threshold=SKIP_THRESHOLD, full_threshold=FULL_THRESHOLD):
+    """
+    Score the change of the market since the last analysis.
+
+    Parameters:
+    data (DataFrame): Candles and indicators, oldest first.
+    since (datetime): Time of the last analysis.
+    levels (list[float]): Support and resistance levels of the last analysis.
+
+    Returns:
+    str, float, list[str]: FULL, BRIEF or SKIP, the score and the changes that contributed to it.
+    """
+    previous = data[data['timestamp'] <= pd.Timestamp(since)]
+    if previous.empty:
+        return FULL, float('inf'), ["last analysis is older than the data"]
+    previous = previous.iloc[-1]
+    current = data.iloc[-1]
+
+    score = 0.0
+    reasons = []
+
+    atr = previous.get('atr', np.nan)
+    if not pd.isna(atr) and atr > 0:
+        move = abs(current['close'] - previous['close']) / atr
+        score += MOVE_WEIGHT * move
+        if move >= 0.1:
+            reasons.append(f"price moved {move:.1f} ATR")
+
+    before, after = market_regimes(previous), market_regimes(current)
+    for name in before:
+        if before[name] is not None and after[name] is not None and before[name] != after[name]:
+            score += REGIME_WEIGHT
+            reasons.append(f"{name} {before[name]} -> {after[name]}")
+
+    # Detectors flag several candles of one formation, so each kind of event counts once
+    for column, events in new_events(data, previous['timestamp']).items():
+        score += EVENT_WEIGHTS.get(column, EVENT_WEIGHT)
+        reasons.append(f"new {column} ({events})")
+
+    low, high = sorted((previous['close'], current['close']))
+    for level in levels:
+        if low < level < high:
+            score += LEVEL_WEIGHT
+            reasons.append(f"{'broke above' if current['close'] > level else 'broke below'} {level:g}")
+
+    decision = SKIP if score < skip_threshold else BRIEF if score < full_threshold else FULL
+    return decision, score, reasons
+
+def test():
+    """A flat market is skipped, a small move gets a brief update, a level break a full analysis."""
+    timestamps = pd.date_range('2024-05-01', periods=50, freq='4h')
+    data = pd.DataFrame({
+        'timestamp': timestamps, 'close': 100.0, 'atr': 2.0, 'ema_50': 95.0, 'ema_200': 90.0,
+        'macd': 1.0, 'macd_signal': 0.5, 'rsi': 55.0, 'stoch_k': 50.0,
+        'bollinger_lband': 96.0, 'bollinger_hband': 104.0, 'fvg_pattern': 0,
+    })
+    since = timestamps[40]
+    assert assess_change(data, since)[0] == SKIP
+
+    data.loc[45:, 'close'] = 103.0
+    decision, score, reasons = assess_change(data, since)
+    assert decision == BRIEF, (decision, score, reasons)
+
+    decision, score, reasons = assess_change(data, since, levels=[102.0])
+    assert decision == FULL, (decision, score, reasons)
+    print(f"{decision} at score {score:.1f}: {', '.join(reasons)}")
+
+    # A double top that the last analysis had not seen counts, one it saw does not
+    data.loc[45:, 'close'] = 100.0
+    data['double_top_pattern'] = 0
+    data.loc[47, 'double_top_pattern'] = 1
+    assert new_events(data, since) == {'double_top_pattern': 1}
+    data.loc[38, 'double_top_pattern'] = 1
+    assert new_events(data, since) == {}
+
+    test_quiet_market()
+
+def test_quiet_market(candles=300, seed=7):
+    """
+    A slow trend with small noise, indicators and patterns computed as for the stored data:
+    fair value gaps are flagged on many candles since the last analysis, and the analysis is still skipped.
+    """
+    from indicators import detect_ema_cross
+    from patterns import detect_fvg, detect_double_top, detect_double_bottom, detect_triangle, detect_wedge
+
+    rng = np.random.default_rng(seed)
+    close = 100 + 0.02 * np.arange(candles) + rng.normal(0, 0.05, candles).cumsum() * 0.2
+    data = pd.DataFrame({
+        'timestamp': pd.date_range('2024-01-01', periods=candles, freq='4h'),
+        'open': np.r_[close[0], close[:-1]], 'close': close,
+        'high': close + rng.uniform(0.05, 0.15, candles), 'low': close - rng.uniform(0.05, 0.15, candles),
+    })
+    true_range = np.maximum(data['high'], data['close'].shift()) - np.minimum(data['low'], data['close'].shift())
+    data['atr'] = true_range.ewm(alpha=1 / 14).mean()
+    for span in (25, 50, 100, 200):
+        data[f'ema_{span}'] = data['close'].ewm(span=span).mean()
+    data['macd'] = data['close'].ewm(span=12).mean() - data['close'].ewm(span=26).mean()
+    data['macd_signal'] = data['macd'].ewm(span=9).mean()
+    for short, long in ((25, 50), (50, 200)):
+        data[f'ema_{short}_cross_ema_{long}'] = detect_ema_cross(data[f'ema_{short}'], data[f'ema_{long}'])
+    for column, detect in (('fvg_pattern', detect_fvg), ('double_top_pattern', detect_double_top),
+                           ('double_bottom_pattern', detect_double_bottom), ('triangle_pattern', detect_triangle),
+                           ('wedge_pattern', detect_wedge)):
+        data[column] = detect(data)
+
+    since = data['timestamp'].iloc[-7]
+    assert data['fvg_pattern'].iloc[-6:].sum() >= 3, data['fvg_pattern'].iloc[-6:]
+    decision, score, reasons = assess_change(data, since)
+    assert decision == SKIP, (decision, score, reasons)
+    print(f"quiet market: {decision} at score {score:.2f} ({', '.join(reasons) or 'no changes'})")
+
+# test()
@@ -0,0 +1,213 @@
+import hashlib
+import json
+import logging
+import os
+import random
+import threading
+import time
+
+import requests
+
+# Client for the chart-img.com TradingView chart API.
+# One keep-alive session is shared by all callers, every request has a connect and a read timeout, and
+# failed requests are retried a bounded number of times, so a hung API call cannot freeze the scheduler.
+# Rendered PNGs are cached on disk under the SHA-256 of the request template: the same symbol, interval
+# and drawings within CACHE_TTL are served from the cache without calling the API.
+
+CHART_IMG_API_URL = 'https://api.chart-img.com'
+ADVANCED_CHART_PATH = '/v2/tradingview/advanced-chart'
+CACHE_DIRECTORY = os.path.join('charts', 'chart_img_cache')
+CACHE_TTL = 15 * 60
+# Seconds to connect, and to wait for each read of the response
+TIMEOUT = (5, 30)
+
+def _json_default(value):
+    # Timestamps of the drawings, in the ISO format of the API
+    if hasattr(value, 'isoformat'):
+        return value.isoformat()
+    return str(value)
+
+def render_template(template):
+    """The request body of a template, identical for equal templates regardless of key order."""
+    return json.dumps(template, sort_keys=True, default=_json_default)
+
+class ChartImgClient:
+    """
+    Render charts with chart-img.com.
+
+    Requests that fail with a connection error, a timeout, 429 or 5xx are retried up to `max_retries` times
+    with jittered exponential backoff (or the Retry-After of the API). Hit and miss counts of the response
+    cache are kept in `hits` and `misses`.
+    """
+
+    base_url: str
+    timeout: tuple
+    max_retries: int
+    cache_directory: str
+    cache_ttl: float
+
+    def __init__(self, api_key, base_url=CHART_IMG_API_URL, timeout=TIMEOUT, max_retries=3,
+                 cache_directory=CACHE_DIRECTORY, cache_ttl=CACHE_TTL, pool_size=4):
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.cache_directory = cache_directory
+        self.cache_ttl = cache_ttl
+        self.session = requests.Session()
+        self.session.headers.update({'x-api-key': api_key, 'content-type': 'application/json'})
+        adapter = requests.adapters.HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        if cache_directory:
+            os.makedirs(cache_directory, exist_ok=True)
+
+    def _cache_path(self, key):
+        return os.path.join(self.cache_directory, f"{key}.png")
+
+    def _cached(self, key):
+        if not self.cache_directory:
+            return None
+        path = self._cache_path(key)
+        try:
+            if time.time() - os.path.getmtime(path) >= self.cache_ttl:
+                os.unlink(path)
+                return None
+            with open(path, 'rb') as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def _store(self, key, content):
+        if not self.cache_directory:
+            return
+        # Written aside and renamed, so a concurrent reader never sees half an image
+        temporary = f"{self._cache_path(key)}.{threading.get_ident()}.tmp"
+        with open(temporary, 'wb') as f:
+            f.write(content)
+        os.replace(temporary, self._cache_path(key))
+        self._prune()
+
+    def _prune(self):
+        # Expired responses that are not requested again would otherwise stay forever
+        now = time.time()
+        for entry in os.scandir(self.cache_directory):
+            try:
+                if entry.name.endswith('.png') and now - entry.stat().st_mtime >= self.cache_ttl:
+                    os.unlink(entry.path)
+            except FileNotFoundError:
+                pass
+
+    def _post(self, path, body):
+        for attempt in range(self.max_retries + 1):
+            last = attempt == self.max_retries
+            delay = min(30, 2 ** attempt) + random.uniform(0, 1)
+            try:
+                response = self.session.post(f"{self.base_url}{path}", data=body, timeout=self.timeout)
+            except requests.RequestException as e:
+                if last:
+                    raise
+                logging.warning(f"chart-img request failed ({type(e).__name__}: {e}), retrying in {delay:.1f}s")
+                time.sleep(delay)
+                continue
+
+            if (response.status_code == 429 or response.status_code >= 500) and not last:
+                delay = max(delay, float(response.headers.get('Retry-After', 0)))
+                logging.warning(f"chart-img answered {response.status_code}, retrying in {delay:.1f}s")
+                time.sleep(delay)
+                continue
+
+            try:
+                response.raise_for_status()
+            except requests.HTTPError:
+                logging.error(f"API Error ({response.status_code}): {response.text}")
+                raise
+            return response.content
+
+    def advanced_chart(self, template):
+        """
+        Render a TradingView advanced chart.
+
+        Returns:
+        bytes: The PNG image, from the cache when the same template was rendered within `cache_ttl`.
+        """
+        body = render_template(template)
+        key = hashlib.sha256(body.encode('utf-8')).hexdigest()
+        content = self._cached(key)
+        with self.lock:
+            if content is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        if content is not None:
+            logging.info(f"Chart of {template.get('symbol')} at interval {template.get('interval')} served from the cache")
+            return content
+
+        content = self._post(ADVANCED_CHART_PATH, body)
+        self._store(key, content)
+        return content
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+def get_client(api_key, base_url=CHART_IMG_API_URL):
+    """Return the process-wide client for an API key, created on first use."""
+    with _clients_lock:
+        if (api_key, base_url) not in _clients:
+            _clients[(api_key, base_url)] = ChartImgClient(api_key, base_url)
+        return _clients[(api_key, base_url)]
+
+def test(directory='chart_img_test'):
+    """Render against a local stand-in for chart-img that hangs on the first request and fails the second."""
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    png = b'\x89PNG\r\n\x1a\nstand-in'
+    counter = {'requests': 0}
+    counter_lock = threading.Lock()
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+            with counter_lock:
+                counter['requests'] += 1
+                request = counter['requests']
+            if request == 1:
+                # Hangs past the read timeout of the client
+                time.sleep(2)
+                return
+            if request == 2:
+                self.send_response(503)
+                self.send_header('Retry-After', '0')
+                self.end_headers()
+                return
+            self.send_response(200)
+            self.send_header('Content-Type', 'image/png')
+            self.send_header('Content-Length', str(len(png)))
+            self.end_headers()
+            self.wfile.write(png)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        client = ChartImgClient('test', base_url=f"http://127.0.0.1:{server.server_port}", timeout=(1, 0.5), cache_directory=directory)
+        template = {'symbol': 'BINANCE:BTCUSDT', 'interval': '4h', 'drawings': [{'name': 'Rectangle', 'input': {'price': 60000.0}}]}
+
+        started = time.perf_counter()
+        assert client.advanced_chart(template) == png
+        elapsed = time.perf_counter() - started
+        assert counter['requests'] == 3, counter
+
+        # Same template with the keys in another order
+        reordered = {'drawings': template['drawings'], 'interval': '4h', 'symbol': 'BINANCE:BTCUSDT'}
+        assert client.advanced_chart(reordered) == png
+        assert counter['requests'] == 3 and client.hits == 1, (counter, client.hits)
+        print(f"Rendered after a timeout and a 503 in {elapsed:.1f}s, then served from the cache ({counter['requests']} HTTP calls)")
+    finally:
+        server.shutdown()
+
+# test()
@@ -0,0 +1,122 @@
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from fma_chart import CHART_ROWS, chart_payload, draw
+from image_encoding import encode_figure, CHART_FORMAT, CHART_TARGET_BYTES
+from worker_context import worker_context
+
+# Chart rendering in a pool of worker processes.
+# Each worker imports matplotlib with the Agg backend once and draws a warm-up chart, so the style, the fonts
+# and the figure template are ready before the first real chart. Charts travel to the workers as the NumPy
+# arrays of chart_payload (only the drawn candles and columns) and come back encoded by image_encoding,
+# straight from the canvas buffer without a file in between.
+
+# Charts drawn at the same time
+CHART_WORKERS = os.cpu_count()
+
+_pool = None
+_pool_workers = None
+# The chart stage of the pipeline asks for the pool from several threads
+_pool_lock = threading.Lock()
+
+def _init_worker():
+    # Loads the fonts and the mplfinance style, and builds the figure template of this process
+    encode_figure(draw('WARMUP', 'BINANCE', '4h', _sample_payload(), []))
+
+def get_pool(max_workers=None):
+    """Return the process pool, started once and kept warm between runs."""
+    global _pool, _pool_workers
+    max_workers = max_workers or CHART_WORKERS
+    with _pool_lock:
+        if _pool is None or _pool_workers != max_workers:
+            shutdown_pool()
+            # Workers come from a fork server that imports only the worker modules, see worker_context
+            _pool = ProcessPoolExecutor(max_workers=max_workers, initializer=_init_worker, mp_context=worker_context())
+            _pool_workers = max_workers
+        return _pool
+
+def shutdown_pool():
+    global _pool, _pool_workers
+    if _pool is not None:
+        _pool.shutdown()
+        _pool = None
+        _pool_workers = None
+
+def _warm(_):
+    return os.getpid()
+
+def _render(job):
+    symbol, exchange, interval, payload, areas, format, target_bytes = job
+    started = time.perf_counter()
+    figure = draw(symbol, exchange, interval, payload, areas)
+    drawn = time.perf_counter()
+    content, info = encode_figure(figure, format, target_bytes)
+    info['draw_time'] = drawn - started
+    return content, info
+
+def submit_chart(symbol, exchange, interval, data, support_resistance_areas, max_workers=None,
+                 format=CHART_FORMAT, target_bytes=CHART_TARGET_BYTES):
+    """
+    Draw a chart like fma_chart.fig in the pool.
+
+    Returns:
+    Future: resolves to (image bytes, info of encode_image with the seconds spent drawing as `draw_time`).
+    """
+    job = (symbol, exchange, interval, chart_payload(data), support_resistance_areas, format, target_bytes)
+    return get_pool(max_workers).submit(_render, job)
+
+def render_chart(symbol, exchange, interval, data, support_resistance_areas, max_workers=None,
+                 format=CHART_FORMAT, target_bytes=CHART_TARGET_BYTES):
+    """Draw a chart in the pool and wait for it, returns the image bytes and their info."""
+    content, info = submit_chart(symbol, exchange, interval, data, support_resistance_areas, max_workers, format, target_bytes).result()
+    logging.info(f"Rendered chart of {symbol} at interval {interval} in {info['draw_time']:.2f}s, "
+                 f"{info['bytes']} bytes as {info['format']} encoded in {info['encode_time']:.2f}s")
+    return content, info
+
+def _sample_payload(rows=CHART_ROWS, seed=0):
+    rng = np.random.default_rng(seed)
+    close = 100 + np.cumsum(rng.normal(0, 1, rows))
+    data = pd.DataFrame({
+        'timestamp': pd.date_range('2024-01-01', periods=rows, freq='4h'),
+        'open': np.concatenate([[close[0]], close[:-1]]),
+        'close': close,
+        'volume': rng.uniform(10, 1000, rows),
+        'rsi': rng.uniform(20, 80, rows),
+        'macd': rng.normal(0, 1, rows),
+        'macd_signal': rng.normal(0, 1, rows),
+        'macd_diff': rng.normal(0, 1, rows),
+    })
+    data['high'] = data[['open', 'close']].max(axis=1) + 0.5
+    data['low'] = data[['open', 'close']].min(axis=1) - 0.5
+    for column in ['ema_50', 'ema_200', 'bollinger_mband']:
+        data[column] = close
+    data['bollinger_hband'] = close + 2
+    data['bollinger_lband'] = close - 2
+    return chart_payload(data, rows)
+
+def benchmark(charts=16, max_workers=None):
+    """Charts per second drawn one after the other in this process and in the warm pool."""
+    payloads = [_sample_payload(seed=i) for i in range(charts)]
+
+    started = time.perf_counter()
+    for i, payload in enumerate(payloads):
+        _render((f"SYM{i}USDT", 'BINANCE', '4h', payload, [], CHART_FORMAT, CHART_TARGET_BYTES))
+    serial = time.perf_counter() - started
+
+    pool = get_pool(max_workers)
+    # Exclude worker start-up and warm-up from the measurement
+    list(pool.map(_warm, range(_pool_workers)))
+    started = time.perf_counter()
+    jobs = [(f"SYM{i}USDT", 'BINANCE', '4h', payload, [], CHART_FORMAT, CHART_TARGET_BYTES) for i, payload in enumerate(payloads)]
+    list(pool.map(_render, jobs))
+    parallel = time.perf_counter() - started
+    print(f"{charts} charts: serial {charts / serial:.1f} charts/s, pool {charts / parallel:.1f} charts/s on {_pool_workers} workers")
+
+if __name__ == "__main__":
+    benchmark()
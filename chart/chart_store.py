@@ -0,0 +1,197 @@
+import hashlib
+import logging
+import os
+import threading
+from datetime import datetime, timedelta
+
+from sqlalchemy import create_engine, Column, String, Integer, DateTime, Index, func, select
+from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.orm import sessionmaker
+
+# Content-addressed store of rendered charts.
+# A chart is saved once under the SHA-256 of its bytes (identical renders share one file), and an index maps
+# (symbol, interval, timestamp) to the blob. Entries older than `max_age` are dropped, and when the blobs
+# exceed `max_bytes` the least recently used ones are evicted with their entries, so the directory stays bounded.
+
+STORE_DIRECTORY = os.path.join('charts', 'store')
+DEFAULT_MAX_AGE = timedelta(days=30)
+DEFAULT_MAX_BYTES = 500 * 1024 * 1024
+
+Base = declarative_base()
+
+class ChartBlob(Base):
+    __tablename__ = 'chart_blob'
+    __table_args__ = (Index('ix_chart_blob_last_used_at', 'last_used_at'),)
+    hash = Column(String, primary_key=True)
+    path = Column(String)
+    size = Column(Integer)
+    created_at = Column(DateTime)
+    last_used_at = Column(DateTime)
+
+class ChartEntry(Base):
+    __tablename__ = 'chart_entry'
+    __table_args__ = (Index('ix_chart_entry_symbol_interval_timestamp', 'symbol', 'interval', 'timestamp'),)
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    symbol = Column(String)
+    interval = Column(String)
+    timestamp = Column(DateTime)
+    hash = Column(String, index=True)
+
+class ChartStore:
+    """
+    Chart files under `directory/blobs`, indexed in `directory/index.db`.
+
+    `put` returns the path of the blob, which stays valid until the blob is evicted.
+    """
+
+    max_age: timedelta
+    max_bytes: int
+
+    def __init__(self, directory=STORE_DIRECTORY, max_age=DEFAULT_MAX_AGE, max_bytes=DEFAULT_MAX_BYTES):
+        self.directory = directory
+        self.max_age = max_age
+        self.max_bytes = max_bytes
+        os.makedirs(os.path.join(directory, 'blobs'), exist_ok=True)
+        self.engine = create_engine('sqlite:///' + os.path.join(directory, 'index.db'))
+        Base.metadata.create_all(self.engine)
+        self.Session = sessionmaker(bind=self.engine)
+        # Charts are stored from several pipeline threads
+        self.lock = threading.Lock()
+
+    def _blob_path(self, digest, extension):
+        # Two levels keep the directories small
+        return os.path.join(self.directory, 'blobs', digest[:2], f"{digest}.{extension}")
+
+    def _write(self, path, content):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temporary = f"{path}.{threading.get_ident()}.tmp"
+        with open(temporary, 'wb') as f:
+            f.write(content)
+        os.replace(temporary, path)
+
+    def put(self, symbol, interval, content, timestamp=None, extension='png'):
+        """
+        Store a rendered chart.
+
+        Returns:
+        str: Path of the blob holding `content`.
+        """
+        digest = hashlib.sha256(content).hexdigest()
+        now = datetime.utcnow()
+        with self.lock:
+            session = self.Session()
+            try:
+                blob = session.get(ChartBlob, digest)
+                if blob is None or not os.path.exists(blob.path):
+                    path = self._blob_path(digest, extension)
+                    self._write(path, content)
+                    blob = session.merge(ChartBlob(hash=digest, path=path, size=len(content), created_at=now))
+                else:
+                    logging.info(f"Chart of {symbol} at interval {interval} is identical to {blob.path}")
+                blob.last_used_at = now
+                session.add(ChartEntry(symbol=symbol, interval=interval, timestamp=timestamp or now, hash=digest))
+                self._expire(session, now)
+                self._evict(session, keep=digest)
+                path = blob.path
+                session.commit()
+            except Exception:
+                session.rollback()
+                raise
+            finally:
+                session.close()
+        return path
+
+    def get(self, symbol, interval, timestamp=None):
+        """Path of the chart stored at `timestamp`, or of the latest one, None when there is none."""
+        session = self.Session()
+        try:
+            query = session.query(ChartBlob).join(ChartEntry, ChartEntry.hash == ChartBlob.hash).filter(
+                ChartEntry.symbol == symbol, ChartEntry.interval == interval)
+            if timestamp is not None:
+                query = query.filter(ChartEntry.timestamp <= timestamp)
+            blob = query.order_by(ChartEntry.timestamp.desc()).first()
+            if blob is None:
+                return None
+            blob.last_used_at = datetime.utcnow()
+            path = blob.path
+            session.commit()
+            return path
+        finally:
+            session.close()
+
+    def _delete_blobs(self, session, blobs):
+        for blob in blobs:
+            try:
+                os.unlink(blob.path)
+            except FileNotFoundError:
+                pass
+            session.query(ChartEntry).filter(ChartEntry.hash == blob.hash).delete(synchronize_session=False)
+            session.delete(blob)
+
+    def _expire(self, session, now):
+        expired = session.query(ChartEntry).filter(ChartEntry.timestamp < now - self.max_age).delete(synchronize_session=False)
+        if not expired:
+            return
+        session.flush()
+        orphans = session.query(ChartBlob).filter(~ChartBlob.hash.in_(select(ChartEntry.hash))).all()
+        self._delete_blobs(session, orphans)
+        logging.info(f"Expired {expired} chart entries and {len(orphans)} chart files")
+
+    def _evict(self, session, keep):
+        session.flush()
+        total = session.query(func.coalesce(func.sum(ChartBlob.size), 0)).scalar()
+        if total <= self.max_bytes:
+            return
+        evicted = []
+        for blob in session.query(ChartBlob).filter(ChartBlob.hash != keep).order_by(ChartBlob.last_used_at):
+            if total <= self.max_bytes:
+                break
+            evicted.append(blob)
+            total -= blob.size
+        self._delete_blobs(session, evicted)
+        logging.info(f"Evicted {len(evicted)} chart files from the store")
+
+    def stats(self):
+        session = self.Session()
+        try:
+            blobs, size = session.query(func.count(ChartBlob.hash), func.coalesce(func.sum(ChartBlob.size), 0)).one()
+            entries = session.query(func.count(ChartEntry.id)).scalar()
+        finally:
+            session.close()
+        return {'entries': entries, 'blobs': blobs, 'bytes': size}
+
+_store = None
+_store_lock = threading.Lock()
+
+def get_store():
+    """Return the process-wide chart store, created on first use."""
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = ChartStore()
+        return _store
+
+def test(directory='chart_store_test'):
+    """Identical renders share a blob, old entries expire and the least recently used blob is evicted."""
+    import shutil
+    shutil.rmtree(directory, ignore_errors=True)
+    store = ChartStore(directory, max_bytes=2500)
+    now = datetime.utcnow()
+
+    first = store.put('BTCUSDT', '4h', b'a' * 1000, now - timedelta(hours=8))
+    assert store.put('BTCUSDT', '4h', b'a' * 1000, now - timedelta(hours=4)) == first
+    assert store.stats() == {'entries': 2, 'blobs': 1, 'bytes': 1000}, store.stats()
+
+    second = store.put('ETHUSDT', '4h', b'b' * 1000, now - timedelta(hours=2))
+    assert store.get('BTCUSDT', '4h') == first
+    # Over 2500 bytes: the ETHUSDT blob is the least recently used one
+    third = store.put('BTCUSDT', '1d', b'c' * 1000, now)
+    assert not os.path.exists(second) and store.get('ETHUSDT', '4h') is None
+    assert os.path.exists(first) and os.path.exists(third)
+
+    store.max_age = timedelta(hours=1)
+    store.put('BTCUSDT', '1d', b'c' * 1000)
+    assert not os.path.exists(first) and store.get('BTCUSDT', '4h') is None
+    print(store.stats())
+
+# test()
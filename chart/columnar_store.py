@@ -0,0 +1,162 @@
+import logging
+import os
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.ipc
+except ImportError:  # the columnar backend is optional
+    pa = None
+
+# Columnar history store.
+# Candles and indicators of every (symbol, interval) are kept in Arrow IPC files partitioned by month:
+#   {root}/{symbol}/{interval}/{YYYY-MM}.arrow
+# Arrow IPC files are uncompressed, so reads memory-map them and only the projected columns are
+# touched. Appending rewrites just the months that received candles.
+
+# Directory of the columnar copy that fetch_data writes and analyze reads, e.g. 'columnar', None for SQLite only.
+# fetch_data copies the history stored in SQLite before the store was enabled on the next update of each pair.
+COLUMNAR_STORE_DIR = None
+
+def _timestamp_scalar(value, table):
+    return pa.scalar(pd.Timestamp(value).to_pydatetime(), table.schema.field('timestamp').type)
+
+class ColumnarStore:
+
+    root: str
+
+    def __init__(self, root):
+        if pa is None:
+            raise ImportError("The columnar store needs pyarrow, install it with `pip install pyarrow`")
+        self.root = root
+
+    def _directory(self, symbol, interval):
+        return os.path.join(self.root, symbol, interval)
+
+    def _months(self, symbol, interval):
+        directory = self._directory(symbol, interval)
+        if not os.path.isdir(directory):
+            return []
+        return sorted(name[:-len('.arrow')] for name in os.listdir(directory) if name.endswith('.arrow'))
+
+    def _read_month(self, symbol, interval, month):
+        path = os.path.join(self._directory(symbol, interval), f"{month}.arrow")
+        with pa.memory_map(path, 'r') as source:
+            return pa.ipc.open_file(source).read_all()
+
+    def first_timestamp(self, symbol, interval):
+        """Timestamp of the oldest stored row of a (symbol, interval), None when nothing is stored."""
+        months = self._months(symbol, interval)
+        if not months:
+            return None
+        timestamps = self._read_month(symbol, interval, months[0])['timestamp']
+        return pd.Timestamp(timestamps[0].as_py()) if len(timestamps) else None
+
+    def covers(self, symbol, interval, start):
+        """Whether the store holds the rows from `start` on, None for the whole history stored in SQLite."""
+        first = self.first_timestamp(symbol, interval)
+        return first is not None and start is not None and first <= pd.Timestamp(start)
+
+    def append(self, symbol, interval, data):
+        """
+        Add rows to the store, replacing stored rows with the same timestamp (e.g. a candle that was still open).
+
+        Parameters:
+        data (DataFrame): Must contain a 'timestamp' column, any other columns are stored as they are.
+        """
+        if data.empty:
+            return
+        directory = self._directory(symbol, interval)
+        os.makedirs(directory, exist_ok=True)
+
+        data = data.reset_index(drop=True)
+        months = data['timestamp'].dt.strftime('%Y-%m')
+        for month, rows in data.groupby(months, sort=True):
+            path = os.path.join(directory, f"{month}.arrow")
+            if os.path.exists(path):
+                rows = pd.concat([self._read_month(symbol, interval, month).to_pandas(), rows], ignore_index=True)
+            rows = rows.drop_duplicates('timestamp', keep='last').sort_values('timestamp')
+            table = pa.Table.from_pandas(rows, preserve_index=False)
+
+            # Write next to the target and swap, so readers never see a half-written file
+            temporary = f"{path}.tmp"
+            with pa.OSFile(temporary, 'wb') as sink:
+                with pa.ipc.new_file(sink, table.schema) as writer:
+                    writer.write_table(table)
+            os.replace(temporary, path)
+
+    def read(self, symbol, interval, start=None, end=None, columns=None, tail=None):
+        """
+        Read a time range of a (symbol, interval) from memory-mapped files.
+
+        Parameters:
+        start, end (datetime): Inclusive range, open ended when None.
+        columns (list): Columns to load besides 'timestamp', all of them when None.
+        tail (int): Keep only the newest `tail` rows of the range.
+
+        Returns:
+        DataFrame: Rows sorted by timestamp, empty if nothing is stored.
+        """
+        first = pd.Timestamp(start).strftime('%Y-%m') if start is not None else None
+        last = pd.Timestamp(end).strftime('%Y-%m') if end is not None else None
+        months = [m for m in self._months(symbol, interval) if (first is None or m >= first) and (last is None or m <= last)]
+
+        tables = []
+        rows = 0
+        # Newest months first, so a tail read stops as soon as it has enough rows
+        for month in reversed(months):
+            table = self._read_month(symbol, interval, month)
+            if columns is not None:
+                table = table.select(['timestamp'] + [c for c in columns if c in table.column_names and c != 'timestamp'])
+            if start is not None:
+                table = table.filter(pc.greater_equal(table['timestamp'], _timestamp_scalar(start, table)))
+            if end is not None:
+                table = table.filter(pc.less_equal(table['timestamp'], _timestamp_scalar(end, table)))
+            tables.append(table)
+            rows += table.num_rows
+            if tail is not None and rows >= tail:
+                break
+
+        if not tables:
+            return pd.DataFrame(columns=['timestamp'] + list(columns or []))
+        frames = [table.to_pandas() for table in reversed(tables)]
+        data = pd.concat(frames, ignore_index=True) if len(frames) > 1 else frames[0]
+        if tail is not None:
+            data = data.iloc[-tail:].reset_index(drop=True)
+        return data
+
+_store = None
+_store_lock = threading.Lock()
+
+def get_columnar_store():
+    """Return the process-wide columnar store, None when COLUMNAR_STORE_DIR is not set."""
+    global _store
+    with _store_lock:
+        if _store is None and COLUMNAR_STORE_DIR:
+            _store = ColumnarStore(COLUMNAR_STORE_DIR)
+        return _store
+
+def benchmark(root='columnar_benchmark', pairs=24, years=3):
+    """Write `years` of 15m candles for `pairs` symbols and time a projected range read of all of them."""
+    store = ColumnarStore(root)
+    timestamps = pd.date_range('2021-01-01', periods=years * 365 * 96, freq='15min')
+    rng = np.random.default_rng(0)
+    for i in range(pairs):
+        close = 100 + np.cumsum(rng.normal(0, 1, len(timestamps)))
+        store.append(f"SYM{i}USDT", '15m', pd.DataFrame({
+            'timestamp': timestamps, 'open': close, 'high': close + 1, 'low': close - 1, 'close': close,
+            'volume': rng.uniform(10, 1000, len(timestamps)), 'rsi': rng.uniform(0, 100, len(timestamps)),
+        }))
+
+    started = time.perf_counter()
+    rows = sum(len(store.read(f"SYM{i}USDT", '15m', columns=['close', 'rsi'])) for i in range(pairs))
+    elapsed = time.perf_counter() - started
+    logging.info(f"Read {rows} rows of 2 columns for {pairs} pairs in {elapsed:.2f}s")
+    print(f"{pairs} pairs x {years} years of 15m: {rows / elapsed:,.0f} rows/s")
+
+# benchmark()
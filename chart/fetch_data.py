@@ -1,14 +1,22 @@
 import pandas as pd
-import pandas_ta as ta
 from binance.client import Client
 import logging
-from sqlalchemy import create_engine, Column, String, Float, DateTime, Integer
+from sqlalchemy import create_engine, Column, String, Float, DateTime, Integer, LargeBinary, Index, func
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 from credentials import binance_api_key, binance_secret_key
 import time
 import schedule
 import numpy as np
+from indicators import calculate_indicators
+from indicator_pool import compute_indicators_parallel
+from columnar_store import get_columnar_store
+import pickle
+from datetime import datetime, timezone
+from dateutil.relativedelta import relativedelta
+from streaming_indicators import StreamingIndicators
+from kline_fetcher import KlineFetcher, klines_to_dataframe
+from resample import resample_candles
 
 # Set up logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -18,6 +26,9 @@ api_key = binance_api_key
 api_secret = binance_secret_key
 client = Client(api_key, api_secret)
 
+# Concurrent fetcher used when many (symbol, interval) pairs are updated at once
+kline_fetcher = KlineFetcher()
+
 # Database setup
 DATABASE_URL = 'sqlite:///indicators.db'  # Change this to your preferred database URL
 engine = create_engine(DATABASE_URL)
@@ -25,9 +36,13 @@ Session = sessionmaker(bind=engine)
 session = Session()
 Base = declarative_base()
 
+# Optional columnar copy of candles and indicators, enabled with columnar_store.COLUMNAR_STORE_DIR
+columnar_store = get_columnar_store()
+
 # Define the HistoricalData model
 class HistoricalData(Base):
     __tablename__ = 'historical_data'
+    __table_args__ = (Index('uq_historical_data_symbol_interval_timestamp', 'symbol', 'interval', 'timestamp', unique=True),)
     id = Column(Integer, primary_key=True)
     symbol = Column(String)
     interval = Column(String)
@@ -41,6 +56,7 @@ class HistoricalData(Base):
 # Define the Indicators model
 class Indicators(Base):
     __tablename__ = 'indicators'
+    __table_args__ = (Index('uq_indicators_symbol_interval_timestamp', 'symbol', 'interval', 'timestamp', unique=True),)
     id = Column(Integer, primary_key=True)
     symbol = Column(String)
     interval = Column(String)
@@ -89,10 +105,49 @@ class Indicators(Base):
     fvg_pattern = Column(Integer)
     head_and_shoulders = Column(Integer)
     harmonic_pattern = Column(Integer)
+
+# Streaming indicator state of each (symbol, interval), up to its last closed candle
+class IndicatorState(Base):
+    __tablename__ = 'indicator_state'
+    __table_args__ = (Index('uq_indicator_state_symbol_interval', 'symbol', 'interval', unique=True),)
+    id = Column(Integer, primary_key=True)
+    symbol = Column(String)
+    interval = Column(String)
+    timestamp = Column(DateTime)
+    state = Column(LargeBinary)
 # Create tables
 Base.metadata.create_all(engine)
 
-def fetch_historical_data(symbol, interval, start_str):
+def ensure_upsert_keys(bind):
+    """
+    Create the (symbol, interval, timestamp) unique indexes on tables created before they were declared.
+    create_all does not alter existing tables, and the bulk upsert needs these keys as conflict targets.
+    """
+    for model in (HistoricalData, Indicators):
+        for index in model.__table__.indexes:
+            try:
+                index.create(bind, checkfirst=True)
+            except Exception as e:
+                logging.error(f"Could not create {index.name}, remove duplicate rows first: {e}")
+
+ensure_upsert_keys(engine)
+
+# How far back to download when nothing is stored yet for a (symbol, interval)
+INITIAL_LOOKBACK = {
+    '15m': relativedelta(weeks=3),
+    '4h': relativedelta(weeks=25),
+    '1d': relativedelta(months=35),
+}
+
+# Intervals built locally from a finer stored interval instead of being downloaded, interval -> base interval.
+# The base interval is then downloaded far enough back to cover the lookback of the intervals derived from it,
+# and trimmed back to its own lookback once they are built (trim_base_history).
+# 1d is downloaded: derived from 15m it would need 35 months of 15m candles (about 100k per symbol).
+DERIVED_INTERVALS = {
+    '4h': '15m',
+}
+
+def fetch_historical_data(symbol, interval, start_str, min_rows=50):
     try:
         logging.info(f"Fetching historical data for {symbol} at interval {interval} starting from {start_str}")
         
@@ -102,575 +157,436 @@ def fetch_historical_data(symbol, interval, start_str):
             logging.error("No data fetched from Binance API")
             return pd.DataFrame()
         
-        data = pd.DataFrame(klines, columns=['timestamp', 'open', 'high', 'low', 'close', 'volume', 'close_time', 'quote_asset_volume', 'number_of_trades', 'taker_buy_base_asset_volume', 'taker_buy_quote_asset_volume', 'ignore'])
-        data['timestamp'] = pd.to_datetime(data['timestamp'], unit='ms')
-        data = data.astype({'open': 'float', 'high': 'float', 'low': 'float', 'close': 'float', 'volume': 'float'})
+        data = klines_to_dataframe(klines)
         
-        if data.empty or len(data) < 50:  # Adjust the threshold as needed
+        if data.empty or len(data) < min_rows:
             logging.error("Insufficient data to calculate indicators")
             return pd.DataFrame()
         
         logging.info(f"Fetched {len(data)} rows of data for {symbol} at interval {interval}")
-        return data[['timestamp', 'open', 'high', 'low', 'close', 'volume']]
+        return data
     except Exception as e:
         logging.error(f"Error fetching historical data: {e}", exc_info=True)
         return pd.DataFrame()
     
-# Indicators and Oscillator Calculation
-def calculate_indicators(data):
-    try:
-        data['rsi'] = ta.rsi(data['close'], length=14)
-        macd = ta.macd(data['close'])
-        if macd is not None:
-            data['macd'] = macd['MACD_12_26_9']
-            data['macd_signal'] = macd['MACDs_12_26_9']
-            data['macd_diff'] = macd['MACDh_12_26_9']
-        else:
-            data['macd'] = None
-            data['macd_signal'] = None
-            data['macd_diff'] = None
-        bbands = ta.bbands(data['close'], length=20, std=2)
-        if bbands is not None:
-            data['bollinger_hband'] = bbands['BBU_20_2.0']
-            data['bollinger_mband'] = bbands['BBM_20_2.0']
-            data['bollinger_lband'] = bbands['BBL_20_2.0']
-        else:
-            data['bollinger_hband'] = None
-            data['bollinger_mband'] = None
-            data['bollinger_lband'] = None
-
-        data['ema_25'] = ta.ema(data['close'], length=25)
-        data['ema_50'] = ta.ema(data['close'], length=50)
-        data['ema_100'] = ta.ema(data['close'], length=100)
-        data['ema_200'] = ta.ema(data['close'], length=200)
-
-        # Calculate SMA, STOCH and ..  indicators
-        data['sma_50'] = ta.sma(data['close'], length=50)
-        data['sma_200'] = ta.sma(data['close'], length=200)
-        stoch = ta.stoch(data['high'], data['low'], data['close'])
-        if stoch is not None:
-            data['stoch_k'] = stoch['STOCHk_14_3_3']
-            data['stoch_d'] = stoch['STOCHd_14_3_3']
-        else:
-            data['stoch_k'] = None
-            data['stoch_d'] = None
-        data['cci'] = ta.cci(data['high'], data['low'], data['close'], length=20)
-        data['atr'] = ta.atr(data['high'], data['low'], data['close'], length=14)
-        data['obv'] = ta.obv(data['close'], data['volume'])
-        data['williams_r'] = ta.willr(data['high'], data['low'], data['close'], length=14)
-
-        data['ema_25'].fillna(0, inplace=True)
-        data['ema_50'].fillna(0, inplace=True)
-        data['ema_100'].fillna(0, inplace=True)
-        data['ema_200'].fillna(0, inplace=True)
-
-        data['ema_25'].ffill(inplace=True)
-        data['ema_50'].ffill(inplace=True)
-        data['ema_100'].ffill(inplace=True)
-        data['ema_200'].ffill(inplace=True)
-
-        data['ema_25'].bfill(inplace=True)
-        data['ema_50'].bfill(inplace=True)
-        data['ema_100'].bfill(inplace=True)
-        data['ema_200'].bfill(inplace=True)
-
-        # Detect EMA crosses
-        data['ema_25_cross_ema_50'] = detect_ema_cross(data['ema_25'], data['ema_50'])
-        data['ema_25_cross_ema_100'] = detect_ema_cross(data['ema_25'], data['ema_100'])
-        data['ema_25_cross_ema_200'] = detect_ema_cross(data['ema_25'], data['ema_200'])
-        data['ema_50_cross_ema_100'] = detect_ema_cross(data['ema_50'], data['ema_100'])
-        data['ema_50_cross_ema_200'] = detect_ema_cross(data['ema_50'], data['ema_200'])
-        data['ema_100_cross_ema_200'] = detect_ema_cross(data['ema_100'], data['ema_200'])
-
-        data = calculate_major_pivots(data)
-        data = calculate_minor_pivots(data)
-        data = calculate_fibonacci_levels(data)
-
-        # Detect FVG
-        data['fvg_pattern'] = detect_fvg(data)
-
-        # Detect patterns
-        data['head_and_shoulders'] = detect_head_and_shoulders(data)
-        data['harmonic_pattern'] = detect_harmonic_pattern(data)
-        data['wedge_pattern'] = detect_wedge(data)
-        data['triangle_pattern'] = detect_triangle(data)
-        data['double_top_pattern'] = detect_double_top(data)
-        data['double_bottom_pattern'] = detect_double_bottom(data)
-
-        logging.info("Calculated RSI, MACD, Bollinger Bands, EMA crosses, major and minor pivots, Fibonacci levels, SMAs, Stochastic, CCI, ATR, OBV, and Williams %R")
-        return data
-    except Exception as e:
-        logging.error(f"Error calculating indicators: {e}", exc_info=True)
-        return pd.DataFrame()
-
-
+# Columns written by the bulk upsert, in addition to symbol, interval and timestamp
+HISTORICAL_COLUMNS = ['open', 'high', 'low', 'close', 'volume']
+INDICATOR_COLUMNS = [
+    column.name for column in Indicators.__table__.columns
+    if column.name not in ('id', 'symbol', 'interval', 'timestamp')
+]
 
-def detect_ema_cross(ema_short, ema_long):
-    cross_up = (ema_short.shift(1) <= ema_long.shift(1)) & (ema_short > ema_long)
-    cross_down = (ema_short.shift(1) >= ema_long.shift(1)) & (ema_short < ema_long)
-    return cross_up.astype(int) - cross_down.astype(int)
+def _column_values(series):
+    """Convert a DataFrame column to a list of Python values with NaN/NaT as None."""
+    if pd.api.types.is_datetime64_any_dtype(series):
+        return [None if pd.isna(x) else x for x in series.dt.to_pydatetime()]
+    return series.astype(object).where(series.notna(), None).tolist()
 
-  
-def calculate_major_pivots(data):
+def upsert_rows(db_session, model, symbol, interval, data, columns):
     """
-    Calculate major pivot points for given price data.
-    
+    Insert or update rows of `model` keyed on (symbol, interval, timestamp) in one executemany.
+
     Parameters:
-    data (DataFrame): A DataFrame with columns ['high', 'low', 'close'].
-    
+    db_session (Session): Session used to execute the statement, it is not committed here.
+    model: HistoricalData or Indicators.
+    symbol (str): Symbol stored on every row.
+    interval (str): Interval stored on every row.
+    data (DataFrame): Must contain a 'timestamp' column, missing value columns are stored as NULL.
+    columns (list): Value columns to write.
+
     Returns:
-    DataFrame: The original DataFrame with additional columns for major pivots and their support and resistance levels.
+    int: Number of rows written.
     """
-    data['pivot'] = (data['high'].shift(1) + data['low'].shift(1) + data['close'].shift(1)) / 3
-    data['pivot_res1'] = 2 * data['pivot'] - data['low'].shift(1)
-    data['pivot_sup1'] = 2 * data['pivot'] - data['high'].shift(1)
-    data['pivot_res2'] = data['pivot'] + (data['high'].shift(1) - data['low'].shift(1))
-    data['pivot_sup2'] = data['pivot'] - (data['high'].shift(1) - data['low'].shift(1))
-    
-    return data
+    if data.empty:
+        return 0
+
+    if db_session.get_bind().dialect.name == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+
+    columns = [column for column in columns if column in data.columns]
+    values = [_column_values(data['timestamp'])] + [_column_values(data[column]) for column in columns]
+    keys = ['timestamp'] + columns
+    rows = [dict(zip(keys, row), symbol=symbol, interval=interval) for row in zip(*values)]
+
+    statement = insert(model.__table__)
+    statement = statement.on_conflict_do_update(
+        index_elements=['symbol', 'interval', 'timestamp'],
+        set_={column: statement.excluded[column] for column in columns}
+    )
+    db_session.connection().execute(statement, rows)
+    return len(rows)
 
-def calculate_minor_pivots(data, window=10):
+def store_historical_data(symbol, interval, data):
+    try:
+        count = upsert_rows(session, HistoricalData, symbol, interval, data, HISTORICAL_COLUMNS)
+        session.commit()
+        logging.info(f"Stored {count} rows of historical data for {symbol} at interval {interval} in database")
+    except Exception as e:
+        session.rollback()
+        logging.error(f"Error storing historical data in database: {e}", exc_info=True)
+
+def store_indicators_data(symbol, interval, data):
+    try:
+        count = upsert_rows(session, Indicators, symbol, interval, data, INDICATOR_COLUMNS)
+        session.commit()
+        logging.info(f"Stored {count} rows of indicators data for {symbol} at interval {interval} in database")
+    except Exception as e:
+        session.rollback()
+        logging.error(f"Error storing indicators data in database: {e}", exc_info=True)
+
+def benchmark_store(sizes=(10_000, 100_000)):
     """
-    Calculate minor pivot points for given price data.
-    
-    Parameters:
-    data (DataFrame): A DataFrame with columns ['high', 'low', 'close'].
-    window (int): The number of periods to use for rolling calculations (default is 10).
-    
-    Returns:
-    DataFrame: The original DataFrame with additional columns for minor pivots and their support and resistance levels.
+    Compare rows/s of the former per-row ORM inserts with the bulk upsert on an in-memory database.
+    Indicator rows carry every indicator column, like a real refresh.
     """
-    if len(data) < window:
-        raise ValueError("Not enough data to calculate minor pivots")
-    
-    high = data['high'].rolling(window=window, min_periods=1).max()
-    low = data['low'].rolling(window=window, min_periods=1).min()
-    close = data['close'].shift(-(window-1)).rolling(window=window, min_periods=1).apply(lambda x: x[0] if len(x) == window else np.nan, raw=True)
-
-    pivot = (high + low + close) / 3
-    res1 = 2 * pivot - low
-    sup1 = 2 * pivot - high
-    res2 = pivot + (high - low)
-    sup2 = pivot - (high - low)
-
-    data['minor_pivot'] = pivot
-    data['minor_pivot_res1'] = res1
-    data['minor_pivot_sup1'] = sup1
-    data['minor_pivot_res2'] = res2
-    data['minor_pivot_sup2'] = sup2
-    
-    return data
-
-def detect_fvg(data, window=10):
+    for rows in sizes:
+        data = pd.DataFrame({'timestamp': pd.date_range('2020-01-01', periods=rows, freq='15min')})
+        for column in INDICATOR_COLUMNS:
+            data[column] = np.random.rand(rows)
+
+        for name in ('orm', 'bulk'):
+            bench_engine = create_engine('sqlite://')
+            Base.metadata.create_all(bench_engine)
+            bench_session = sessionmaker(bind=bench_engine)()
+            started = time.perf_counter()
+            if name == 'orm':
+                for _, row in data.iterrows():
+                    bench_session.add(Indicators(symbol='BTCUSDT', interval='15m', **row.to_dict()))
+            else:
+                upsert_rows(bench_session, Indicators, 'BTCUSDT', '15m', data, INDICATOR_COLUMNS)
+            bench_session.commit()
+            elapsed = time.perf_counter() - started
+            bench_session.close()
+            print(f"{name:>4} {rows:>7} rows: {rows / elapsed:,.0f} rows/s")
+
+# benchmark_store()
+
+def get_last_timestamp(symbol, interval):
     """
-    Detect Fair Value Gaps (FVG) in the given price data.
-    
-    Parameters:
-    data (DataFrame): A DataFrame with columns ['high', 'low'].
-    window (int): The number of periods to look back for detecting gaps (default is 10).
-    
+    Return the watermark for incremental ingestion of a (symbol, interval).
+
+    The watermark is the newest timestamp present in both `historical_data` and
+    `indicators`, so a run that stored candles but crashed before storing their
+    indicators is picked up again on the next run.
+
     Returns:
-    np.array: An array indicating the presence of FVGs (1 if detected, else 0).
+    datetime or None: The watermark, or None when nothing is stored yet.
     """
-    patterns = np.zeros(len(data))
-    
-    # Iterate over the data with the specified window
-    for i in range(window, len(data)):
-        for j in range(1, window + 1):
-            prev_high = data['high'][i-j]
-            prev_low = data['low'][i-j]
-            current_high = data['high'][i]
-            current_low = data['low'][i]
-            
-            # Detect gap up
-            if current_low > prev_high:
-                patterns[i] = 1
-                break  # Break to avoid multiple detections for the same index
-
-            elif current_high < prev_low:
-                patterns[i] = 1
-                break  # Break to avoid multiple detections for the same index
-    
-    return patterns
-
-def detect_double_top(data, window=10, tolerance=0.02):
+    last_timestamps = [
+        session.query(func.max(model.timestamp)).filter(
+            model.symbol == symbol,
+            model.interval == interval
+        ).scalar()
+        for model in (HistoricalData, Indicators)
+    ]
+    if None in last_timestamps:
+        return None
+    return min(last_timestamps)
+
+def load_historical_data(symbol, interval, since=None):
+    query = session.query(
+        HistoricalData.timestamp,
+        HistoricalData.open,
+        HistoricalData.high,
+        HistoricalData.low,
+        HistoricalData.close,
+        HistoricalData.volume
+    ).filter(
+        HistoricalData.symbol == symbol,
+        HistoricalData.interval == interval
+    ).order_by(HistoricalData.timestamp)
+    if since is not None:
+        query = query.filter(HistoricalData.timestamp >= since)
+    return pd.read_sql(query.statement, session.bind)
+
+def delete_stored_data(symbol, interval, since=None, before=None):
     """
-    Detect double top patterns in the given price data.
-    
+    Delete stored candles and indicators of a single (symbol, interval).
+
     Parameters:
-    data (DataFrame): A DataFrame with columns ['high', 'low', 'close'].
-    window (int): The number of periods to use for the rolling window to detect peaks.
-    tolerance (float): The tolerance level for peak matching.
-    
-    Returns:
-    np.array: An array indicating the presence of double top patterns (1 if detected, else 0).
+    symbol (str): Symbol whose rows are deleted, other symbols are left alone.
+    interval (str): Interval whose rows are deleted.
+    since (datetime): If given, only rows at or after this timestamp are deleted.
+    before (datetime): If given, only rows before this timestamp are deleted.
     """
-    patterns = np.zeros(len(data))
-    
-    if len(data) < window:
-        return patterns
-    
-    for i in range(window, len(data)):
-        highs = data['high'][i-window:i]
-        
-        if len(highs) < window:
-            continue
-        max1 = highs.max()
-        max1_idx = highs.idxmax()
-        highs_excluding_max1 = highs.drop(max1_idx)
-        if highs_excluding_max1.empty:
-            continue
-        
-        max2 = highs_excluding_max1.max()
-        max2_idx = highs_excluding_max1.idxmax()
-
-        if max2_idx < max1_idx:
-            continue
-        if abs(max1 - max2) / max1 < tolerance:
-            if data['close'][i] < highs.mean():
-                patterns[i] = 1
-    
-    return patterns
-
-
-def detect_double_bottom(data, window=10, tolerance=0.02):
+    for model in (HistoricalData, Indicators):
+        query = session.query(model).filter(model.symbol == symbol, model.interval == interval)
+        if since is not None:
+            query = query.filter(model.timestamp >= since)
+        if before is not None:
+            query = query.filter(model.timestamp < before)
+        query.delete(synchronize_session=False)
+
+def load_indicator_state(symbol, interval):
+    record = session.query(IndicatorState).filter(
+        IndicatorState.symbol == symbol,
+        IndicatorState.interval == interval
+    ).first()
+    return pickle.loads(record.state) if record else None
+
+def save_indicator_state(symbol, interval, state):
+    record = session.query(IndicatorState).filter(
+        IndicatorState.symbol == symbol,
+        IndicatorState.interval == interval
+    ).first()
+    if record is None:
+        record = IndicatorState(symbol=symbol, interval=interval)
+        session.add(record)
+    record.timestamp = state.last_timestamp
+    record.state = pickle.dumps(state)
+    session.commit()
+
+def stream_indicators(state, data):
     """
-    Detect double bottom patterns in the given price data.
-    
-    Parameters:
-    data (DataFrame): A DataFrame with columns ['high', 'low', 'close'].
-    window (int): The number of periods to use for the rolling window to detect troughs.
-    tolerance (float): The tolerance level for trough matching.
-    
-    Returns:
-    np.array: An array indicating the presence of double bottom patterns (1 if detected, else 0).
+    Fold the closed candles of `data` into `state` and return the indicators rows of all of them.
+    The last candle of `data` may still be open, so it is computed without advancing the state.
     """
-    patterns = np.zeros(len(data))
-    
-    if len(data) < window:
-        return patterns
-    
-    for i in range(window, len(data)):
-        lows = data['low'][i-window:i]
-        
-        if len(lows) < window:
-            continue
-        min1 = lows.min()
-        min1_idx = lows.idxmin()
-
-        lows_excluding_min1 = lows.drop(min1_idx)
-        if lows_excluding_min1.empty:
-            continue
-        
-        min2 = lows_excluding_min1.min()
-        min2_idx = lows_excluding_min1.idxmax()
+    candles = data.to_dict('records')
+    rows = [state.update(candle) for candle in candles[:-1]]
+    rows.append(state.peek(candles[-1]))
+    return pd.DataFrame(rows)
 
-        if min2_idx < min1_idx:
-            continue
-
-        if abs(min1 - min2) / min1 < tolerance:
-            if data['close'][i] > lows.mean():
-                patterns[i] = 1
-    
-    return patterns
+def get_fetch_start(symbol, interval, incremental=True, derived=()):
+    """
+    Return (start_ms, last_timestamp) for the next download of a (symbol, interval).
+    last_timestamp is the incremental watermark, or None when the full lookback is downloaded.
 
-def detect_triangle(data, window=10, tolerance=0.02):
+    derived lists the intervals that will be built from this one, the full lookback covers theirs too
+    and is downloaded again as long as one of them has no stored history yet.
     """
-    Detect triangle patterns in the given price data.
-    
-    Parameters:
-    data (DataFrame): A DataFrame with columns ['high', 'low'].
-    window (int): The number of periods to use for the rolling window to detect trend lines.
-    tolerance (float): The tolerance level for pattern matching.
-    
-    Returns:
-    np.array: An array indicating the presence of triangle patterns (1 if detected, else 0).
+    last_timestamp = get_last_timestamp(symbol, interval) if incremental else None
+    if last_timestamp and any(get_last_timestamp(symbol, other) is None for other in derived):
+        last_timestamp = None
+    if last_timestamp:
+        # Start from the newest stored candle: it may still have been open when it was stored
+        start = pd.Timestamp(last_timestamp).tz_localize('UTC')
+    else:
+        now = datetime.now(timezone.utc)
+        start = min(now - INITIAL_LOOKBACK[other] for other in (interval, *derived))
+    return int(start.timestamp() * 1000), last_timestamp
+
+def derive_candles(symbol, interval, incremental=True):
     """
-    patterns = np.zeros(len(data))
-    
-    if len(data) < window:
-        return patterns
-    
-    for i in range(window, len(data)):
-        highs = data['high'][i-window:i]
-        lows = data['low'][i-window:i]
-        
-        if len(highs) < window or len(lows) < window:
-            continue
-        
-        high_slope = (highs.iloc[-1] - highs.iloc[0]) / window
-        low_slope = (lows.iloc[-1] - lows.iloc[0]) / window
-        
-        if high_slope > 0 and low_slope > 0:
-            if abs(highs.max() - highs.min()) / highs.min() < tolerance:
-                patterns[i] = 1
-        elif high_slope < 0 and low_slope < 0:
-            if abs(lows.max() - lows.min()) / lows.min() < tolerance:
-                patterns[i] = 1
-        else:
-            if abs(high_slope - low_slope) / max(abs(high_slope), abs(low_slope)) < tolerance:
-                patterns[i] = 1
-    
-    return patterns
+    Build the candles of a derived interval from its stored base interval.
 
-def detect_head_and_shoulders(data, tolerance=0.02):
-    """
-    Detect head and shoulders patterns in the given price data.
-    
-    Parameters:
-    data (DataFrame): A DataFrame with columns ['high', 'low', 'close'].
-    tolerance (float): The tolerance level for pattern matching.
-    
     Returns:
-    np.array: An array indicating the presence of head and shoulders patterns (1 if detected, else 0).
+    DataFrame, datetime: Candles from the newest stored candle of the interval on (all of them when
+    nothing is stored yet), and the watermark they were built after.
     """
-    patterns = np.zeros(len(data))
+    base_interval = DERIVED_INTERVALS[interval]
+    last_timestamp = get_last_timestamp(symbol, interval) if incremental else None
+    base = load_historical_data(symbol, base_interval, since=last_timestamp)
+    return resample_candles(base, interval, base_interval), last_timestamp
 
-    for i in range(6, len(data)):
-        left_shoulder = data['high'][i-6]
-        head = data['high'][i-3]
-        right_shoulder = data['high'][i]
-        neckline = min(data['low'][i-5], data['low'][i-1])
-        neckline = (neckline + data['low'][i-2]) / 2 
-
-        if not (head > left_shoulder and head > right_shoulder):
-            continue
-
-        if not (left_shoulder * (1 - tolerance) <= right_shoulder <= left_shoulder * (1 + tolerance)):
-            continue
-
-        if data['close'][i] < neckline:
-            patterns[i] = 1
-
-    return patterns
-
-
-def detect_wedge(data, window=10, tolerance=0.02):
+def trim_base_history(symbol, base_interval):
     """
-    Detect wedge patterns in the given price data.
-    
-    Parameters:
-    data (DataFrame): A DataFrame with columns ['high', 'low'].
-    window (int): The number of periods to use for the rolling window to detect trend lines.
-    tolerance (float): The tolerance level for pattern matching.
-    
-    Returns:
-    np.array: An array indicating the presence of wedge patterns (1 if detected, else 0).
+    Delete the candles of a base interval that are older than its own lookback, once every interval derived
+    from it is built past them. Keeps the base series, and its full indicator recomputes, bounded.
     """
-    patterns = np.zeros(len(data))
-    
-    if len(data) < window:
-        return patterns
-    
-    for i in range(window, len(data)):
-        highs = data['high'][i-window:i]
-        lows = data['low'][i-window:i]
-        
-        if len(highs) < window or len(lows) < window:
+    cutoff = datetime.utcnow() - INITIAL_LOOKBACK[base_interval]
+    for interval, base in DERIVED_INTERVALS.items():
+        if base != base_interval:
             continue
-        
-        high_slope = (highs.iloc[-1] - highs.iloc[0]) / window
-        low_slope = (lows.iloc[-1] - lows.iloc[0]) / window
-
-        if high_slope < 0 and low_slope < 0:
-            high_slope_2 = (highs.iloc[1] - highs.iloc[0]) / (window - 1)
-            low_slope_2 = (lows.iloc[1] - lows.iloc[0]) / (window - 1)
-            if high_slope_2 != 0 and low_slope_2 != 0 and \
-               abs((high_slope - high_slope_2) / high_slope_2) < tolerance and \
-               abs((low_slope - low_slope_2) / low_slope_2) < tolerance:
-                patterns[i] = 1
-        elif high_slope > 0 and low_slope > 0:
-            high_slope_2 = (highs.iloc[1] - highs.iloc[0]) / (window - 1)
-            low_slope_2 = (lows.iloc[1] - lows.iloc[0]) / (window - 1)
-            if high_slope_2 != 0 and low_slope_2 != 0 and \
-               abs((high_slope - high_slope_2) / high_slope_2) < tolerance and \
-               abs((low_slope - low_slope_2) / low_slope_2) < tolerance:
-                patterns[i] = 1
-    
-    return patterns
-
-def detect_harmonic_pattern(data, tolerance=0.02):
+        last_timestamp = get_last_timestamp(symbol, interval)
+        if last_timestamp is None:
+            return
+        # The open candle of the derived interval is built again from the base candles since its start
+        cutoff = min(cutoff, last_timestamp)
+    delete_stored_data(symbol, base_interval, before=cutoff)
+    session.commit()
+
+def has_new_data(symbol, interval, data, last_timestamp):
+    if data.empty or (not last_timestamp and len(data) < 50):
+        logging.warning(f"No new data fetched for {symbol} at interval {interval}")
+        return False
+    return True
+
+def store_candles(symbol, interval, data, last_timestamp):
     """
-    Detect harmonic patterns in the given price data.
-    
-    Parameters:
-    data (DataFrame): A DataFrame with columns ['high', 'low'].
-    tolerance (float): The tolerance level for Fibonacci ratio matching.
-    
+    Store downloaded candles, incrementally after last_timestamp or as a full reload.
+
     Returns:
-    np.array: An array indicating the presence of harmonic patterns (1 if detected, else 0).
+    StreamingIndicators or None: The indicator state when it ends right before the stored candles,
+    otherwise None and the indicators have to be recomputed from the stored series.
     """
-    patterns = np.zeros(len(data))
-
-    for i in range(5, len(data)):
-        X = data['low'][i-5]
-        A = data['high'][i-4]
-        B = data['low'][i-3]
-        C = data['high'][i-2]
-        D = data['low'][i-1]
-        current = data['low'][i]
-
-        if not (0.618 - tolerance <= (B - X) / (A - X) <= 0.618 + tolerance):
-            continue
-
-        if not (0.382 - tolerance <= (C - A) / (A - B) <= 0.382 + tolerance or
-                0.886 - tolerance <= (C - A) / (A - B) <= 0.886 + tolerance):
-            continue
-
-        if not (0.382 - tolerance <= (D - B) / (C - B) <= 0.382 + tolerance or
-                0.886 - tolerance <= (D - B) / (C - B) <= 0.886 + tolerance):
-            continue
-
-        if not (1.618 - tolerance <= (current - C) / (C - D) <= 1.618 + tolerance or
-                2.618 - tolerance <= (current - C) / (C - D) <= 2.618 + tolerance):
-            continue
-
-        patterns[i] = 1
-
-    return patterns
-
-def calculate_fibonacci_levels(data):
+    if not last_timestamp:
+        delete_stored_data(symbol, interval)
+        store_historical_data(symbol, interval, data)
+        return None
+
+    # The streaming state must end on the stored candle right before the re-fetched one
+    state = load_indicator_state(symbol, interval)
+    previous_timestamp = session.query(func.max(HistoricalData.timestamp)).filter(
+        HistoricalData.symbol == symbol,
+        HistoricalData.interval == interval,
+        HistoricalData.timestamp < last_timestamp
+    ).scalar()
+
+    delete_stored_data(symbol, interval, since=last_timestamp)
+    store_historical_data(symbol, interval, data)
+
+    if state is not None and previous_timestamp is not None and state.last_timestamp == pd.Timestamp(previous_timestamp):
+        return state
+    return None
+
+def _columnar_rows(candles, indicators):
+    columns = ['timestamp'] + [column for column in INDICATOR_COLUMNS if column in indicators.columns]
+    return candles[['timestamp'] + HISTORICAL_COLUMNS].merge(indicators[columns], on='timestamp')
+
+def backfill_columnar_store(symbol, interval):
+    """
+    Copy the rows that SQLite holds from before the oldest row of the columnar store into it. The store is only
+    written by the updates after it was enabled, this brings in the older history on the first of them.
+    """
+    first = columnar_store.first_timestamp(symbol, interval)
+    oldest = session.query(func.min(HistoricalData.timestamp)).filter(
+        HistoricalData.symbol == symbol, HistoricalData.interval == interval).scalar()
+    if oldest is None or (first is not None and pd.Timestamp(oldest) >= first):
+        return
+    candles = load_historical_data(symbol, interval)
+    query = session.query(Indicators).filter(Indicators.symbol == symbol, Indicators.interval == interval)
+    if first is not None:
+        candles = candles[candles['timestamp'] < first]
+        query = query.filter(Indicators.timestamp < first)
+    rows = _columnar_rows(candles, pd.read_sql(query.statement, session.bind))
+    columnar_store.append(symbol, interval, rows)
+    logging.info(f"Copied {len(rows)} rows of {symbol} at interval {interval} from SQLite to the columnar store")
+
+def mirror_to_columnar_store(symbol, interval, candles, indicators):
+    if columnar_store is None or indicators.empty:
+        return
     try:
-        high = data['high'].rolling(window=20).max()
-        low = data['low'].rolling(window=20).min()
-        data['fib_38_2'] = high - 0.382 * (high - low)
-        data['fib_61_8'] = high - 0.618 * (high - low)
-        return data
+        backfill_columnar_store(symbol, interval)
+        columnar_store.append(symbol, interval, _columnar_rows(candles, indicators))
     except Exception as e:
-        logging.error(f"Error calculating Fibonacci levels: {e}", exc_info=True)
-        return data
+        logging.error(f"Error storing {symbol} at interval {interval} in the columnar store: {e}", exc_info=True)
+
+def store_streamed_indicators(symbol, interval, data, state):
+    indicators = stream_indicators(state, data)
+    store_indicators_data(symbol, interval, indicators)
+    save_indicator_state(symbol, interval, state)
+    mirror_to_columnar_store(symbol, interval, data, indicators)
+
+def store_computed_indicators(symbol, interval, history, indicators, last_timestamp):
+    """Store indicators computed over the whole series and rebuild the streaming state from it."""
+    if last_timestamp and not indicators.empty:
+        indicators = indicators[indicators['timestamp'] >= pd.Timestamp(last_timestamp)]
+    store_indicators_data(symbol, interval, indicators)
+    save_indicator_state(symbol, interval, StreamingIndicators.from_history(history.iloc[:-1]))
+    mirror_to_columnar_store(symbol, interval, history, indicators)
+
+def apply_update(symbol, interval, data, last_timestamp):
+    if not has_new_data(symbol, interval, data, last_timestamp):
+        return
+
+    state = store_candles(symbol, interval, data, last_timestamp)
+    if state is not None:
+        store_streamed_indicators(symbol, interval, data, state)
+    else:
+        history = load_historical_data(symbol, interval) if last_timestamp else data
+        store_computed_indicators(symbol, interval, history, calculate_indicators(history.copy()), last_timestamp)
+    logging.info(f"Updated {len(data)} candles for {symbol} at interval {interval} since {last_timestamp or 'initial lookback'}")
+
+def update_database(symbol, interval, incremental=True, derived=()):
+    if interval in DERIVED_INTERVALS:
+        update_database(symbol, DERIVED_INTERVALS[interval], incremental, derived=(interval,))
+        try:
+            data, last_timestamp = derive_candles(symbol, interval, incremental)
+            apply_update(symbol, interval, data, last_timestamp)
+            trim_base_history(symbol, DERIVED_INTERVALS[interval])
+        except Exception as e:
+            session.rollback()
+            logging.error(f"Error updating database: {e}", exc_info=True)
+        return
 
-def store_historical_data(symbol, interval, data):
     try:
-        for index, row in data.iterrows():
-            historical_data = HistoricalData(
-                symbol=symbol,
-                interval=interval,
-                timestamp=row['timestamp'],
-                open=row['open'],
-                high=row['high'],
-                low=row['low'],
-                close=row['close'],
-                volume=row['volume']
-            )
-            session.add(historical_data)
-        session.commit()
-        logging.info(f"Stored historical data for {symbol} at interval {interval} in database")
+        start_ms, last_timestamp = get_fetch_start(symbol, interval, incremental, derived)
+        data = fetch_historical_data(symbol, interval, start_ms, min_rows=1)
+        apply_update(symbol, interval, data, last_timestamp)
     except Exception as e:
-        logging.error(f"Error storing historical data in database: {e}", exc_info=True)
+        session.rollback()
+        logging.error(f"Error updating database: {e}", exc_info=True)
 
-def store_indicators_data(symbol, interval, data):
-    try:
-        for index, row in data.iterrows():
-            indicators = Indicators(
-                symbol=symbol,
-                interval=interval,
-                timestamp=row['timestamp'],
-                rsi=row.get('rsi'),
-                macd=row.get('macd'),
-                macd_signal=row.get('macd_signal'),
-                macd_diff=row.get('macd_diff'),
-                ema_25=row.get('ema_25'),
-                ema_50=row.get('ema_50'),
-                ema_100=row.get('ema_100'),
-                ema_200=row.get('ema_200'),
-                ema_25_cross_ema_50=row.get('ema_25_cross_ema_50'),
-                ema_25_cross_ema_100=row.get('ema_25_cross_ema_100'),
-                ema_25_cross_ema_200=row.get('ema_25_cross_ema_200'),
-                ema_50_cross_ema_100=row.get('ema_50_cross_ema_100'),
-                ema_50_cross_ema_200=row.get('ema_50_cross_ema_200'),
-                ema_100_cross_ema_200=row.get('ema_100_cross_ema_200'),
-                bollinger_hband=row.get('bollinger_hband'),
-                bollinger_mband=row.get('bollinger_mband'),
-                bollinger_lband=row.get('bollinger_lband'),
-                pivot=row.get('pivot'),
-                pivot_res1=row.get('pivot_res1'),
-                pivot_sup1=row.get('pivot_sup1'),
-                pivot_res2=row.get('pivot_res2'),
-                pivot_sup2=row.get('pivot_sup2'),
-                minor_pivot=row.get('minor_pivot'),
-                minor_pivot_res1=row.get('minor_pivot_res1'),
-                minor_pivot_sup1=row.get('minor_pivot_sup1'),
-                minor_pivot_res2=row.get('minor_pivot_res2'),
-                minor_pivot_sup2=row.get('minor_pivot_sup2'),
-                fib_38_2=row.get('fib_38_2'),
-                fib_61_8=row.get('fib_61_8'),
-                sma_50=row.get('sma_50'),
-                sma_200=row.get('sma_200'),
-                stoch_k=row.get('stoch_k'),
-                stoch_d=row.get('stoch_d'),
-                cci=row.get('cci'),
-                atr=row.get('atr'),
-                obv=row.get('obv'),
-                williams_r=row.get('williams_r'),
-                head_and_shoulders=row.get('head_and_shoulders'),
-                harmonic_pattern=row.get('harmonic_pattern'),
-                wedge_pattern=row.get('wedge_pattern'),
-                triangle_pattern=row.get('triangle_pattern'),
-                double_top_pattern=row.get('double_top_pattern'),
-                double_bottom_pattern=row.get('double_bottom_pattern'),
-                fvg_pattern=row.get('fvg_pattern')
-            )
-            session.add(indicators)
-        session.commit()
-        logging.info(f"Stored indicators data for {symbol} at interval {interval} in database")
-    except Exception as e:
-        logging.error(f"Error storing indicators data in database: {e}", exc_info=True)
+def store_updates(updates):
+    """
+    Store downloaded or derived candles of many (symbol, interval) pairs and stream their indicators where possible.
 
-def update_database(symbol, interval):
-    try:
-        session.query(HistoricalData).delete()
-        session.query(Indicators).delete()
-        last_record = None
-        if last_record:
-            start_str = last_record.timestamp.strftime('%Y-%m-%dT%H:%M:%S')
-        else:
-            if interval == '15m':
-                start_str = '3 weeks ago UTC'
-            elif interval == '4h':
-                start_str = '25 weeks ago UTC'
-            elif interval == '1d':
-                start_str = '35 months ago UTC'
-        
-        data = fetch_historical_data(symbol, interval, start_str)
-        if not data.empty:
-            store_historical_data(symbol, interval, data)
-            indicators = calculate_indicators(data)
-            store_indicators_data(symbol, interval, indicators)
-    except Exception as e:
-        logging.error(f"Error updating database: {e}", exc_info=True)
+    Parameters:
+    updates (dict): (symbol, interval) -> (candles, last_timestamp).
 
-def periodic_update(symbol, interval):
-    try:
-        logging.info(f"Starting periodic update for {symbol} at interval {interval}")
-        session.query(HistoricalData).delete()
-        session.query(Indicators).delete()
-        last_record = None
-        if last_record:
-            start_str = last_record.timestamp.strftime('%Y-%m-%dT%H:%M:%S')
-        else:
-            if interval == '15m':
-                start_str = '3 weeks ago UTC'
-            elif interval == '4h':
-                start_str = '25 weeks ago UTC'
-            elif interval == '1d':
-                start_str = '35 months ago UTC'
-        
-        data = fetch_historical_data(symbol, interval, start_str)
-        if not data.empty:
-            store_historical_data(symbol, interval, data)
-            indicators = calculate_indicators(data)
-            store_indicators_data(symbol, interval, indicators)
-            logging.info(f"Periodic update completed for {symbol} at interval {interval}")
-        else:
-            logging.warning(f"No new data fetched for {symbol} at interval {interval}")
-    except Exception as e:
-        logging.error(f"Error during periodic update: {e}", exc_info=True)
+    Returns:
+    dict: (symbol, interval) -> (history, last_timestamp) of the series whose indicators must be recomputed in full.
+    """
+    pending = {}
+    for (symbol, interval), (data, last_timestamp) in updates.items():
+        try:
+            if not has_new_data(symbol, interval, data, last_timestamp):
+                continue
+            state = store_candles(symbol, interval, data, last_timestamp)
+            if state is not None:
+                store_streamed_indicators(symbol, interval, data, state)
+            else:
+                history = load_historical_data(symbol, interval) if last_timestamp else data
+                pending[(symbol, interval)] = (history, last_timestamp)
+        except Exception as e:
+            session.rollback()
+            logging.error(f"Error updating database for {symbol} at interval {interval}: {e}", exc_info=True)
+    return pending
+
+def update_databases(symbols, intervals, incremental=True):
+    """
+    Update many (symbol, interval) pairs, downloading all of them concurrently and running
+    full indicator recomputes in the process pool. Storing stays on the calling thread, which owns the session.
+    Intervals in DERIVED_INTERVALS are not downloaded but built from their base interval once it is stored.
+    """
+    derived = [interval for interval in intervals if interval in DERIVED_INTERVALS]
+    downloaded = list(dict.fromkeys(DERIVED_INTERVALS.get(interval, interval) for interval in intervals))
 
-def schedule_updates(symbols, intervals):
+    starts = {}
     for symbol in symbols:
-        for interval in intervals:
-            schedule.every(5).minutes.do(periodic_update, symbol=symbol, interval=interval)
+        for interval in downloaded:
+            try:
+                derived_from = [other for other in derived if DERIVED_INTERVALS[other] == interval]
+                starts[(symbol, interval)] = get_fetch_start(symbol, interval, incremental, derived_from)
+            except Exception as e:
+                logging.error(f"Error reading watermark for {symbol} at interval {interval}: {e}", exc_info=True)
+
+    results = kline_fetcher.fetch([(symbol, interval, start_ms) for (symbol, interval), (start_ms, _) in starts.items()])
+
+    # Series that cannot be streamed are recomputed in full, in parallel across processes
+    pending = store_updates({key: (results[key], last_timestamp) for key, (_, last_timestamp) in starts.items()})
+
+    updates = {}
+    for symbol in symbols:
+        for interval in derived:
+            try:
+                updates[(symbol, interval)] = derive_candles(symbol, interval, incremental)
+            except Exception as e:
+                logging.error(f"Error deriving {symbol} at interval {interval}: {e}", exc_info=True)
+    pending.update(store_updates(updates))
+
+    if pending:
+        computed, _ = compute_indicators_parallel({key: history for key, (history, _) in pending.items()})
+        for (symbol, interval), (history, last_timestamp) in pending.items():
+            try:
+                store_computed_indicators(symbol, interval, history, computed[(symbol, interval)], last_timestamp)
+            except Exception as e:
+                session.rollback()
+                logging.error(f"Error storing indicators for {symbol} at interval {interval}: {e}", exc_info=True)
+
+    # Bases are trimmed once the intervals derived from them have their indicators
+    for symbol in symbols:
+        for interval in dict.fromkeys(DERIVED_INTERVALS[other] for other in derived):
+            try:
+                trim_base_history(symbol, interval)
+            except Exception as e:
+                session.rollback()
+                logging.error(f"Error trimming {symbol} at interval {interval}: {e}", exc_info=True)
+
+def schedule_updates(symbols, intervals):
+    schedule.every(5).minutes.do(update_databases, symbols=symbols, intervals=intervals)
 
 def run_scheduler():
     while True:
@@ -678,16 +594,18 @@ def run_scheduler():
         time.sleep(1)
 
 def main(intervals=None):
+    """
+    Standalone entry point (`python fetch_data.py`) that only keeps the database up to date, every 5 minutes.
+    The analysis service (main.py) does not use it, it updates the database itself before each analysis run.
+    """
     if intervals is None:
         intervals = ['15m', '4h', '1d']  # Default intervals
 
     symbols = ['BTCUSDT', 'ETHUSDT']  # Example symbols
 
     # Initial data load
-    for symbol in symbols:
-        for interval in intervals:
-            logging.info(f"Processing interval {interval} for symbol {symbol}")
-            update_database(symbol, interval)
+    logging.info(f"Processing intervals {intervals} for symbols {symbols}")
+    update_databases(symbols, intervals)
 
     # Schedule periodic updates
     schedule_updates(symbols, intervals)
@@ -1,22 +1,97 @@
+import matplotlib
+# Charts are only ever written to files, Agg needs no display and is the fastest raster backend
+matplotlib.use('Agg')
+
 import pandas as pd
 import numpy as np
 import matplotlib.pyplot as plt
 import mplfinance as mpf
-from matplotlib.dates import DateFormatter
+from matplotlib.dates import DateFormatter, date2num
+from matplotlib.collections import PolyCollection
 import matplotlib.patches as patches
 
-def fig(symbol: str, exchange: str, interval: str, data : pd.DataFrame, support_resistance_areas: list):
+from indicators import CHART_COLUMNS
+
+# Candles drawn on the chart
+CHART_ROWS = 120
+PAYLOAD_COLUMNS = ['open', 'high', 'low', 'close', 'volume', *CHART_COLUMNS]
+
+MACD_BAR_WIDTH = {
+    '1d': 0.9,
+    '4h': 0.14,
+    '15m': 0.01
+}
+
+# One figure per process, cleared and drawn again for every chart instead of building a new one
+_template = None
+
+def _figure():
+    global _template
+    if _template is None:
+        figure, axes = plt.subplots(4, 1, figsize=(12, 8), sharex=True, gridspec_kw={'height_ratios': [6,1, 2, 2]})
+        _template = figure, tuple(axes)
+    figure, axes = _template
+    for ax in axes:
+        ax.clear()
+    for text in list(figure.texts):
+        text.remove()
+    return figure, axes
+
+def chart_payload(data: pd.DataFrame, rows: int = CHART_ROWS) -> dict:
+    """The last `rows` candles as plain NumPy arrays, which pickle much smaller and faster than the DataFrame."""
+    data = data.iloc[-rows:]
+    payload = {column: data[column].to_numpy(dtype=float) for column in PAYLOAD_COLUMNS}
+    payload['timestamp'] = data['timestamp'].to_numpy(dtype='datetime64[ns]').view('int64')
+    return payload
+
+def macd_colors(macd_diff: np.ndarray) -> np.ndarray:
+    """Histogram colours: green/red above/below zero, light when the bar shrinks compared to the previous one."""
+    macd_diff = np.asarray(macd_diff, dtype=float)
+    previous = np.concatenate([[0.0], macd_diff[:-1]])
+    # A previous bar of exactly 0 (or none at all) does not count as shrinking
+    has_previous = previous != 0
+    return np.where(
+        macd_diff > 0,
+        np.where(has_previous & (macd_diff < previous), 'lightgreen', 'green'),
+        np.where(has_previous & (macd_diff > previous), 'lightcoral', 'red'),
+    )
+
+def _histogram(ax, index: pd.DatetimeIndex, values: np.ndarray, colors: np.ndarray, width: float, **kwargs):
+    """Bars as one collection of rectangles, ax.bar adds and autoscales a patch per bar."""
+    left = date2num(index) - width / 2
+    right = left + width
+    zero = np.zeros_like(values)
+    vertices = np.stack([
+        np.column_stack([left, zero]), np.column_stack([left, values]),
+        np.column_stack([right, values]), np.column_stack([right, zero]),
+    ], axis=1)
+    bars = PolyCollection(np.nan_to_num(vertices), facecolors=colors, edgecolors='none', **kwargs)
+    ax.add_collection(bars)
+    ax.autoscale_view()
+    return bars
 
+def _mark_conflicts(support_resistance_areas: list):
+    """Flag areas that overlap an area of the other kind, they are drawn as lines only."""
+    if not support_resistance_areas:
+        return
+    start = np.array([area['startPrice'] for area in support_resistance_areas], dtype=float)
+    end = np.array([area['endPrice'] for area in support_resistance_areas], dtype=float)
+    text = np.array([area['text'] for area in support_resistance_areas])
+    overlap = ((start[:, None] < start[None, :]) & (start[None, :] < end[:, None])) | \
+              ((start[None, :] < start[:, None]) & (start[:, None] < end[None, :]))
+    conflict = (overlap & (text[:, None] != text[None, :])).any(axis=1)
+    for area, flag in zip(support_resistance_areas, conflict):
+        if flag:
+            area['conflict'] = True
+
+def draw(symbol: str, exchange: str, interval: str, payload: dict, support_resistance_areas: list):
+    """Draw the chart of a payload made by chart_payload into the figure template of this process and return the figure."""
     space = 0.2
-    
-    df = data
 
-    # cut older data but last 200 candles
-    df = data.iloc[-120:]
-    df.set_index('timestamp', inplace=True)
+    df = pd.DataFrame({column: payload[column] for column in PAYLOAD_COLUMNS},
+                      index=pd.DatetimeIndex(pd.to_datetime(payload['timestamp'], unit='ns'), name='timestamp'))
 
-    # Create the plot
-    fig, (ax1, axv, ax2, ax3) = plt.subplots(4, 1, figsize=(12, 8), sharex=True, gridspec_kw={'height_ratios': [6,1, 2, 2]})
+    fig, (ax1, axv, ax2, ax3) = _figure()
 
     # Plot candlestick chart
     mpf.plot(df, 
@@ -51,29 +126,9 @@ def fig(symbol: str, exchange: str, interval: str, data : pd.DataFrame, support_
     ax2.legend()
 
     # Plot MACD
-    macd_colors = []
-    for i in range(len(df['macd_diff'])):
-        macdi = df['macd_diff'].iloc[i]
-        macdo = df['macd_diff'].iloc[i-1] if i > 0 else None
-        if macdi > 0:
-            if macdo and macdi < macdo:  # Crossing from negative to positive
-                macd_colors.append('lightgreen')
-            else:
-                macd_colors.append('green')
-        else:
-            if macdo and macdi > macdo:  # Crossing from positive to negative
-                macd_colors.append('lightcoral')
-            else:
-                macd_colors.append('red')
-            
     ax3.plot(df.index, df['macd'], label='MACD', color='blue', linewidth=0.6)
     ax3.plot(df.index, df['macd_signal'], label='MACD Signal', color='orange', linewidth=0.6)
-    ax3.bar(df.index, df['macd_diff'], label='MACD Hist', color=macd_colors, alpha=0.8, width={
-            '1d': 0.9,
-            '4h': 0.14,
-            '15m': 0.01
-        }[interval]
-    )
+    _histogram(ax3, df.index, payload['macd_diff'], macd_colors(payload['macd_diff']), MACD_BAR_WIDTH[interval], label='MACD Hist', alpha=0.8)
     ax3.set_ylabel('MACD')
     ax3.legend()
 
@@ -91,14 +146,7 @@ def fig(symbol: str, exchange: str, interval: str, data : pd.DataFrame, support_
             ax.spines['bottom'].set_visible(False)    
 
     # Plot support and resistance areas as rectangles
-    for a1 in support_resistance_areas:
-        for a2 in support_resistance_areas:
-            if a1['text'] != a2['text'] and (
-                a1['startPrice'] < a2['startPrice'] < a1['endPrice'] or
-                a2['startPrice'] < a1['startPrice'] < a2['endPrice']
-            ):
-                a1['conflict'] = True
-                a2['conflict'] = True
+    _mark_conflicts(support_resistance_areas)
      
     # Add the last price dashed line and box
     last_price = df['close'].iloc[-1]
@@ -136,10 +184,20 @@ def fig(symbol: str, exchange: str, interval: str, data : pd.DataFrame, support_
     fig.text(0.01, 0.97, f"{symbol}  |  {exchange}  |  {interval}", fontsize=14, fontweight='bold', ha='left', color="gray")
 
     # Adjust layout and show plot
-    plt.tight_layout()
+    fig.tight_layout()
     # plt.show()
-    # Save the plot as an image
-    fig.savefig(f"charts/{exchange}_{symbol}_{interval}.png")
-    plt.close(fig)
+    return fig
+
+def render(symbol: str, exchange: str, interval: str, payload: dict, support_resistance_areas: list, output):
+    """
+    Draw the chart of a payload and save it as a PNG.
+
+    Args:
+        output: file name or binary file object the PNG is written to
+    """
+    draw(symbol, exchange, interval, payload, support_resistance_areas).savefig(output, format='png')
+
+def fig(symbol: str, exchange: str, interval: str, data : pd.DataFrame, support_resistance_areas: list):
+    render(symbol, exchange, interval, chart_payload(data), support_resistance_areas, f"charts/{exchange}_{symbol}_{interval}.png")
 
-# fig("BTCUSDT","BINANCE","4h",None)
\ No newline at end of file
+# fig("BTCUSDT","BINANCE","4h",None)
@@ -0,0 +1,115 @@
+import io
+import logging
+import time
+
+import numpy as np
+from PIL import Image
+
+# Compact encodings of rendered charts, straight from the RGBA buffer of a drawn matplotlib canvas.
+# Charts are mostly flat colours, so a 256 colour palette PNG is a fraction of the size of the default RGBA PNG
+# with no visible difference. WebP and JPEG are searched for the best quality that fits `target_bytes`.
+
+PNG = 'png'
+PALETTE_PNG = 'png_palette'
+WEBP = 'webp'
+JPEG = 'jpeg'
+
+EXTENSIONS = {PNG: 'png', PALETTE_PNG: 'png', WEBP: 'webp', JPEG: 'jpg'}
+
+# Encoding of the charts sent to Telegram, None for no size target
+CHART_FORMAT = PALETTE_PNG
+CHART_TARGET_BYTES = None
+
+MIN_QUALITY = 30
+MAX_QUALITY = 95
+PALETTE_COLORS = (256, 128, 64, 32)
+
+def canvas_image(figure):
+    """The drawn figure as an RGB image, without going through a file."""
+    figure.canvas.draw()
+    rgba = np.asarray(figure.canvas.buffer_rgba())
+    return Image.fromarray(rgba[..., :3])
+
+def _save(image, format, **params):
+    output = io.BytesIO()
+    image.save(output, format=format, **params)
+    return output.getvalue()
+
+def _lossy(image, format, target_bytes):
+    if target_bytes is None:
+        return _save(image, format, quality=MAX_QUALITY), MAX_QUALITY
+    # Highest quality that still fits, the lowest one when none does
+    low, high = MIN_QUALITY, MAX_QUALITY
+    best = None
+    while low <= high:
+        quality = (low + high) // 2
+        content = _save(image, format, quality=quality)
+        if len(content) <= target_bytes:
+            best = content, quality
+            low = quality + 1
+        else:
+            high = quality - 1
+    return best or (_save(image, format, quality=MIN_QUALITY), MIN_QUALITY)
+
+def _palette(image, target_bytes):
+    for colors in PALETTE_COLORS:
+        # Median cut keeps the faint fills (RSI band, Bollinger area) that the faster octree merges into white
+        content = _save(image.quantize(colors=colors, method=Image.Quantize.MEDIANCUT), 'PNG', optimize=True)
+        if target_bytes is None or len(content) <= target_bytes:
+            break
+    return content, colors
+
+def encode_image(image, format=CHART_FORMAT, target_bytes=CHART_TARGET_BYTES):
+    """
+    Encode an image in one of PNG, PALETTE_PNG, WEBP or JPEG.
+
+    Returns:
+    bytes, dict: The encoded image, and its format, extension, size, quality (or palette colours) and encode time.
+    """
+    started = time.perf_counter()
+    quality = None
+    if format == PNG:
+        content = _save(image, 'PNG')
+    elif format == PALETTE_PNG:
+        content, quality = _palette(image, target_bytes)
+    elif format == WEBP:
+        content, quality = _lossy(image, 'WEBP', target_bytes)
+    elif format == JPEG:
+        content, quality = _lossy(image, 'JPEG', target_bytes)
+    else:
+        raise ValueError(f"Unknown image format {format}")
+    info = {
+        'format': format,
+        'extension': EXTENSIONS[format],
+        'bytes': len(content),
+        'quality': quality,
+        'encode_time': time.perf_counter() - started,
+    }
+    if target_bytes is not None and len(content) > target_bytes:
+        logging.warning(f"Chart is {len(content)} bytes as {format}, over the target of {target_bytes}")
+    return content, info
+
+def encode_figure(figure, format=CHART_FORMAT, target_bytes=CHART_TARGET_BYTES):
+    """Draw a figure and encode it in memory, see encode_image."""
+    return encode_image(canvas_image(figure), format, target_bytes)
+
+def benchmark(figure=None, target_bytes=100_000):
+    """Size and encode time of a chart in every format, against the default savefig PNG."""
+    if figure is None:
+        from chart_pool import _sample_payload
+        from fma_chart import draw
+        figure = draw('BTCUSDT', 'BINANCE', '4h', _sample_payload(), [])
+
+    started = time.perf_counter()
+    output = io.BytesIO()
+    figure.savefig(output, format='png')
+    print(f"savefig png: {len(output.getvalue())} bytes in {time.perf_counter() - started:.3f}s")
+
+    image = canvas_image(figure)
+    for format in (PNG, PALETTE_PNG, WEBP, JPEG):
+        for target in (None, target_bytes):
+            content, info = encode_image(image, format, target)
+            print(f"{format} (target {target}): {info['bytes']} bytes, quality {info['quality']}, in {info['encode_time']:.3f}s")
+
+if __name__ == "__main__":
+    benchmark()
@@ -0,0 +1,121 @@
+import logging
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from indicators import calculate_indicators
+from worker_context import worker_context
+
+# Parallel calculate_indicators over many (symbol, interval) series.
+# Jobs travel to the workers as plain NumPy column arrays and come back the same way,
+# which pickles far smaller and faster than DataFrames.
+
+CANDLE_COLUMNS = ['timestamp', 'open', 'high', 'low', 'close', 'volume']
+
+_pool = None
+_pool_workers = None
+
+def get_pool(max_workers=None):
+    """Return the process pool, started once and kept warm (pandas_ta already imported) between refreshes."""
+    global _pool, _pool_workers
+    max_workers = max_workers or os.cpu_count()
+    if _pool is None or _pool_workers != max_workers:
+        shutdown_pool()
+        # Workers come from a fork server that imports only the worker modules, see worker_context
+        _pool = ProcessPoolExecutor(max_workers=max_workers, mp_context=worker_context())
+        _pool_workers = max_workers
+    return _pool
+
+def shutdown_pool():
+    global _pool, _pool_workers
+    if _pool is not None:
+        _pool.shutdown()
+        _pool = None
+        _pool_workers = None
+
+def _warm(_):
+    return os.getpid()
+
+def _to_arrays(data):
+    arrays = {column: data[column].to_numpy(dtype=float) for column in CANDLE_COLUMNS[1:]}
+    arrays['timestamp'] = data['timestamp'].to_numpy(dtype='datetime64[ns]').view('int64')
+    return arrays
+
+def _compute(job):
+    key, arrays = job
+    started = time.perf_counter()
+    data = pd.DataFrame(arrays)
+    data['timestamp'] = pd.to_datetime(data['timestamp'], unit='ns')
+    result = calculate_indicators(data)
+    columns = {
+        column: result[column].to_numpy()
+        for column in result.columns if column not in CANDLE_COLUMNS
+    }
+    return key, columns, time.perf_counter() - started
+
+def compute_indicators_parallel(frames, max_workers=None, chunksize=1):
+    """
+    Run calculate_indicators for many series in the process pool.
+
+    Parameters:
+    frames (dict): (symbol, interval) -> DataFrame with ['timestamp', 'open', 'high', 'low', 'close', 'volume'].
+    max_workers (int): Pool size, all cores by default.
+    chunksize (int): Jobs sent to a worker at once, raise it when there are many short series.
+
+    Returns:
+    dict, dict: (symbol, interval) -> DataFrame of candles and indicators like calculate_indicators returns,
+                and (symbol, interval) -> seconds spent computing in the worker.
+    """
+    started = time.perf_counter()
+    jobs = [(key, _to_arrays(data)) for key, data in frames.items()]
+
+    results = {}
+    timings = {}
+    for key, columns, elapsed in get_pool(max_workers).map(_compute, jobs, chunksize=chunksize):
+        data = frames[key][CANDLE_COLUMNS].reset_index(drop=True)
+        if columns:
+            data = pd.concat([data, pd.DataFrame(columns)], axis=1)
+        else:
+            # calculate_indicators failed in the worker and already logged why
+            data = pd.DataFrame()
+        results[key] = data
+        timings[key] = elapsed
+        logging.info(f"Calculated indicators for {key[0]} at interval {key[1]} in {elapsed:.2f}s")
+
+    total = time.perf_counter() - started
+    busy = sum(timings.values())
+    logging.info(f"Calculated indicators for {len(jobs)} series in {total:.2f}s ({busy:.2f}s of worker time)")
+    return results, timings
+
+def benchmark(series=16, rows=2000):
+    """Compare serial calculate_indicators with the process pool on random 15m series."""
+    rng = np.random.default_rng(0)
+    frames = {}
+    for i in range(series):
+        close = 100 + np.cumsum(rng.normal(0, 1, rows))
+        frames[(f"SYM{i}USDT", '15m')] = pd.DataFrame({
+            'timestamp': pd.date_range('2024-01-01', periods=rows, freq='15min'),
+            'open': close,
+            'high': close + 1,
+            'low': close - 1,
+            'close': close,
+            'volume': rng.uniform(10, 1000, rows),
+        })
+
+    started = time.perf_counter()
+    for data in frames.values():
+        calculate_indicators(data.copy())
+    serial = time.perf_counter() - started
+
+    # Exclude worker start-up from the measurement
+    list(get_pool().map(_warm, range(os.cpu_count())))
+    started = time.perf_counter()
+    compute_indicators_parallel(frames)
+    parallel = time.perf_counter() - started
+    print(f"{series} series x {rows} rows: serial {serial:.2f}s, pool {parallel:.2f}s on {os.cpu_count()} cores")
+
+if __name__ == "__main__":
+    benchmark()
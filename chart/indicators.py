@@ -0,0 +1,299 @@
+import pandas as pd
+import pandas_ta as ta
+from pandas_ta.utils import non_zero_range
+import logging
+import numpy as np
+import patterns
+
+# Indicator and pattern computation on a candle DataFrame.
+# This module has no side effects on import (no API clients or database connections),
+# so it can be loaded by worker processes.
+
+# Indicator registry.
+# Every entry declares the columns it reads (candle columns or outputs of other entries), its
+# parameters and the columns it writes. compute_indicators resolves the requested columns to the
+# entries producing them and their dependencies and runs each entry once, so intermediates shared
+# by several indicators (EMAs, true range, rolling highs and lows) are computed a single time.
+
+CANDLE_COLUMNS = ['timestamp', 'open', 'high', 'low', 'close', 'volume']
+
+class Indicator:
+
+    name: str
+    inputs: list
+    outputs: list
+    params: dict
+
+    def __init__(self, name, inputs, outputs, compute, params):
+        self.name = name
+        self.inputs = inputs
+        self.outputs = outputs
+        self.compute = compute
+        self.params = params
+
+    def __call__(self, data):
+        """Write the outputs of this entry into `data`, a DataFrame that already holds all of its inputs."""
+        values = self.compute(data, **self.params)
+        if len(self.outputs) == 1:
+            values = (values,)
+        elif values is None:
+            values = (None,) * len(self.outputs)
+        for column, value in zip(self.outputs, values):
+            data[column] = value
+
+# Entry name -> Indicator and output column -> entry name
+INDICATORS = {}
+PRODUCERS = {}
+
+def register(name, inputs, outputs, **params):
+    """Decorator adding `compute(data, **params)` to the registry, it returns one Series per output."""
+    def decorator(compute):
+        INDICATORS[name] = Indicator(name, inputs, outputs, compute, params)
+        for column in outputs:
+            PRODUCERS[column] = name
+        return compute
+    return decorator
+
+def resolve(columns):
+    """Return the names of the entries needed for `columns`, each after the entries it depends on."""
+    order = []
+    visiting = set()
+
+    def visit(column):
+        if column in CANDLE_COLUMNS:
+            return
+        if column not in PRODUCERS:
+            raise ValueError(f"Unknown indicator column: {column}")
+        name = PRODUCERS[column]
+        if name in order:
+            return
+        if name in visiting:
+            raise ValueError(f"Circular indicator dependency through {name}")
+        visiting.add(name)
+        for dependency in INDICATORS[name].inputs:
+            visit(dependency)
+        visiting.discard(name)
+        order.append(name)
+
+    for column in columns:
+        visit(column)
+    return order
+
+def compute_indicators(data, columns):
+    """
+    Add the requested indicator columns to the candles in `data`, computing nothing else than
+    them and what they depend on.
+
+    Parameters:
+    data (DataFrame): A DataFrame with columns ['timestamp', 'open', 'high', 'low', 'close', 'volume'].
+    columns (list): Registered columns, e.g. CHART_COLUMNS.
+
+    Returns:
+    DataFrame: `data` with the requested columns, intermediates that were not requested are dropped.
+    """
+    order = resolve(columns)
+    for name in order:
+        INDICATORS[name](data)
+    requested = set(columns)
+    intermediates = [column for name in order for column in INDICATORS[name].outputs if column not in requested]
+    return data.drop(columns=intermediates) if intermediates else data
+
+# Shared intermediates
+
+for length in (25, 50, 100, 200):
+    @register(f'ema_{length}', ['close'], [f'ema_{length}'], length=length)
+    def _ema(data, length):
+        # Leading values are 0 rather than NaN, as the EMA columns have always been stored
+        ema = ta.ema(data['close'], length=length)
+        return ema.fillna(0) if ema is not None else 0
+
+@register('true_range', ['high', 'low', 'close'], ['true_range'])
+def _true_range(data):
+    return ta.true_range(data['high'], data['low'], data['close'])
+
+for length in (14, 20):
+    @register(f'rolling_extremes_{length}', ['high', 'low'], [f'highest_high_{length}', f'lowest_low_{length}'], length=length)
+    def _rolling_extremes(data, length):
+        return data['high'].rolling(length).max(), data['low'].rolling(length).min()
+
+# Indicators, in the order of the indicators table
+
+@register('rsi', ['close'], ['rsi'])
+def _rsi(data):
+    return ta.rsi(data['close'], length=14)
+
+@register('macd', ['close'], ['macd', 'macd_signal', 'macd_diff'])
+def _macd(data):
+    macd = ta.macd(data['close'])
+    if macd is None:
+        return None
+    return macd['MACD_12_26_9'], macd['MACDs_12_26_9'], macd['MACDh_12_26_9']
+
+@register('bollinger', ['close'], ['bollinger_hband', 'bollinger_mband', 'bollinger_lband'])
+def _bollinger(data):
+    bbands = ta.bbands(data['close'], length=20, std=2)
+    if bbands is None:
+        return None
+    return bbands['BBU_20_2.0'], bbands['BBM_20_2.0'], bbands['BBL_20_2.0']
+
+for length in (50, 200):
+    @register(f'sma_{length}', ['close'], [f'sma_{length}'], length=length)
+    def _sma(data, length):
+        return ta.sma(data['close'], length=length)
+
+@register('stoch', ['close', 'highest_high_14', 'lowest_low_14'], ['stoch_k', 'stoch_d'])
+def _stoch(data):
+    # ta.stoch(high, low, close) with its defaults k=14, d=3, smooth_k=3
+    stoch = 100 * (data['close'] - data['lowest_low_14']) / non_zero_range(data['highest_high_14'], data['lowest_low_14'])
+    stoch_k = stoch.rolling(3).mean()
+    return stoch_k, stoch_k.rolling(3).mean()
+
+@register('cci', ['high', 'low', 'close'], ['cci'])
+def _cci(data):
+    return ta.cci(data['high'], data['low'], data['close'], length=20)
+
+@register('atr', ['true_range'], ['atr'])
+def _atr(data):
+    # ta.atr(high, low, close, length=14) is the RMA of the true range
+    return ta.rma(data['true_range'], length=14)
+
+@register('obv', ['close', 'volume'], ['obv'])
+def _obv(data):
+    return ta.obv(data['close'], data['volume'])
+
+@register('williams_r', ['close', 'highest_high_14', 'lowest_low_14'], ['williams_r'])
+def _williams_r(data):
+    # ta.willr(high, low, close, length=14)
+    highest, lowest = data['highest_high_14'], data['lowest_low_14']
+    return 100 * ((data['close'] - lowest) / (highest - lowest) - 1)
+
+for short, long in ((25, 50), (25, 100), (25, 200), (50, 100), (50, 200), (100, 200)):
+    @register(f'ema_{short}_cross_ema_{long}', [f'ema_{short}', f'ema_{long}'], [f'ema_{short}_cross_ema_{long}'], short=short, long=long)
+    def _ema_cross(data, short, long):
+        return detect_ema_cross(data[f'ema_{short}'], data[f'ema_{long}'])
+
+PIVOT_COLUMNS = ['pivot', 'pivot_res1', 'pivot_sup1', 'pivot_res2', 'pivot_sup2']
+MINOR_PIVOT_COLUMNS = ['minor_pivot', 'minor_pivot_res1', 'minor_pivot_sup1', 'minor_pivot_res2', 'minor_pivot_sup2']
+
+@register('pivots', ['high', 'low', 'close'], PIVOT_COLUMNS)
+def _pivots(data):
+    pivots = calculate_major_pivots(data[['high', 'low', 'close']].copy())
+    return [pivots[column] for column in PIVOT_COLUMNS]
+
+@register('minor_pivots', ['high', 'low', 'close'], MINOR_PIVOT_COLUMNS)
+def _minor_pivots(data):
+    pivots = calculate_minor_pivots(data[['high', 'low', 'close']].copy())
+    return [pivots[column] for column in MINOR_PIVOT_COLUMNS]
+
+@register('fibonacci', ['highest_high_20', 'lowest_low_20'], ['fib_38_2', 'fib_61_8'])
+def _fibonacci(data):
+    return fibonacci_levels(data['highest_high_20'], data['lowest_low_20'])
+
+for column, detect in (
+    ('fvg_pattern', patterns.detect_fvg),
+    ('head_and_shoulders', patterns.detect_head_and_shoulders),
+    ('harmonic_pattern', patterns.detect_harmonic_pattern),
+    ('wedge_pattern', patterns.detect_wedge),
+    ('triangle_pattern', patterns.detect_triangle),
+    ('double_top_pattern', patterns.detect_double_top),
+    ('double_bottom_pattern', patterns.detect_double_bottom),
+):
+    @register(column, ['open', 'high', 'low', 'close'], [column], detect=detect)
+    def _pattern(data, detect):
+        return detect(data)
+
+# Columns stored in the indicators table, in their stored order
+INDICATOR_COLUMNS = [
+    'rsi', 'macd', 'macd_signal', 'macd_diff', 'bollinger_hband', 'bollinger_mband', 'bollinger_lband',
+    'ema_25', 'ema_50', 'ema_100', 'ema_200', 'sma_50', 'sma_200', 'stoch_k', 'stoch_d',
+    'cci', 'atr', 'obv', 'williams_r',
+    'ema_25_cross_ema_50', 'ema_25_cross_ema_100', 'ema_25_cross_ema_200',
+    'ema_50_cross_ema_100', 'ema_50_cross_ema_200', 'ema_100_cross_ema_200',
+    *PIVOT_COLUMNS, *MINOR_PIVOT_COLUMNS, 'fib_38_2', 'fib_61_8',
+    'fvg_pattern', 'head_and_shoulders', 'harmonic_pattern', 'wedge_pattern',
+    'triangle_pattern', 'double_top_pattern', 'double_bottom_pattern',
+]
+
+# Columns drawn by fma_chart.fig
+CHART_COLUMNS = [
+    'ema_50', 'ema_200', 'bollinger_hband', 'bollinger_mband', 'bollinger_lband',
+    'rsi', 'macd', 'macd_signal', 'macd_diff',
+]
+
+# Indicators and Oscillator Calculation
+def calculate_indicators(data):
+    try:
+        data = compute_indicators(data, INDICATOR_COLUMNS)
+        logging.info("Calculated RSI, MACD, Bollinger Bands, EMA crosses, major and minor pivots, Fibonacci levels, SMAs, Stochastic, CCI, ATR, OBV, and Williams %R")
+        return data
+    except Exception as e:
+        logging.error(f"Error calculating indicators: {e}", exc_info=True)
+        return pd.DataFrame()
+
+def detect_ema_cross(ema_short, ema_long):
+    cross_up = (ema_short.shift(1) <= ema_long.shift(1)) & (ema_short > ema_long)
+    cross_down = (ema_short.shift(1) >= ema_long.shift(1)) & (ema_short < ema_long)
+    return cross_up.astype(int) - cross_down.astype(int)
+
+  
+def calculate_major_pivots(data):
+    """
+    Calculate major pivot points for given price data.
+    
+    Parameters:
+    data (DataFrame): A DataFrame with columns ['high', 'low', 'close'].
+    
+    Returns:
+    DataFrame: The original DataFrame with additional columns for major pivots and their support and resistance levels.
+    """
+    data['pivot'] = (data['high'].shift(1) + data['low'].shift(1) + data['close'].shift(1)) / 3
+    data['pivot_res1'] = 2 * data['pivot'] - data['low'].shift(1)
+    data['pivot_sup1'] = 2 * data['pivot'] - data['high'].shift(1)
+    data['pivot_res2'] = data['pivot'] + (data['high'].shift(1) - data['low'].shift(1))
+    data['pivot_sup2'] = data['pivot'] - (data['high'].shift(1) - data['low'].shift(1))
+    
+    return data
+
+def calculate_minor_pivots(data, window=10):
+    """
+    Calculate minor pivot points for given price data.
+    
+    Parameters:
+    data (DataFrame): A DataFrame with columns ['high', 'low', 'close'].
+    window (int): The number of periods to use for rolling calculations (default is 10).
+    
+    Returns:
+    DataFrame: The original DataFrame with additional columns for minor pivots and their support and resistance levels.
+    """
+    if len(data) < window:
+        raise ValueError("Not enough data to calculate minor pivots")
+    
+    high = data['high'].rolling(window=window, min_periods=1).max()
+    low = data['low'].rolling(window=window, min_periods=1).min()
+    close = data['close'].shift(-(window-1)).rolling(window=window, min_periods=1).apply(lambda x: x[0] if len(x) == window else np.nan, raw=True)
+
+    pivot = (high + low + close) / 3
+    res1 = 2 * pivot - low
+    sup1 = 2 * pivot - high
+    res2 = pivot + (high - low)
+    sup2 = pivot - (high - low)
+
+    data['minor_pivot'] = pivot
+    data['minor_pivot_res1'] = res1
+    data['minor_pivot_sup1'] = sup1
+    data['minor_pivot_res2'] = res2
+    data['minor_pivot_sup2'] = sup2
+    
+    return data
+
+def calculate_fibonacci_levels(data):
+    try:
+        data['fib_38_2'], data['fib_61_8'] = fibonacci_levels(data['high'].rolling(window=20).max(), data['low'].rolling(window=20).min())
+        return data
+    except Exception as e:
+        logging.error(f"Error calculating Fibonacci levels: {e}", exc_info=True)
+        return data
+
+def fibonacci_levels(high, low):
+    """Return the 38.2% and 61.8% retracements between a rolling high and low."""
+    return high - 0.382 * (high - low), high - 0.618 * (high - low)
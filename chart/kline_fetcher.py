@@ -0,0 +1,243 @@
+import logging
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+import pandas as pd
+import requests
+
+# Concurrent kline download straight from the Binance REST API.
+# Every (symbol, interval, time range) job is split into pages of at most KLINES_LIMIT candles,
+# all pages are fetched from a thread pool, and a token bucket keeps the total request weight
+# under Binance's per-minute limit.
+
+BINANCE_API_URL = 'https://api.binance.com'
+KLINES_LIMIT = 1000
+# Request weight of GET /api/v3/klines with limit 1000
+KLINES_WEIGHT = 2
+# Binance allows 6000 weight per minute per IP, keep some headroom for other callers
+WEIGHT_PER_MINUTE = 5000
+
+INTERVAL_MS = {
+    '1m': 60_000,
+    '3m': 3 * 60_000,
+    '5m': 5 * 60_000,
+    '15m': 15 * 60_000,
+    '30m': 30 * 60_000,
+    '1h': 3_600_000,
+    '2h': 2 * 3_600_000,
+    '4h': 4 * 3_600_000,
+    '6h': 6 * 3_600_000,
+    '8h': 8 * 3_600_000,
+    '12h': 12 * 3_600_000,
+    '1d': 86_400_000,
+    '3d': 3 * 86_400_000,
+    '1w': 7 * 86_400_000,
+}
+
+KLINE_COLUMNS = ['timestamp', 'open', 'high', 'low', 'close', 'volume', 'close_time', 'quote_asset_volume', 'number_of_trades', 'taker_buy_base_asset_volume', 'taker_buy_quote_asset_volume', 'ignore']
+
+def klines_to_dataframe(klines):
+    """Convert raw Binance klines to the ['timestamp', 'open', 'high', 'low', 'close', 'volume'] frame used everywhere."""
+    if not klines:
+        return pd.DataFrame(columns=['timestamp', 'open', 'high', 'low', 'close', 'volume'])
+    data = pd.DataFrame(klines, columns=KLINE_COLUMNS)
+    data['timestamp'] = pd.to_datetime(data['timestamp'], unit='ms')
+    data = data.astype({'open': 'float', 'high': 'float', 'low': 'float', 'close': 'float', 'volume': 'float'})
+    return data[['timestamp', 'open', 'high', 'low', 'close', 'volume']]
+
+class WeightRateLimiter:
+    """
+    Token bucket over Binance request weight.
+
+    Tokens refill continuously at `weight_per_minute / 60` per second. The bucket is also synced
+    down to the weight Binance reports as used, and can be paused as a whole after a 429/418.
+    """
+
+    def __init__(self, weight_per_minute=WEIGHT_PER_MINUTE):
+        self.capacity = weight_per_minute
+        self.rate = weight_per_minute / 60
+        self.tokens = float(weight_per_minute)
+        self.updated = time.monotonic()
+        self.resume_at = 0.0
+        self.lock = threading.Lock()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self, weight):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self._refill(now)
+                if now >= self.resume_at and self.tokens >= weight:
+                    self.tokens -= weight
+                    return
+                wait = max(self.resume_at - now, (weight - self.tokens) / self.rate)
+            time.sleep(wait)
+
+    def observe_used_weight(self, used_weight):
+        """Sync with the X-MBX-USED-WEIGHT-1M header so that other clients on the same IP are accounted for."""
+        with self.lock:
+            self._refill(time.monotonic())
+            self.tokens = min(self.tokens, self.capacity - used_weight)
+
+    def pause(self, seconds):
+        with self.lock:
+            self.resume_at = max(self.resume_at, time.monotonic() + seconds)
+            self.tokens = 0.0
+
+class KlineFetcher:
+    """Fetch klines for many (symbol, interval, start, end) jobs in parallel."""
+
+    base_url: str
+    limiter: WeightRateLimiter
+    max_workers: int
+    max_retries: int
+    timeout: float
+
+    def __init__(self, base_url=BINANCE_API_URL, max_workers=8, weight_per_minute=WEIGHT_PER_MINUTE, max_retries=5, timeout=10):
+        self.base_url = base_url.rstrip('/')
+        self.limiter = WeightRateLimiter(weight_per_minute)
+        self.max_workers = max_workers
+        self.max_retries = max_retries
+        self.timeout = timeout
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=max_workers, pool_maxsize=max_workers)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def _get_page(self, symbol, interval, start_ms, end_ms):
+        params = {'symbol': symbol, 'interval': interval, 'startTime': start_ms, 'endTime': end_ms, 'limit': KLINES_LIMIT}
+        for attempt in range(self.max_retries + 1):
+            self.limiter.acquire(KLINES_WEIGHT)
+            try:
+                response = self.session.get(f"{self.base_url}/api/v3/klines", params=params, timeout=self.timeout)
+            except requests.RequestException as e:
+                delay = min(60, 2 ** attempt) + random.uniform(0, 1)
+                logging.warning(f"Kline request for {symbol} {interval} failed ({e}), retrying in {delay:.1f}s")
+                time.sleep(delay)
+                continue
+
+            used_weight = response.headers.get('X-MBX-USED-WEIGHT-1M')
+            if used_weight:
+                self.limiter.observe_used_weight(int(used_weight))
+
+            if response.status_code in (418, 429):
+                # 429 is a rate limit warning, 418 an IP ban; both say how long to stay away
+                delay = max(float(response.headers.get('Retry-After', 0)), min(60, 2 ** attempt)) + random.uniform(0, 1)
+                logging.warning(f"Binance answered {response.status_code} for {symbol} {interval}, pausing all requests for {delay:.1f}s")
+                self.limiter.pause(delay)
+                continue
+            if response.status_code >= 500:
+                delay = min(60, 2 ** attempt) + random.uniform(0, 1)
+                logging.warning(f"Binance answered {response.status_code} for {symbol} {interval}, retrying in {delay:.1f}s")
+                time.sleep(delay)
+                continue
+
+            response.raise_for_status()
+            return response.json()
+        raise RuntimeError(f"Giving up on klines for {symbol} {interval} from {start_ms} after {self.max_retries} retries")
+
+    def _pages(self, interval, start_ms, end_ms):
+        page_ms = KLINES_LIMIT * INTERVAL_MS[interval]
+        start = start_ms - start_ms % INTERVAL_MS[interval]
+        while start <= end_ms:
+            yield start, min(start + page_ms - 1, end_ms)
+            start += page_ms
+
+    def fetch(self, jobs):
+        """
+        Fetch all jobs concurrently.
+
+        Parameters:
+        jobs (list): (symbol, interval, start_ms) or (symbol, interval, start_ms, end_ms) tuples, end defaults to now.
+
+        Returns:
+        dict: (symbol, interval) -> DataFrame with ['timestamp', 'open', 'high', 'low', 'close', 'volume'],
+              an empty DataFrame for jobs that failed.
+        """
+        now_ms = int(datetime.now(timezone.utc).timestamp() * 1000)
+        pages = []
+        for job in jobs:
+            symbol, interval, start_ms = job[:3]
+            end_ms = job[3] if len(job) > 3 and job[3] is not None else now_ms
+            pages.extend((symbol, interval, start, end) for start, end in self._pages(interval, start_ms, end_ms))
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='kline_fetcher') as executor:
+            futures = [(page, executor.submit(self._get_page, *page)) for page in pages]
+
+            klines = {}
+            failed = set()
+            for (symbol, interval, start, end), future in futures:
+                try:
+                    klines.setdefault((symbol, interval), []).extend(future.result())
+                except Exception as e:
+                    logging.error(f"Error fetching klines for {symbol} at interval {interval}: {e}", exc_info=True)
+                    failed.add((symbol, interval))
+
+        results = {}
+        for job in jobs:
+            key = (job[0], job[1])
+            if key in failed:
+                results[key] = klines_to_dataframe([])
+                continue
+            data = klines_to_dataframe(klines.get(key, []))
+            results[key] = data.drop_duplicates('timestamp', keep='last').sort_values('timestamp').reset_index(drop=True)
+        logging.info(f"Fetched {len(pages)} kline pages for {len(jobs)} jobs in {time.perf_counter() - started:.2f}s")
+        return results
+
+def test(symbols=20, candles=3000):
+    """Fetch from a local stand-in for the Binance klines endpoint that rate limits every 25th request."""
+    import json
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+    from urllib.parse import parse_qs, urlparse
+
+    interval_ms = INTERVAL_MS['15m']
+    first_ms = 1_700_000_000_000 - 1_700_000_000_000 % interval_ms
+    counter = {'requests': 0, 'limited': 0}
+    counter_lock = threading.Lock()
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            with counter_lock:
+                counter['requests'] += 1
+                limited = counter['requests'] % 25 == 0
+                counter['limited'] += limited
+            if limited:
+                self.send_response(429)
+                self.send_header('Retry-After', '1')
+                self.end_headers()
+                return
+            query = {key: values[0] for key, values in parse_qs(urlparse(self.path).query).items()}
+            start = max(int(query['startTime']), first_ms)
+            end = min(int(query['endTime']), first_ms + (candles - 1) * interval_ms)
+            open_times = range(start - (start - first_ms) % interval_ms, end + 1, interval_ms)
+            body = json.dumps([[t, '1', '2', '0.5', '1.5', '10', t + interval_ms - 1, '0', 0, '0', '0', '0'] for t in list(open_times)[:int(query['limit'])]])
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('X-MBX-USED-WEIGHT-1M', str(counter['requests'] * KLINES_WEIGHT))
+            self.end_headers()
+            self.wfile.write(body.encode())
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        fetcher = KlineFetcher(base_url=f"http://127.0.0.1:{server.server_port}", weight_per_minute=60_000)
+        jobs = [(f"SYM{i}USDT", '15m', first_ms, first_ms + (candles - 1) * interval_ms) for i in range(symbols)]
+        results = fetcher.fetch(jobs)
+        for (symbol, interval), data in results.items():
+            assert len(data) == candles, f"{symbol}: {len(data)} candles"
+            assert data['timestamp'].is_monotonic_increasing
+        print(f"Fetched {symbols} x {candles} candles with {counter['requests']} requests, {counter['limited']} answered 429")
+    finally:
+        server.shutdown()
+
+# test()
@@ -0,0 +1,309 @@
+import numpy as np
+import pandas as pd
+from numpy.lib.stride_tricks import sliding_window_view
+
+# Vectorized versions of the loop pattern detectors in patterns_reference.py.
+# Each function takes the same arguments and returns the same 0/1 float array as its
+# loop counterpart, assuming a RangeIndex and finite OHLC prices like the ones fetched from Binance.
+
+def _column(data, name):
+    return data[name].to_numpy(dtype=float)
+
+def _windows(values, window):
+    """Windows values[i-window:i] for every i in range(window, len(values)), one per row."""
+    return sliding_window_view(values, window)[:len(values) - window]
+
+def _slopes(highs, lows, window):
+    high_slope = (highs[:, -1] - highs[:, 0]) / window
+    low_slope = (lows[:, -1] - lows[:, 0]) / window
+    return high_slope, low_slope
+
+def _between(values, center, tolerance):
+    return (center - tolerance <= values) & (values <= center + tolerance)
+
+def detect_fvg(data, window=10):
+    """
+    Detect Fair Value Gaps (FVG) in the given price data.
+
+    A candle is a gap when its low is above the high, or its high below the low, of any of the
+    `window` previous candles, which is the same as comparing against the window minimum high
+    and maximum low.
+
+    Parameters:
+    data (DataFrame): A DataFrame with columns ['high', 'low'].
+    window (int): The number of periods to look back for detecting gaps (default is 10).
+
+    Returns:
+    np.array: An array indicating the presence of FVGs (1 if detected, else 0).
+    """
+    patterns = np.zeros(len(data))
+    if len(data) <= window:
+        return patterns
+
+    high = _column(data, 'high')
+    low = _column(data, 'low')
+
+    # Missing prices never match in the loop version
+    min_prev_high = _windows(np.where(np.isnan(high), np.inf, high), window).min(axis=1)
+    max_prev_low = _windows(np.where(np.isnan(low), -np.inf, low), window).max(axis=1)
+
+    gap = (low[window:] > min_prev_high) | (high[window:] < max_prev_low)
+    patterns[window:][gap] = 1
+    return patterns
+
+def _second_extreme(windows, first_idx, fill):
+    """Return the windows with the element at first_idx of every row replaced by fill."""
+    rest = windows.copy()
+    rest[np.arange(len(rest)), first_idx] = fill
+    return rest
+
+def detect_double_top(data, window=10, tolerance=0.02):
+    """
+    Detect double top patterns in the given price data.
+
+    Parameters:
+    data (DataFrame): A DataFrame with columns ['high', 'low', 'close'].
+    window (int): The number of periods to use for the rolling window to detect peaks.
+    tolerance (float): The tolerance level for peak matching.
+
+    Returns:
+    np.array: An array indicating the presence of double top patterns (1 if detected, else 0).
+    """
+    patterns = np.zeros(len(data))
+    if len(data) <= window or window < 2:
+        return patterns
+
+    highs = _windows(_column(data, 'high'), window)
+    close = _column(data, 'close')[window:]
+    rows = np.arange(len(highs))
+
+    max1_idx = highs.argmax(axis=1)
+    max1 = highs[rows, max1_idx]
+    rest = _second_extreme(highs, max1_idx, -np.inf)
+    max2_idx = rest.argmax(axis=1)
+    max2 = rest[rows, max2_idx]
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        found = (
+            (max2_idx >= max1_idx)
+            & (np.abs(max1 - max2) / max1 < tolerance)
+            & (close < highs.mean(axis=1))
+        )
+    patterns[window:][found] = 1
+    return patterns
+
+def detect_double_bottom(data, window=10, tolerance=0.02):
+    """
+    Detect double bottom patterns in the given price data.
+
+    Like the loop version, the position of the second trough is taken with idxmax of the
+    remaining lows, so the ordering check matches it exactly.
+
+    Parameters:
+    data (DataFrame): A DataFrame with columns ['high', 'low', 'close'].
+    window (int): The number of periods to use for the rolling window to detect troughs.
+    tolerance (float): The tolerance level for trough matching.
+
+    Returns:
+    np.array: An array indicating the presence of double bottom patterns (1 if detected, else 0).
+    """
+    patterns = np.zeros(len(data))
+    if len(data) <= window or window < 2:
+        return patterns
+
+    lows = _windows(_column(data, 'low'), window)
+    close = _column(data, 'close')[window:]
+    rows = np.arange(len(lows))
+
+    min1_idx = lows.argmin(axis=1)
+    min1 = lows[rows, min1_idx]
+    min2 = _second_extreme(lows, min1_idx, np.inf).min(axis=1)
+    min2_idx = _second_extreme(lows, min1_idx, -np.inf).argmax(axis=1)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        found = (
+            (min2_idx >= min1_idx)
+            & (np.abs(min1 - min2) / min1 < tolerance)
+            & (close > lows.mean(axis=1))
+        )
+    patterns[window:][found] = 1
+    return patterns
+
+def detect_triangle(data, window=10, tolerance=0.02):
+    """
+    Detect triangle patterns in the given price data.
+
+    Parameters:
+    data (DataFrame): A DataFrame with columns ['high', 'low'].
+    window (int): The number of periods to use for the rolling window to detect trend lines.
+    tolerance (float): The tolerance level for pattern matching.
+
+    Returns:
+    np.array: An array indicating the presence of triangle patterns (1 if detected, else 0).
+    """
+    patterns = np.zeros(len(data))
+    if len(data) <= window:
+        return patterns
+
+    highs = _windows(_column(data, 'high'), window)
+    lows = _windows(_column(data, 'low'), window)
+    high_slope, low_slope = _slopes(highs, lows, window)
+
+    rising = (high_slope > 0) & (low_slope > 0)
+    falling = (high_slope < 0) & (low_slope < 0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        high_range = np.abs(highs.max(axis=1) - highs.min(axis=1)) / highs.min(axis=1)
+        low_range = np.abs(lows.max(axis=1) - lows.min(axis=1)) / lows.min(axis=1)
+        converging = np.abs(high_slope - low_slope) / np.maximum(np.abs(high_slope), np.abs(low_slope))
+
+    found = np.where(
+        rising, high_range < tolerance,
+        np.where(falling, low_range < tolerance, converging < tolerance)
+    )
+    patterns[window:][found] = 1
+    return patterns
+
+def detect_head_and_shoulders(data, tolerance=0.02):
+    """
+    Detect head and shoulders patterns in the given price data.
+
+    Parameters:
+    data (DataFrame): A DataFrame with columns ['high', 'low', 'close'].
+    tolerance (float): The tolerance level for pattern matching.
+
+    Returns:
+    np.array: An array indicating the presence of head and shoulders patterns (1 if detected, else 0).
+    """
+    patterns = np.zeros(len(data))
+    n = len(data)
+    if n <= 6:
+        return patterns
+
+    high = _column(data, 'high')
+    low = _column(data, 'low')
+    close = _column(data, 'close')
+
+    # Every array below is aligned on i in range(6, n)
+    left_shoulder = high[0:n - 6]
+    head = high[3:n - 3]
+    right_shoulder = high[6:]
+    neckline = (np.minimum(low[1:n - 5], low[5:n - 1]) + low[4:n - 2]) / 2
+
+    found = (
+        (head > left_shoulder) & (head > right_shoulder)
+        & (left_shoulder * (1 - tolerance) <= right_shoulder)
+        & (right_shoulder <= left_shoulder * (1 + tolerance))
+        & (close[6:] < neckline)
+    )
+    patterns[6:][found] = 1
+    return patterns
+
+def detect_wedge(data, window=10, tolerance=0.02):
+    """
+    Detect wedge patterns in the given price data.
+
+    Parameters:
+    data (DataFrame): A DataFrame with columns ['high', 'low'].
+    window (int): The number of periods to use for the rolling window to detect trend lines.
+    tolerance (float): The tolerance level for pattern matching.
+
+    Returns:
+    np.array: An array indicating the presence of wedge patterns (1 if detected, else 0).
+    """
+    patterns = np.zeros(len(data))
+    if len(data) <= window or window < 2:
+        return patterns
+
+    highs = _windows(_column(data, 'high'), window)
+    lows = _windows(_column(data, 'low'), window)
+    high_slope, low_slope = _slopes(highs, lows, window)
+    high_slope_2 = (highs[:, 1] - highs[:, 0]) / (window - 1)
+    low_slope_2 = (lows[:, 1] - lows[:, 0]) / (window - 1)
+
+    same_direction = ((high_slope < 0) & (low_slope < 0)) | ((high_slope > 0) & (low_slope > 0))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        found = (
+            same_direction
+            & (high_slope_2 != 0) & (low_slope_2 != 0)
+            & (np.abs((high_slope - high_slope_2) / high_slope_2) < tolerance)
+            & (np.abs((low_slope - low_slope_2) / low_slope_2) < tolerance)
+        )
+    patterns[window:][found] = 1
+    return patterns
+
+def detect_harmonic_pattern(data, tolerance=0.02):
+    """
+    Detect harmonic patterns in the given price data.
+
+    Parameters:
+    data (DataFrame): A DataFrame with columns ['high', 'low'].
+    tolerance (float): The tolerance level for Fibonacci ratio matching.
+
+    Returns:
+    np.array: An array indicating the presence of harmonic patterns (1 if detected, else 0).
+    """
+    patterns = np.zeros(len(data))
+    n = len(data)
+    if n <= 5:
+        return patterns
+
+    high = _column(data, 'high')
+    low = _column(data, 'low')
+
+    # Every array below is aligned on i in range(5, n)
+    X = low[0:n - 5]
+    A = high[1:n - 4]
+    B = low[2:n - 3]
+    C = high[3:n - 2]
+    D = low[4:n - 1]
+    current = low[5:]
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        xab = (B - X) / (A - X)
+        abc = (C - A) / (A - B)
+        bcd = (D - B) / (C - B)
+        cd = (current - C) / (C - D)
+
+    found = (
+        _between(xab, 0.618, tolerance)
+        & (_between(abc, 0.382, tolerance) | _between(abc, 0.886, tolerance))
+        & (_between(bcd, 0.382, tolerance) | _between(bcd, 0.886, tolerance))
+        & (_between(cd, 1.618, tolerance) | _between(cd, 2.618, tolerance))
+    )
+    patterns[5:][found] = 1
+    return patterns
+
+def test(rows=3000, seed=0):
+    """Check every vectorized detector against its loop implementation in patterns_reference.py."""
+    import patterns_reference
+
+    rng = np.random.default_rng(seed)
+    # A random walk with tight candles so that every pattern actually fires somewhere
+    close = 100 + np.cumsum(rng.normal(0, 0.5, rows))
+    open_ = close + rng.normal(0, 0.3, rows)
+    data = pd.DataFrame({
+        'open': open_,
+        'high': np.maximum(open_, close) + rng.uniform(0, 0.4, rows),
+        'low': np.minimum(open_, close) - rng.uniform(0, 0.4, rows),
+        'close': close,
+    })
+    # Flat stretches exercise the zero-slope and tie branches
+    data.iloc[500:530, :] = 100.0
+    # A window whose first step carries 90% of its total move is a wedge
+    step = np.tile([0, 0.9, 0.9, 0.9, 0.9, 0.9, 0.9, 0.9, 0.9, 1.0], 5)
+    data.loc[600:649, 'high'] = 101 + step
+    data.loc[600:649, 'low'] = 99 + step
+    # X, A, B, C, D and the current low at exact Fibonacci ratios form a harmonic pattern
+    data.loc[1000:1005, 'low'] = [100, np.nan, 106.18, np.nan, 108.2966, 116.576]
+    data.loc[1000:1005, 'high'] = [np.nan, 110, np.nan, 111.459, np.nan, np.nan]
+    data = data.ffill()
+
+    for name in ['detect_fvg', 'detect_double_top', 'detect_double_bottom', 'detect_triangle',
+                 'detect_wedge', 'detect_head_and_shoulders', 'detect_harmonic_pattern']:
+        with np.errstate(divide='ignore', invalid='ignore'):
+            expected = getattr(patterns_reference, name)(data)
+        actual = globals()[name](data)
+        assert np.array_equal(expected, actual), f"{name}: {int((expected != actual).sum())} mismatches"
+        print(f"{name}: OK ({int(actual.sum())} detections)")
+
+# test()
@@ -0,0 +1,272 @@
+import numpy as np
+
+# Loop implementations of the pattern detectors, the reference that patterns.test() checks the
+# vectorized versions in patterns.py against. Nothing else uses them.
+
+def detect_fvg(data, window=10):
+    """
+    Detect Fair Value Gaps (FVG) in the given price data.
+    
+    Parameters:
+    data (DataFrame): A DataFrame with columns ['high', 'low'].
+    window (int): The number of periods to look back for detecting gaps (default is 10).
+    
+    Returns:
+    np.array: An array indicating the presence of FVGs (1 if detected, else 0).
+    """
+    patterns = np.zeros(len(data))
+    
+    # Iterate over the data with the specified window
+    for i in range(window, len(data)):
+        for j in range(1, window + 1):
+            prev_high = data['high'][i-j]
+            prev_low = data['low'][i-j]
+            current_high = data['high'][i]
+            current_low = data['low'][i]
+            
+            # Detect gap up
+            if current_low > prev_high:
+                patterns[i] = 1
+                break  # Break to avoid multiple detections for the same index
+
+            elif current_high < prev_low:
+                patterns[i] = 1
+                break  # Break to avoid multiple detections for the same index
+    
+    return patterns
+
+def detect_double_top(data, window=10, tolerance=0.02):
+    """
+    Detect double top patterns in the given price data.
+    
+    Parameters:
+    data (DataFrame): A DataFrame with columns ['high', 'low', 'close'].
+    window (int): The number of periods to use for the rolling window to detect peaks.
+    tolerance (float): The tolerance level for peak matching.
+    
+    Returns:
+    np.array: An array indicating the presence of double top patterns (1 if detected, else 0).
+    """
+    patterns = np.zeros(len(data))
+    
+    if len(data) < window:
+        return patterns
+    
+    for i in range(window, len(data)):
+        highs = data['high'][i-window:i]
+        
+        if len(highs) < window:
+            continue
+        max1 = highs.max()
+        max1_idx = highs.idxmax()
+        highs_excluding_max1 = highs.drop(max1_idx)
+        if highs_excluding_max1.empty:
+            continue
+        
+        max2 = highs_excluding_max1.max()
+        max2_idx = highs_excluding_max1.idxmax()
+
+        if max2_idx < max1_idx:
+            continue
+        if abs(max1 - max2) / max1 < tolerance:
+            if data['close'][i] < highs.mean():
+                patterns[i] = 1
+    
+    return patterns
+
+
+def detect_double_bottom(data, window=10, tolerance=0.02):
+    """
+    Detect double bottom patterns in the given price data.
+    
+    Parameters:
+    data (DataFrame): A DataFrame with columns ['high', 'low', 'close'].
+    window (int): The number of periods to use for the rolling window to detect troughs.
+    tolerance (float): The tolerance level for trough matching.
+    
+    Returns:
+    np.array: An array indicating the presence of double bottom patterns (1 if detected, else 0).
+    """
+    patterns = np.zeros(len(data))
+    
+    if len(data) < window:
+        return patterns
+    
+    for i in range(window, len(data)):
+        lows = data['low'][i-window:i]
+        
+        if len(lows) < window:
+            continue
+        min1 = lows.min()
+        min1_idx = lows.idxmin()
+
+        lows_excluding_min1 = lows.drop(min1_idx)
+        if lows_excluding_min1.empty:
+            continue
+        
+        min2 = lows_excluding_min1.min()
+        min2_idx = lows_excluding_min1.idxmax()
+
+        if min2_idx < min1_idx:
+            continue
+
+        if abs(min1 - min2) / min1 < tolerance:
+            if data['close'][i] > lows.mean():
+                patterns[i] = 1
+    
+    return patterns
+
+def detect_triangle(data, window=10, tolerance=0.02):
+    """
+    Detect triangle patterns in the given price data.
+    
+    Parameters:
+    data (DataFrame): A DataFrame with columns ['high', 'low'].
+    window (int): The number of periods to use for the rolling window to detect trend lines.
+    tolerance (float): The tolerance level for pattern matching.
+    
+    Returns:
+    np.array: An array indicating the presence of triangle patterns (1 if detected, else 0).
+    """
+    patterns = np.zeros(len(data))
+    
+    if len(data) < window:
+        return patterns
+    
+    for i in range(window, len(data)):
+        highs = data['high'][i-window:i]
+        lows = data['low'][i-window:i]
+        
+        if len(highs) < window or len(lows) < window:
+            continue
+        
+        high_slope = (highs.iloc[-1] - highs.iloc[0]) / window
+        low_slope = (lows.iloc[-1] - lows.iloc[0]) / window
+        
+        if high_slope > 0 and low_slope > 0:
+            if abs(highs.max() - highs.min()) / highs.min() < tolerance:
+                patterns[i] = 1
+        elif high_slope < 0 and low_slope < 0:
+            if abs(lows.max() - lows.min()) / lows.min() < tolerance:
+                patterns[i] = 1
+        else:
+            if abs(high_slope - low_slope) / max(abs(high_slope), abs(low_slope)) < tolerance:
+                patterns[i] = 1
+    
+    return patterns
+
+def detect_head_and_shoulders(data, tolerance=0.02):
+    """
+    Detect head and shoulders patterns in the given price data.
+    
+    Parameters:
+    data (DataFrame): A DataFrame with columns ['high', 'low', 'close'].
+    tolerance (float): The tolerance level for pattern matching.
+    
+    Returns:
+    np.array: An array indicating the presence of head and shoulders patterns (1 if detected, else 0).
+    """
+    patterns = np.zeros(len(data))
+
+    for i in range(6, len(data)):
+        left_shoulder = data['high'][i-6]
+        head = data['high'][i-3]
+        right_shoulder = data['high'][i]
+        neckline = min(data['low'][i-5], data['low'][i-1])
+        neckline = (neckline + data['low'][i-2]) / 2 
+
+        if not (head > left_shoulder and head > right_shoulder):
+            continue
+
+        if not (left_shoulder * (1 - tolerance) <= right_shoulder <= left_shoulder * (1 + tolerance)):
+            continue
+
+        if data['close'][i] < neckline:
+            patterns[i] = 1
+
+    return patterns
+
+
+def detect_wedge(data, window=10, tolerance=0.02):
+    """
+    Detect wedge patterns in the given price data.
+    
+    Parameters:
+    data (DataFrame): A DataFrame with columns ['high', 'low'].
+    window (int): The number of periods to use for the rolling window to detect trend lines.
+    tolerance (float): The tolerance level for pattern matching.
+    
+    Returns:
+    np.array: An array indicating the presence of wedge patterns (1 if detected, else 0).
+    """
+    patterns = np.zeros(len(data))
+    
+    if len(data) < window:
+        return patterns
+    
+    for i in range(window, len(data)):
+        highs = data['high'][i-window:i]
+        lows = data['low'][i-window:i]
+        
+        if len(highs) < window or len(lows) < window:
+            continue
+        
+        high_slope = (highs.iloc[-1] - highs.iloc[0]) / window
+        low_slope = (lows.iloc[-1] - lows.iloc[0]) / window
+
+        if high_slope < 0 and low_slope < 0:
+            high_slope_2 = (highs.iloc[1] - highs.iloc[0]) / (window - 1)
+            low_slope_2 = (lows.iloc[1] - lows.iloc[0]) / (window - 1)
+            if high_slope_2 != 0 and low_slope_2 != 0 and \
+               abs((high_slope - high_slope_2) / high_slope_2) < tolerance and \
+               abs((low_slope - low_slope_2) / low_slope_2) < tolerance:
+                patterns[i] = 1
+        elif high_slope > 0 and low_slope > 0:
+            high_slope_2 = (highs.iloc[1] - highs.iloc[0]) / (window - 1)
+            low_slope_2 = (lows.iloc[1] - lows.iloc[0]) / (window - 1)
+            if high_slope_2 != 0 and low_slope_2 != 0 and \
+               abs((high_slope - high_slope_2) / high_slope_2) < tolerance and \
+               abs((low_slope - low_slope_2) / low_slope_2) < tolerance:
+                patterns[i] = 1
+    
+    return patterns
+
+def detect_harmonic_pattern(data, tolerance=0.02):
+    """
+    Detect harmonic patterns in the given price data.
+    
+    Parameters:
+    data (DataFrame): A DataFrame with columns ['high', 'low'].
+    tolerance (float): The tolerance level for Fibonacci ratio matching.
+    
+    Returns:
+    np.array: An array indicating the presence of harmonic patterns (1 if detected, else 0).
+    """
+    patterns = np.zeros(len(data))
+
+    for i in range(5, len(data)):
+        X = data['low'][i-5]
+        A = data['high'][i-4]
+        B = data['low'][i-3]
+        C = data['high'][i-2]
+        D = data['low'][i-1]
+        current = data['low'][i]
+
+        if not (0.618 - tolerance <= (B - X) / (A - X) <= 0.618 + tolerance):
+            continue
+
+        if not (0.382 - tolerance <= (C - A) / (A - B) <= 0.382 + tolerance or
+                0.886 - tolerance <= (C - A) / (A - B) <= 0.886 + tolerance):
+            continue
+
+        if not (0.382 - tolerance <= (D - B) / (C - B) <= 0.382 + tolerance or
+                0.886 - tolerance <= (D - B) / (C - B) <= 0.886 + tolerance):
+            continue
+
+        if not (1.618 - tolerance <= (current - C) / (C - D) <= 1.618 + tolerance or
+                2.618 - tolerance <= (current - C) / (C - D) <= 2.618 + tolerance):
+            continue
+
+        patterns[i] = 1
+
+    return patterns
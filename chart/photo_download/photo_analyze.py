@@ -1,8 +1,11 @@
 import base64
 import os
+import sys
 import logging
-from openai import OpenAI
 from credentials import openai_api_key
+# The shared llm package lives at the repository root
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+from llm.gateway import get_gateway
 
 # Set up logging
 logging.basicConfig(level=logging.INFO)
@@ -14,8 +17,8 @@ openai_api_key = openai_api_key
 if not openai_api_key:
     raise ValueError("Please set your OpenAI API key in the environment variable 'OPENAI_API_KEY'.")
 
-# Initialize OpenAI client
-client = OpenAI(api_key=openai_api_key)
+# Initialize OpenAI gateway
+gateway = get_gateway(openai_api_key)
 
 # Folder where images are saved
 output_folder = 'images'
@@ -38,7 +41,7 @@ def analyze_image(image_path):
     """Send the image description to OpenAI GPT and get analysis."""
     base64_image = encode_image(image_path)
 
-    response = client.chat.completions.create(
+    return gateway.chat_sync(
         model="gpt-4o",
         messages=[
             {"role": "system", "content": "You are a helpful assistant that responds in Markdown. Help me with my technical analysis!"},
@@ -50,8 +53,6 @@ def analyze_image(image_path):
         temperature=0.0,
     )
 
-    return response.choices[0].message.content
-
 def main():
     latest_image = get_latest_image(output_folder)
     if not latest_image:
@@ -0,0 +1,167 @@
+import logging
+import queue
+import threading
+import time
+
+# Staged pipeline: each stage has its own worker threads and takes its items from a bounded queue,
+# so while one item waits on a slow stage (e.g. GPT) the next items already go through the others.
+# The wall time of a run approaches the busiest stage instead of the sum of all stages.
+
+_STOP = object()
+
+class Stage:
+    """
+    One step of a Pipeline.
+
+    `func(item)` returns the item for the next stage, or None to drop it (e.g. nothing new to analyze).
+    An exception drops the item as well and is logged and counted in the stage metrics.
+    """
+
+    def __init__(self, name, func, workers=1, queue_size=None):
+        self.name = name
+        self.func = func
+        self.workers = workers
+        # A full queue blocks the stage before it, which keeps memory bounded
+        self.queue = queue.Queue(maxsize=queue_size or 2 * workers)
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.processed = 0
+        self.errors = 0
+        self.dropped = 0
+        self.busy = 0.0
+        self.waited = 0.0
+        self.max_latency = 0.0
+        self.max_depth = 0
+        self.stopped = 0
+
+    def put(self, item):
+        self.queue.put((item, time.perf_counter()))
+        if item is not _STOP:
+            with self.lock:
+                self.max_depth = max(self.max_depth, self.queue.qsize())
+
+    def metrics(self):
+        with self.lock:
+            done = self.processed + self.errors
+            return {
+                'workers': self.workers,
+                'processed': self.processed,
+                'dropped': self.dropped,
+                'errors': self.errors,
+                'queue_depth': self.queue.qsize(),
+                'max_queue_depth': self.max_depth,
+                'mean_latency': self.busy / done if done else 0.0,
+                'max_latency': self.max_latency,
+                'mean_wait': self.waited / done if done else 0.0,
+                'busy': self.busy,
+            }
+
+class Pipeline:
+
+    def __init__(self, stages):
+        self.stages = stages
+        self.results = []
+        self.wall_time = 0.0
+
+    def _work(self, index):
+        stage = self.stages[index]
+        following = self.stages[index + 1] if index + 1 < len(self.stages) else None
+        while True:
+            item, enqueued = stage.queue.get()
+            if item is _STOP:
+                break
+            started = time.perf_counter()
+            error = False
+            try:
+                result = stage.func(item)
+            except Exception as e:
+                logging.error(f"Pipeline stage {stage.name} failed on {item!r:.100}: {e}", exc_info=True)
+                result = None
+                error = True
+            elapsed = time.perf_counter() - started
+            with stage.lock:
+                stage.busy += elapsed
+                stage.waited += started - enqueued
+                stage.max_latency = max(stage.max_latency, elapsed)
+                if error:
+                    stage.errors += 1
+                else:
+                    stage.processed += 1
+                    stage.dropped += result is None
+            if result is None:
+                continue
+            if following is not None:
+                following.put(result)
+            else:
+                with stage.lock:
+                    self.results.append(result)
+
+        # The last worker of a stage to stop passes the stop on to all workers of the next stage
+        with stage.lock:
+            stage.stopped += 1
+            last = stage.stopped == stage.workers
+        if last and following is not None:
+            for _ in range(following.workers):
+                following.put(_STOP)
+
+    def run(self, items):
+        """Push `items` through all stages and wait for them, returns the outputs of the last stage."""
+        self.results = []
+        for stage in self.stages:
+            stage.reset()
+        started = time.perf_counter()
+        threads = [
+            threading.Thread(target=self._work, args=(index,), name=f"pipeline_{stage.name}_{worker}", daemon=True)
+            for index, stage in enumerate(self.stages)
+            for worker in range(stage.workers)
+        ]
+        for thread in threads:
+            thread.start()
+        for item in items:
+            self.stages[0].put(item)
+        for _ in range(self.stages[0].workers):
+            self.stages[0].put(_STOP)
+        for thread in threads:
+            thread.join()
+        self.wall_time = time.perf_counter() - started
+        self.log_metrics()
+        return self.results
+
+    def metrics(self):
+        """Queue depths and latencies per stage, safe to call from another thread while the pipeline runs."""
+        return {'wall_time': self.wall_time, 'stages': {stage.name: stage.metrics() for stage in self.stages}}
+
+    def log_metrics(self):
+        metrics = self.metrics()
+        for name, stage in metrics['stages'].items():
+            logging.info(
+                f"Pipeline stage {name}: {stage['processed']} done ({stage['dropped']} dropped, {stage['errors']} failed) "
+                f"by {stage['workers']} workers, latency {stage['mean_latency']:.2f}s mean / {stage['max_latency']:.2f}s max, "
+                f"waited {stage['mean_wait']:.2f}s mean, queue depth {stage['max_queue_depth']} max"
+            )
+        busiest = max(metrics['stages'].items(), key=lambda entry: entry[1]['busy'] / entry[1]['workers'])
+        logging.info(f"Pipeline finished in {metrics['wall_time']:.2f}s, busiest stage {busiest[0]} "
+                     f"({busiest[1]['busy'] / busiest[1]['workers']:.2f}s per worker)")
+
+def test(items=6):
+    """Simulated analysis run: sequential time is the sum of the stages, pipelined it approaches the slowest one."""
+    def sleeper(seconds):
+        def func(item):
+            time.sleep(seconds)
+            return item
+        return func
+
+    durations = {'update': 0.2, 'analyze': 1.0, 'chart': 0.3, 'publish': 0.1}
+    pipeline = Pipeline([
+        Stage('update', sleeper(durations['update'])),
+        Stage('analyze', sleeper(durations['analyze']), workers=4),
+        Stage('chart', sleeper(durations['chart'])),
+        Stage('publish', sleeper(durations['publish'])),
+    ])
+    results = pipeline.run(range(items))
+    assert sorted(results) == list(range(items)), results
+    print(f"{items} items: sequential {items * sum(durations.values()):.1f}s, pipelined {pipeline.wall_time:.1f}s")
+
+# test()
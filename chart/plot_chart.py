@@ -3,10 +3,10 @@ import pandas as pd
 import numpy as np
 from typing import Iterator
 from credentials import chart_image_api_key
-from fma_chart import fig
-import requests
+from chart_pool import render_chart
+from chart_img import get_client
+from chart_store import get_store
 import logging
-import json
 
 PERSIAN_NUM = "۰۱۲۳۴۵۶۷۸۹"
 def _normalize_number(n:str) -> float:
@@ -18,7 +18,7 @@ def _normalize_number(n:str) -> float:
     return float(n)
         
 
-def _parse_support_resistance(msg:str) -> tuple:
+def parse_support_resistance(msg:str) -> tuple:
     """
         extract support and resistance price from GPT text response
 
@@ -43,10 +43,83 @@ def _parse_support_resistance(msg:str) -> tuple:
         
     return [ _normalize_number(x) for x in support ], [ _normalize_number(x) for x in resistance ]
     
-def _get_sr_drawing_input(msg:str, data: pd.DataFrame) -> Iterator:
+def _sr_zones(levels: np.ndarray, data: pd.DataFrame, support: bool) -> dict:
+    """
+    Zones of all support or resistance levels at once, as arrays indexed like `levels`.
+
+    The zone of a level is built from the last candle that contains it: its shadow when the level lies in a shadow
+    longer than the body, otherwise the run of consecutive candles containing the level that ends there.
+    """
+    low = data['low'].to_numpy(dtype=float)
+    high = data['high'].to_numpy(dtype=float)
+    open_ = data['open'].to_numpy(dtype=float)
+    close = data['close'].to_numpy(dtype=float)
+    n = len(data)
+    index = np.arange(n)
+
+    # (levels, candles) mask of the candles whose range contains each level
+    contains = (low[None, :] <= levels[:, None]) & (levels[:, None] <= high[None, :])
+    # Last containing candle, or the first candle when there is none
+    st = np.where(contains.any(axis=1), n - 1 - np.argmax(contains[:, ::-1], axis=1), 0)
+
+    body_end = np.maximum(open_[st], close[st])
+    body_start = np.minimum(open_[st], close[st])
+    if support:
+        in_shadow = (low[st] < levels) & (levels < body_start) & ((body_end - body_start) <= (body_start - low[st]))
+        shadow_lower, shadow_upper = low[st], body_start
+    else:
+        in_shadow = (body_end < levels) & (levels < high[st]) & ((body_end - body_start) <= (high[st] - body_end))
+        shadow_lower, shadow_upper = body_end, high[st]
+
+    # The run starts after the last candle before st that does not contain the level, at the second candle when all do
+    outside = ~contains & (index[None, :] < st[:, None])
+    ed = np.where(outside.any(axis=1), n - np.argmax(outside[:, ::-1], axis=1), 1)
+    run = (index[None, :] >= ed[:, None]) & (index[None, :] <= st[:, None])
+    if support:
+        run_lower = np.where(run, low[None, :], np.inf).min(axis=1)
+        run_upper = np.where(run, high[None, :], np.inf).min(axis=1)
+    else:
+        run_lower = np.where(run, low[None, :], -np.inf).max(axis=1)
+        run_upper = np.where(run, high[None, :], -np.inf).max(axis=1)
+
+    has_run = ~in_shadow & (st > 0)
+    return {
+        'lower': np.where(in_shadow, shadow_lower, np.where(has_run, run_lower, levels * 0.995)),
+        'upper': np.where(in_shadow, shadow_upper, np.where(has_run, run_upper, levels * 1.005)),
+        'start': np.where(in_shadow, st, np.where(has_run, ed, 0)),
+    }
+
+def _get_sr_drawing_input(msg:str, data: pd.DataFrame, levels: dict = None) -> Iterator:
+    now = np.datetime_as_string(np.datetime64('today'), unit='s') + '.000Z'
+    
+    if levels is not None:
+        supports, resistances = levels['supports'], levels['resistances']
+    else:
+        supports, resistances = parse_support_resistance(msg)
+
+    for prices, support in ((supports, True), (resistances, False)):
+        if not len(prices) or data.empty:
+            continue
+        prices = np.asarray(prices, dtype=float)
+        zones = _sr_zones(prices, data, support)
+        for i, price in enumerate(prices):
+            yield {
+                "startDatetime": data['timestamp'].iloc[zones['start'][i]],
+                "startPrice": zones['lower'][i],
+                "endDatetime": now,
+                "endPrice": zones['upper'][i],
+                "price": price,
+                "text": "SUPPORT" if support else "RESISTANCE"
+            }
+
+def _get_sr_drawing_input_loop(msg:str, data: pd.DataFrame, levels: dict = None) -> Iterator:
+    """Candle by candle version of _get_sr_drawing_input, kept as the reference of test_sr_zones"""
     now = np.datetime_as_string(np.datetime64('today'), unit='s') + '.000Z'
     
-    supports, resistances = _parse_support_resistance(msg)
+    if levels is not None:
+        supports, resistances = levels['supports'], levels['resistances']
+    else:
+        supports, resistances = parse_support_resistance(msg)
     for support in supports:
         for st in reversed(range(len(data))):
             if data['low'].iloc[st] <= support <= data['high'].iloc[st]: break
@@ -152,7 +225,7 @@ def generate_chart_PNG_chart_img(symbol: str, exchange: str, interval: str, msg:
         data (pd.DataFrame): ohlc chart data, this should contains at least the following columns: timestamp, high, low
 
     Returns:
-        str: generated file name
+        str: file name of the chart in the chart store
     """
     drawings = [ d for d in get_SR_drawing(msg, data) ]
     template = {
@@ -183,32 +256,13 @@ def generate_chart_PNG_chart_img(symbol: str, exchange: str, interval: str, msg:
         "drawings": drawings
     }
     
-    response =  requests.post("https://api.chart-img.com/v2/tradingview/advanced-chart", data=json.dumps(template), headers={
-        "x-api-key": chart_image_api_key,
-        "content-type": "application/json",
-    })
-    
-    try:
-        response.raise_for_status()
-    except BaseException as e:
-        logging.error(f"API Error ({response.status_code}): {response.text}")
-        raise e
-    
-    filename = f"charts/{exchange}_{symbol}_{interval}_{np.datetime_as_string(np.datetime64('now'), unit='s')}.png"
-    with open(filename, "wb") as f:
-        f.write(response.content)
+    # Pooled session with timeouts and retries, identical templates are served from the response cache
+    content = get_client(chart_image_api_key).advanced_chart(template)
     
-    import os
-    from pathlib import Path
-    link = f"charts/{exchange}_{symbol}_{interval}.png"
-    if os.path.exists(Path(link)):
-        os.unlink(link)
-    os.link(filename, link)
-    
-    return filename
+    return get_store().put(symbol, interval, content)
     
 
-def generate_chart_PNG_mpl_finance(symbol: str, exchange: str, interval: str, msg:str, data: pd.DataFrame) -> str:
+def generate_chart_PNG_mpl_finance(symbol: str, exchange: str, interval: str, msg:str, data: pd.DataFrame, levels: dict = None) -> str:
     """Generate chart image showing klines, EMA(200), BB, MACD, RSI and main Support & Resistance
 
     Args:
@@ -217,25 +271,17 @@ def generate_chart_PNG_mpl_finance(symbol: str, exchange: str, interval: str, ms
         interval (str): chart interval, for example `4h`
         msg (str): ChatGPT Analysis Response, it should be formatted
         data (pd.DataFrame): ohlc chart data, this should contains at least the following columns: timestamp, high, low
+        levels (dict): structured levels of the analysis with `supports` and `resistances`, parsed from `msg` when None
 
     Returns:
-        str: generated file name
+        str: file name of the chart in the chart store
     """
-    drawings = [ d for d in _get_sr_drawing_input(msg, data) ]
-    
-    fig(symbol, exchange, interval, data, drawings)
-
+    drawings = [ d for d in _get_sr_drawing_input(msg, data, levels) ]
     
-    filename = f"charts/{exchange}_{symbol}_{interval}.png"
-    link = f"charts/{exchange}_{symbol}_{interval}_{np.datetime_as_string(np.datetime64('now'), unit='s')}.png"
-    
-    import os
-    from pathlib import Path
-    if os.path.exists(Path(link)):
-        os.unlink(link)
-    os.link(filename, link)
-    
-    return filename
+    # Drawn by a warm worker process, several charts can be drawn at the same time
+    content, info = render_chart(symbol, exchange, interval, data, drawings)
+    # Saved once per distinct image, old charts are removed by the retention policy of the store
+    return get_store().put(symbol, interval, content, extension=info['extension'])
     
 
 
@@ -276,19 +322,15 @@ def test():
     #ارز_دیجیتال #تحلیل_تکنیکال #بیت_کوین
     """
     
-    s, r = _parse_support_resistance(sample)
+    s, r = parse_support_resistance(sample)
 
     from tvDatafeed import TvDatafeed, Interval
-    import talib
+    from indicators import compute_indicators, CHART_COLUMNS
     data = TvDatafeed().get_hist(symbol='ETHUSDT', exchange='BINANCE', interval=Interval.in_4_hour, n_bars=1000 )
     data['timestamp'] = data.index
     
-    # Calculate technical indicators
-    data['ema_50'] = talib.EMA(data['close'], timeperiod=50)
-    data['ema_200'] = talib.EMA(data['close'], timeperiod=200)
-    data['bollinger_hband'], data['bollinger_mband'], data['bollinger_lband'] = talib.BBANDS(data['close'], timeperiod=20)
-    data['rsi'] = talib.RSI(data['close'])
-    data['macd'], data['macd_signal'], data['macd_diff'] = talib.MACD(data['close'])
+    # Calculate only the technical indicators the chart draws
+    data = compute_indicators(data, CHART_COLUMNS)
 
     
     # print([x for x in get_SR_drawing(sample, data)])
@@ -296,4 +338,35 @@ def test():
     print(generate_chart_PNG_mpl_finance('ETHUSDT','BINANCE','4h',sample,data))
     
 
-# test()
\ No newline at end of file
+def test_sr_zones(candles=5000, levels=12, repeat=5):
+    """Check the vectorized zones against the candle by candle loop on a random walk, and time both."""
+    import time
+    rng = np.random.default_rng(0)
+    close = 3000 + np.cumsum(rng.normal(0, 20, candles))
+    open_ = np.concatenate([[close[0]], close[:-1]])
+    data = pd.DataFrame({
+        'timestamp': pd.date_range('2024-01-01', periods=candles, freq='4h'),
+        'open': open_,
+        'high': np.maximum(open_, close) + rng.exponential(15, candles),
+        'low': np.minimum(open_, close) - rng.exponential(15, candles),
+        'close': close,
+    })
+    # Levels inside the range, above and below all candles, and on the first candle
+    prices = list(rng.uniform(data['low'].min(), data['high'].max(), levels)) + [data['high'].max() + 100, data['low'].min() - 100, data['close'].iloc[0]]
+    sr = {'supports': prices, 'resistances': prices[::-1]}
+
+    expected = list(_get_sr_drawing_input_loop("", data, sr))
+    actual = list(_get_sr_drawing_input("", data, sr))
+    assert len(actual) == len(expected)
+    for a, e in zip(actual, expected):
+        assert a['text'] == e['text'] and a['price'] == e['price'] and a['startDatetime'] == e['startDatetime'], (a, e)
+        assert np.isclose(a['startPrice'], e['startPrice']) and np.isclose(a['endPrice'], e['endPrice']), (a, e)
+
+    for name, build in (('loop', _get_sr_drawing_input_loop), ('vectorized', _get_sr_drawing_input)):
+        started = time.perf_counter()
+        for _ in range(repeat):
+            list(build("", data, sr))
+        print(f"{name}: {(time.perf_counter() - started) / repeat * 1000:.1f} ms for {2 * len(prices)} levels over {candles} candles")
+
+# test()
+# test_sr_zones()
\ No newline at end of file
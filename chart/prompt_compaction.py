@@ -0,0 +1,150 @@
+import logging
+
+import numpy as np
+import pandas as pd
+
+try:
+    import tiktoken
+except ImportError:  # token counts fall back to an estimate
+    tiktoken = None
+
+# Compaction of the candle and indicator table sent to GPT.
+# The table is shrunk until it fits a token budget, in order of how little information each step loses:
+#   1. id columns and columns with a single value (symbol, interval) are dropped, constants go to a header line
+#   2. columns that repeat another column are dropped
+#   3. sparse pattern and EMA cross flags become a list of events
+#   4. older rows are merged into coarser candles, the newest rows stay at full resolution
+#   5. the oldest events, then the oldest of the full resolution rows are left out
+
+PROMPT_TOKEN_BUDGET = 12000
+RECENT_ROWS = 100
+
+ID_COLUMNS = ['id', 'id_x', 'id_y']
+EVENT_COLUMNS = [
+    'ema_25_cross_ema_50', 'ema_25_cross_ema_100', 'ema_25_cross_ema_200',
+    'ema_50_cross_ema_100', 'ema_50_cross_ema_200', 'ema_100_cross_ema_200',
+    'fvg_pattern', 'head_and_shoulders', 'harmonic_pattern', 'wedge_pattern',
+    'triangle_pattern', 'double_top_pattern', 'double_bottom_pattern',
+]
+
+_encodings = {}
+
+def _get_encoding(model):
+    if model not in _encodings:
+        encoding = None
+        if tiktoken is not None:
+            try:
+                try:
+                    encoding = tiktoken.encoding_for_model(model)
+                except KeyError:
+                    encoding = tiktoken.get_encoding('o200k_base')
+            except Exception as e:
+                # tiktoken downloads its encodings on first use
+                logging.warning(f"Could not load the tiktoken encoding for {model}, estimating token counts: {e}")
+        _encodings[model] = encoding
+    return _encodings[model]
+
+def count_tokens(text, model='gpt-4o'):
+    """Exact count with tiktoken when its encoding is available, otherwise about 4 characters per token."""
+    encoding = _get_encoding(model)
+    if encoding is not None:
+        return len(encoding.encode(text))
+    return len(text) // 4 + 1
+
+def _drop_constant_columns(data):
+    constants = {}
+    for column in data.columns:
+        if column == 'timestamp':
+            continue
+        values = data[column].dropna().unique()
+        if len(values) <= 1 and column not in EVENT_COLUMNS:
+            constants[column] = values[0] if len(values) else None
+    return data.drop(columns=list(constants)), constants
+
+def _drop_duplicate_columns(data):
+    duplicates = []
+    columns = [c for c in data.columns if c != 'timestamp' and c not in EVENT_COLUMNS]
+    for i, column in enumerate(columns):
+        if any(data[column].equals(data[other]) for other in columns[:i] if other not in duplicates):
+            duplicates.append(column)
+    return data.drop(columns=duplicates)
+
+def _events(data):
+    rows = []
+    for column in [c for c in EVENT_COLUMNS if c in data.columns]:
+        values = pd.to_numeric(data[column], errors='coerce').fillna(0)
+        for index in np.flatnonzero(values.to_numpy() != 0):
+            rows.append((data['timestamp'].iloc[index], column, int(values.iloc[index])))
+    rows.sort()
+    return [f"{timestamp},{column},{value}" for timestamp, column, value in rows]
+
+def _downsample(data, factor):
+    """Merge every `factor` rows into one candle, aligned so the last group ends on the last row."""
+    if factor <= 1 or data.empty:
+        return data
+    groups = (len(data) - 1 - np.arange(len(data))) // factor
+    groups = groups.max() - groups
+    aggregations = {column: 'last' for column in data.columns}
+    aggregations.update({'timestamp': 'first', 'open': 'first', 'high': 'max', 'low': 'min', 'close': 'last', 'volume': 'sum'})
+    aggregations = {column: how for column, how in aggregations.items() if column in data.columns}
+    return data.groupby(groups, sort=True).agg(aggregations).reset_index(drop=True)
+
+def _render(header, older, factor, recent, events, precision):
+    parts = [header]
+    if not older.empty:
+        parts.append(f"Older candles, each merging {factor} candles:")
+        parts.append(older.to_csv(index=False, float_format=f'%.{precision}f').strip())
+    parts.append(f"Latest {len(recent)} candles:")
+    parts.append(recent.to_csv(index=False, float_format=f'%.{precision}f').strip())
+    if events:
+        parts.append("Detected patterns and EMA crosses (timestamp,name,direction):")
+        parts.extend(events)
+    return "\n".join(parts)
+
+def compact_prompt_data(data, precision, budget=PROMPT_TOKEN_BUDGET, recent_rows=RECENT_ROWS):
+    """
+    Render `data` as compact text for the analysis prompt.
+
+    Parameters:
+    data (DataFrame): Candles and indicators, oldest first.
+    precision (int): Decimals of prices in the output.
+    budget (int): Token budget of the rendered text.
+    recent_rows (int): Newest rows that are kept at full resolution while the budget allows it.
+
+    Returns:
+    str, dict: The text, and the token counts {'before', 'after'} where 'before' is the plain CSV of `data`.
+    """
+    before = count_tokens(data.to_csv(index=False, float_format=f'%.{precision}f'))
+
+    compacted = data.drop(columns=[c for c in ID_COLUMNS if c in data.columns])
+    compacted, constants = _drop_constant_columns(compacted)
+    compacted = _drop_duplicate_columns(compacted)
+    events = _events(compacted)
+    compacted = compacted.drop(columns=[c for c in EVENT_COLUMNS if c in compacted.columns]).reset_index(drop=True)
+    header = ", ".join(f"{column}: {value}" for column, value in constants.items())
+
+    older = compacted.iloc[:-recent_rows] if len(compacted) > recent_rows else compacted.iloc[:0]
+    recent = compacted.iloc[len(older):]
+
+    # Merge older rows more and more coarsely, then give up on them, on old events and on part of the recent block
+    factor = 1
+    while True:
+        merged = _downsample(older, factor)
+        text = _render(header, merged, factor, recent, events, precision)
+        after = count_tokens(text)
+        if after <= budget:
+            break
+        if len(merged) > 1:
+            factor *= 2
+        elif not older.empty:
+            older = older.iloc[:0]
+        elif len(events) > 10:
+            events = events[len(events) // 2:]
+        elif len(recent) > 1:
+            recent = recent.iloc[len(recent) // 2:]
+        else:
+            break
+
+    older_rows = f"older rows merged by {factor}" if not older.empty else "no older rows"
+    logging.info(f"Compacted prompt data from {before} to {after} tokens (budget {budget}, {len(recent)} full resolution rows, {older_rows})")
+    return text, {'before': before, 'after': after}
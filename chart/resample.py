@@ -0,0 +1,78 @@
+import numpy as np
+import pandas as pd
+
+from kline_fetcher import INTERVAL_MS
+
+# Build higher timeframe candles from a base interval series.
+# Buckets are aligned like Binance klines: on UTC midnight for intraday and daily intervals and on
+# Monday 00:00 UTC for weekly ones. The last bucket may be incomplete, exactly like the still-open
+# last candle returned by the exchange, and is completed by later calls.
+
+INTERVAL_NS = {interval: ms * 10**6 for interval, ms in INTERVAL_MS.items()}
+
+# The Unix epoch is a Thursday, weekly candles start on the following Monday
+WEEK_ORIGIN_NS = 4 * 86400 * 10**9
+
+def bucket_start(timestamps, interval):
+    """Open time of the `interval` candle containing each timestamp (naive UTC datetime64 values)."""
+    if interval not in INTERVAL_NS:
+        raise ValueError(f"Unsupported interval: {interval}")
+    period = INTERVAL_NS[interval]
+    origin = WEEK_ORIGIN_NS if interval == '1w' else 0
+    values = np.asarray(timestamps, dtype='datetime64[ns]').view('int64')
+    return ((values - origin) // period * period + origin).view('datetime64[ns]')
+
+def resample_candles(data, interval, base_interval):
+    """
+    Aggregate base candles into `interval` candles.
+
+    Parameters:
+    data (DataFrame): Base candles with ['timestamp', 'open', 'high', 'low', 'close', 'volume'], sorted by timestamp.
+    interval (str): Target interval, a multiple of base_interval, e.g. '4h', '1d' or '1w'.
+    base_interval (str): Interval of `data`, e.g. '15m'.
+
+    Returns:
+    DataFrame: Candles with the same columns. A leading bucket that does not start with its first
+    base candle is dropped, since its open would be wrong.
+    """
+    if INTERVAL_NS[interval] % INTERVAL_NS[base_interval] != 0:
+        raise ValueError(f"{interval} is not a multiple of {base_interval}")
+    if data.empty:
+        return data[['timestamp', 'open', 'high', 'low', 'close', 'volume']].copy()
+
+    buckets = bucket_start(data['timestamp'].to_numpy(), interval)
+    candles = data.groupby(buckets, sort=True).agg(
+        open=('open', 'first'),
+        high=('high', 'max'),
+        low=('low', 'min'),
+        close=('close', 'last'),
+        volume=('volume', 'sum'),
+    )
+    candles.index.name = 'timestamp'
+    candles = candles.reset_index()
+
+    if data['timestamp'].iloc[0] != candles['timestamp'].iloc[0]:
+        candles = candles.iloc[1:].reset_index(drop=True)
+    return candles
+
+def test():
+    """Check alignment and aggregation against pandas resample on random 15m candles."""
+    rng = np.random.default_rng(0)
+    timestamps = pd.date_range('2024-01-03 05:00', periods=5000, freq='15min')
+    close = 100 + np.cumsum(rng.normal(0, 1, len(timestamps)))
+    data = pd.DataFrame({
+        'timestamp': timestamps, 'open': close + rng.normal(0, 0.5, len(timestamps)),
+        'high': close + 2, 'low': close - 2, 'close': close, 'volume': rng.uniform(1, 10, len(timestamps)),
+    })
+
+    for interval, rule in (('1h', '1h'), ('4h', '4h'), ('1d', '1D'), ('1w', 'W-MON')):
+        expected = data.set_index('timestamp').resample(rule, label='left', closed='left').agg(
+            {'open': 'first', 'high': 'max', 'low': 'min', 'close': 'last', 'volume': 'sum'}
+        ).dropna().reset_index()
+        expected = expected[expected['timestamp'] >= timestamps[0]].reset_index(drop=True)
+        actual = resample_candles(data, interval, '15m')
+        pd.testing.assert_frame_equal(actual, expected, check_dtype=False)
+        assert (actual['timestamp'].dt.dayofweek == 0).all() or interval != '1w'
+        print(f"{interval}: OK ({len(actual)} candles)")
+
+# test()
@@ -0,0 +1,121 @@
+import asyncio
+import logging
+import os
+import sys
+from fetch_data import update_databases
+from analyze import (
+    submit_analysis_batch, collect_analysis_batches, fetch_joined_data, generate_analysis, render_analysis_chart,
+    send_analysis, stream_analyses, ANALYSIS_COLUMNS, ANALYSIS_ROWS, STREAM_ANALYSES,
+)
+# The shared llm package lives at the repository root
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from llm.gateway import MAX_CONCURRENCY
+from chart_pool import CHART_WORKERS
+from telegram_bot import start_delivery
+from pipeline import Pipeline, Stage
+import schedule
+import time
+
+# Set up logging
+logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
+
+def analysis_pipeline(interval, stream=STREAM_ANALYSES):
+    """
+    Stages of an analysis run over many symbols: while one symbol waits on GPT, the next ones are loaded
+    and the previous one is drawn and sent. The database is updated before, see run_analysis_pipeline.
+    """
+    def load(job):
+        symbol, precision = job
+        data = fetch_joined_data(symbol, interval, ANALYSIS_COLUMNS, limit=ANALYSIS_ROWS)
+        return None if data.empty else (symbol, precision, interval, data)
+
+    def analyze(job):
+        symbol, precision, interval, data = job
+        result = generate_analysis(symbol, precision, interval, data)
+        # No analysis when the market did not change enough since the last one
+        return None if result is None else (symbol, interval, *result)
+
+    def chart(job):
+        symbol, interval, analysis, levels = job
+        return symbol, interval, analysis, levels, render_analysis_chart(symbol, interval, analysis, levels)
+
+    def publish(job):
+        symbol, interval, analysis, levels, image_file_name = job
+        send_analysis(symbol, interval, analysis, image_file_name, levels)
+        return job
+
+    def stream_publish(job):
+        # Each worker streams on its own loop, GPT and Telegram requests all go through the shared gateway and sender
+        asyncio.run(stream_analyses([job]))
+        return job
+
+    if stream:
+        return Pipeline([Stage('load', load), Stage('stream', stream_publish, workers=MAX_CONCURRENCY)])
+    return Pipeline([
+        Stage('load', load),
+        Stage('analyze', analyze, workers=MAX_CONCURRENCY),
+        # Charts are drawn by the worker processes of chart_pool
+        Stage('chart', chart, workers=CHART_WORKERS),
+        Stage('publish', publish),
+    ])
+
+def run_analysis_pipeline(symbols, precisions, interval):
+    # Klines of all symbols are downloaded concurrently, and indicators computed in the indicator pool,
+    # once for the run (a derived interval shares one download of its base)
+    update_databases(symbols, [interval])
+    analysis_pipeline(interval).run(list(zip(symbols, precisions)))
+
+def analyze_and_update_all(symbols, precisions, interval, batch=False):
+    try:
+        logging.info(f"Updating and analyzing {symbols} at interval {interval}")
+        if batch:
+            # Klines of all symbols are downloaded concurrently before the batch is submitted
+            update_databases(symbols, [interval])
+            # Published by collect_analysis_batches once the batch job completes
+            submit_analysis_batch(list(zip(symbols, precisions)), [interval])
+        else:
+            run_analysis_pipeline(symbols, precisions, interval)
+    except Exception as e:
+        logging.error(f"Error in update and analyze: {e}", exc_info=True)
+
+def schedule_tasks(symbols, precisions, intervals):
+    try:
+        logging.info("Scheduling periodic tasks")
+        for interval in intervals:
+            logging.debug(f"Scheduling {interval} interval tasks for {symbols}")
+            if interval == '15m':
+                schedule.every(1).days.at("04:00:00", 'UTC').do(analyze_and_update_all, symbols=symbols, precisions=precisions, interval=interval, batch=True)
+                schedule.every(1).days.at("18:00:00", 'UTC').do(analyze_and_update_all, symbols=symbols, precisions=precisions, interval=interval, batch=True)
+                # schedule.every(1).days.at("16:00:00", 'UTC').do(analyze_and_update_all, symbols=symbols, precisions=precisions, interval=interval)
+                # schedule.every(1).days.at("23:00:00", 'UTC').do(analyze_and_update_all, symbols=symbols, precisions=precisions, interval=interval)
+                # schedule.every(1).days.at("20:00:00", 'UTC').do(analyze_and_update_all, symbols=symbols, precisions=precisions, interval=interval)
+            elif interval == '4h':
+                schedule.every(1).days.at("12:00:00", 'UTC').do(analyze_and_update_all, symbols=symbols, precisions=precisions, interval=interval)
+                # schedule.every(1).days.at("14:30:00", 'UTC').do(analyze_and_update_all, symbols=symbols, precisions=precisions, interval=interval)
+                # schedule.every(1).days.at("16:00:00", 'UTC').do(analyze_and_update_all, symbols=symbols, precisions=precisions, interval=interval)
+            elif interval == '1d':
+                schedule.every(2).days.at("16:30:00", 'UTC').do(analyze_and_update_all, symbols=symbols, precisions=precisions, interval=interval, batch=True)
+        schedule.every(1).minutes.do(collect_analysis_batches)
+    except Exception as e:
+        logging.error(f"Error scheduling periodic tasks: {e}", exc_info=True)
+
+def run_scheduler():
+    while True:
+        schedule.run_pending()
+        time.sleep(1)  
+
+def main():
+    try:
+        logging.info("Starting main function")
+        intervals = ['15m', '4h', '1d']  # Default intervals
+        symbols = ['BTCUSDT', 'ETHUSDT']  # Example symbols
+        precisions = [0, 0]
+        logging.info("Starting Telegram delivery")
+        start_delivery()
+        logging.info("Setting up scheduled tasks")
+        schedule_tasks(symbols, precisions, intervals)
+
+        logging.info("Starting the scheduler")
+        run_scheduler()
+    except Exception as e:
+        logging.error(f"Error in main function: {e}", exc_info=True)
@@ -0,0 +1,333 @@
+import copy
+import math
+from collections import deque
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+
+import patterns
+
+# Streaming counterpart of fetch_data.calculate_indicators.
+# Every indicator keeps its recurrence state (EMA values, Wilder averages, running totals and
+# fixed-size window deques), so a closed candle is folded in with constant work no matter how
+# long the history is. The formulas follow pandas_ta 0.3.14b, which calculate_indicators uses.
+
+NaN = float('nan')
+
+# Candles kept for the pattern detectors, the widest one looks at the 10 previous candles
+PATTERN_TAIL = 11
+
+class _Sma:
+    """Simple moving average over a fixed window, NaN until the window is full."""
+
+    def __init__(self, length):
+        self.length = length
+        self.values = deque(maxlen=length)
+        self.total = 0.0
+
+    def update(self, x):
+        if math.isnan(x):
+            return NaN
+        if len(self.values) == self.length:
+            self.total -= self.values[0]
+        self.values.append(x)
+        self.total += x
+        return self.total / self.length if len(self.values) == self.length else NaN
+
+class _Ema:
+    """EMA seeded with the SMA of the first `length` values, like ta.ema(sma=True)."""
+
+    def __init__(self, length):
+        self.length = length
+        self.alpha = 2 / (length + 1)
+        self.count = 0
+        self.total = 0.0
+        self.value = NaN
+
+    def update(self, x):
+        if math.isnan(x):
+            return NaN
+        self.count += 1
+        if self.count < self.length:
+            self.total += x
+        elif self.count == self.length:
+            self.value = (self.total + x) / self.length
+        else:
+            self.value = self.alpha * x + (1 - self.alpha) * self.value
+        return self.value
+
+class _Rma:
+    """Wilder's moving average, ewm(alpha=1/length, min_periods=length) with pandas' adjust=True weights."""
+
+    def __init__(self, length):
+        self.length = length
+        self.decay = 1 - 1 / length
+        self.count = 0
+        self.weighted_sum = 0.0
+        self.weight = 0.0
+
+    def update(self, x):
+        if math.isnan(x):
+            return NaN
+        self.count += 1
+        self.weighted_sum = x + self.decay * self.weighted_sum
+        self.weight = 1 + self.decay * self.weight
+        return self.weighted_sum / self.weight if self.count >= self.length else NaN
+
+class _Extreme:
+    """Rolling max (or min) with a monotonic deque, amortized O(1) per value."""
+
+    def __init__(self, length, highest, min_periods=None):
+        self.length = length
+        self.highest = highest
+        self.min_periods = length if min_periods is None else min_periods
+        self.count = 0
+        self.candidates = deque()
+
+    def update(self, x):
+        self.count += 1
+        while self.candidates and (
+            self.candidates[-1][1] <= x if self.highest else self.candidates[-1][1] >= x
+        ):
+            self.candidates.pop()
+        self.candidates.append((self.count, x))
+        if self.candidates[0][0] <= self.count - self.length:
+            self.candidates.popleft()
+        return self.candidates[0][1] if min(self.count, self.length) >= self.min_periods else NaN
+
+class _Window:
+    """Last `length` values, for statistics that need the whole window (stdev, mean deviation)."""
+
+    def __init__(self, length):
+        self.length = length
+        self.values = deque(maxlen=length)
+
+    def update(self, x):
+        self.values.append(x)
+        return len(self.values) == self.length
+
+    def std(self):
+        return float(np.std(self.values))
+
+    def mean_deviation(self):
+        values = np.fromiter(self.values, dtype=float)
+        return float(np.abs(values - values.mean()).mean())
+
+def _divide(numerator, denominator):
+    """Float division with pandas semantics: x/0 is +-inf and 0/0 is NaN instead of raising."""
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return float(np.divide(numerator, denominator))
+
+def _non_zero(value):
+    return value + np.finfo(float).eps if value == 0 else value
+
+class StreamingIndicators:
+    """
+    Indicator state of one (symbol, interval) series.
+
+    `update` folds in one closed candle and returns its indicators row, with the same columns as
+    calculate_indicators. For a candle that is still open, update a copy (see `peek`) so that the
+    state is not advanced past the last closed candle.
+    """
+
+    last_timestamp: Optional[pd.Timestamp]
+
+    def __init__(self):
+        self.last_timestamp = None
+        self.count = 0
+        self.previous = None
+        self.previous_emas = None
+        self.rsi_gain = _Rma(14)
+        self.rsi_loss = _Rma(14)
+        self.macd_fast = _Ema(12)
+        self.macd_slow = _Ema(26)
+        self.macd_signal = _Ema(9)
+        self.bollinger = _Window(20)
+        self.bollinger_mean = _Sma(20)
+        self.emas = {length: _Ema(length) for length in (25, 50, 100, 200)}
+        self.smas = {length: _Sma(length) for length in (50, 200)}
+        self.lowest_14 = _Extreme(14, highest=False)
+        self.highest_14 = _Extreme(14, highest=True)
+        self.stoch_k = _Sma(3)
+        self.stoch_d = _Sma(3)
+        self.cci = _Window(20)
+        self.cci_mean = _Sma(20)
+        self.atr = _Rma(14)
+        self.obv = 0.0
+        self.minor_high = _Extreme(10, highest=True, min_periods=1)
+        self.minor_low = _Extreme(10, highest=False, min_periods=1)
+        self.fib_high = _Extreme(20, highest=True)
+        self.fib_low = _Extreme(20, highest=False)
+        self.tail = deque(maxlen=PATTERN_TAIL)
+
+    @classmethod
+    def from_history(cls, data):
+        """Build the state by replaying closed candles, without computing the pattern columns."""
+        state = cls()
+        for candle in data[['timestamp', 'open', 'high', 'low', 'close', 'volume']].itertuples(index=False):
+            state._advance(candle._asdict())
+        return state
+
+    def update(self, candle):
+        row = self._advance(candle)
+        row.update(self._patterns())
+        return row
+
+    def peek(self, candle):
+        """Indicators row of a still-open candle, leaving this state untouched."""
+        return copy.deepcopy(self).update(candle)
+
+    def _advance(self, candle):
+        timestamp = candle['timestamp']
+        high, low, close, volume = (float(candle[key]) for key in ('high', 'low', 'close', 'volume'))
+        previous = self.previous
+        self.count += 1
+        row = {'timestamp': timestamp}
+
+        # RSI
+        change = close - previous['close'] if previous else NaN
+        gain = self.rsi_gain.update(max(change, 0.0) if previous else NaN)
+        loss = self.rsi_loss.update(min(change, 0.0) if previous else NaN)
+        row['rsi'] = 100 * _divide(gain, gain + abs(loss))
+
+        # MACD
+        macd = self.macd_fast.update(close) - self.macd_slow.update(close)
+        signal = self.macd_signal.update(macd)
+        row['macd'] = macd
+        row['macd_signal'] = signal
+        row['macd_diff'] = macd - signal
+
+        # Bollinger Bands
+        self.bollinger.update(close)
+        middle = self.bollinger_mean.update(close)
+        deviation = 2 * self.bollinger.std() if not math.isnan(middle) else NaN
+        row['bollinger_hband'] = middle + deviation
+        row['bollinger_mband'] = middle
+        row['bollinger_lband'] = middle - deviation
+
+        # EMAs are stored with 0 before they are defined, then crosses against the previous candle
+        emas = {}
+        for length, ema in self.emas.items():
+            value = ema.update(close)
+            emas[length] = 0.0 if math.isnan(value) else value
+            row[f'ema_{length}'] = emas[length]
+        for short, long in ((25, 50), (25, 100), (25, 200), (50, 100), (50, 200), (100, 200)):
+            cross = 0
+            if self.previous_emas:
+                if self.previous_emas[short] <= self.previous_emas[long] and emas[short] > emas[long]:
+                    cross += 1
+                if self.previous_emas[short] >= self.previous_emas[long] and emas[short] < emas[long]:
+                    cross -= 1
+            row[f'ema_{short}_cross_ema_{long}'] = cross
+        self.previous_emas = emas
+
+        # Major pivots from the previous candle
+        if previous:
+            pivot = (previous['high'] + previous['low'] + previous['close']) / 3
+            previous_range = previous['high'] - previous['low']
+            row['pivot'] = pivot
+            row['pivot_res1'] = 2 * pivot - previous['low']
+            row['pivot_sup1'] = 2 * pivot - previous['high']
+            row['pivot_res2'] = pivot + previous_range
+            row['pivot_sup2'] = pivot - previous_range
+        else:
+            for column in ('pivot', 'pivot_res1', 'pivot_sup1', 'pivot_res2', 'pivot_sup2'):
+                row[column] = NaN
+
+        # Minor pivots over the last 10 candles
+        minor_high = self.minor_high.update(high)
+        minor_low = self.minor_low.update(low)
+        minor_pivot = (minor_high + minor_low + (close if self.count >= 10 else NaN)) / 3
+        row['minor_pivot'] = minor_pivot
+        row['minor_pivot_res1'] = 2 * minor_pivot - minor_low
+        row['minor_pivot_sup1'] = 2 * minor_pivot - minor_high
+        row['minor_pivot_res2'] = minor_pivot + (minor_high - minor_low)
+        row['minor_pivot_sup2'] = minor_pivot - (minor_high - minor_low)
+
+        # Fibonacci levels over the last 20 candles
+        fib_high = self.fib_high.update(high)
+        fib_low = self.fib_low.update(low)
+        row['fib_38_2'] = fib_high - 0.382 * (fib_high - fib_low)
+        row['fib_61_8'] = fib_high - 0.618 * (fib_high - fib_low)
+
+        # SMAs
+        for length, sma in self.smas.items():
+            row[f'sma_{length}'] = sma.update(close)
+
+        # Stochastic and Williams %R share the 14 candle high/low
+        lowest = self.lowest_14.update(low)
+        highest = self.highest_14.update(high)
+        stoch = 100 * _divide(close - lowest, _non_zero(highest - lowest))
+        row['stoch_k'] = self.stoch_k.update(stoch)
+        row['stoch_d'] = self.stoch_d.update(row['stoch_k'])
+        row['williams_r'] = 100 * (_divide(close - lowest, highest - lowest) - 1)
+
+        # CCI
+        typical_price = (high + low + close) / 3
+        self.cci.update(typical_price)
+        mean_typical_price = self.cci_mean.update(typical_price)
+        if math.isnan(mean_typical_price):
+            row['cci'] = NaN
+        else:
+            row['cci'] = _divide(typical_price - mean_typical_price, 0.015 * self.cci.mean_deviation())
+
+        # ATR
+        if previous:
+            true_range = max(abs(_non_zero(high - low)), abs(high - previous['close']), abs(previous['close'] - low))
+        else:
+            true_range = NaN
+        row['atr'] = self.atr.update(true_range)
+
+        # OBV
+        if previous:
+            self.obv += float(np.sign(close - previous['close'])) * volume
+        else:
+            self.obv = volume
+        row['obv'] = self.obv
+
+        self.previous = {'high': high, 'low': low, 'close': close}
+        self.tail.append({key: float(candle[key]) for key in ('open', 'high', 'low', 'close')})
+        self.last_timestamp = timestamp
+        return row
+
+    def _patterns(self):
+        tail = pd.DataFrame(list(self.tail))
+        return {
+            'fvg_pattern': patterns.detect_fvg(tail)[-1],
+            'head_and_shoulders': patterns.detect_head_and_shoulders(tail)[-1],
+            'harmonic_pattern': patterns.detect_harmonic_pattern(tail)[-1],
+            'wedge_pattern': patterns.detect_wedge(tail)[-1],
+            'triangle_pattern': patterns.detect_triangle(tail)[-1],
+            'double_top_pattern': patterns.detect_double_top(tail)[-1],
+            'double_bottom_pattern': patterns.detect_double_bottom(tail)[-1],
+        }
+
+def test(rows=1500, warmup=1000, seed=0, tolerance=1e-6):
+    """Check that streaming updates match a full calculate_indicators recompute."""
+    import fetch_data
+
+    rng = np.random.default_rng(seed)
+    close = 30000 + np.cumsum(rng.normal(0, 100, rows))
+    open_ = close + rng.normal(0, 50, rows)
+    data = pd.DataFrame({
+        'timestamp': pd.date_range('2024-01-01', periods=rows, freq='15min'),
+        'open': open_,
+        'high': np.maximum(open_, close) + rng.uniform(0, 80, rows),
+        'low': np.minimum(open_, close) - rng.uniform(0, 80, rows),
+        'close': close,
+        'volume': rng.uniform(10, 1000, rows),
+    })
+    expected = fetch_data.calculate_indicators(data.copy())
+
+    state = StreamingIndicators.from_history(data.iloc[:warmup])
+    actual = pd.DataFrame([state.update(candle) for candle in data.iloc[warmup:].to_dict('records')])
+
+    for column in fetch_data.INDICATOR_COLUMNS:
+        e = expected[column].iloc[warmup:].astype(float).to_numpy()
+        a = actual[column].astype(float).to_numpy()
+        assert np.allclose(e, a, rtol=tolerance, atol=tolerance, equal_nan=True), \
+            f"{column}: max difference {np.nanmax(np.abs(e - a))}"
+    print(f"Streaming indicators match calculate_indicators on {rows - warmup} updates")
+
+# test()
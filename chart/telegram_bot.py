@@ -1,63 +1,146 @@
 import logging
 import os
-from aiogram import Bot, Dispatcher
-from aiogram.types import BufferedInputFile
+import sys
+import time
+from aiogram.exceptions import TelegramBadRequest, TelegramRetryAfter
+from aiogram.types import FSInputFile, InputMediaPhoto
 import asyncio
 from credentials import telegram_bot_token_btc, telegram_channel_id
+# The shared messaging package lives at the repository root
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from messaging.sender import get_sender, split_message
+from messaging.outbox import (post, post_key, photo_message, text_messages, start_outbox, throttle, rate_wait, flood_wait,
+                              wait_sent, PRIORITY_ANALYSIS)
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
-# Initialize Telegram Bot
+# Telegram Bot, one loop and one HTTP session for the whole process
 telegram_token = telegram_bot_token_btc
 channel_id = telegram_channel_id
-bot = Bot(token=telegram_token)
-dp = Dispatcher()
-
-# Store the message IDs of the last analysis for each symbol
-last_message_ids = {'BTCUSDT': None, 'ETHUSDT': None}
-
-# Function to send message to Telegram channel
-async def send_message_to_telegram(message, symbol, interval, image_file_name):
-    try:
-        max_length = 4096  # Telegram's maximum message length
-        parts = [message[i:i + max_length] for i in range(0, len(message), max_length)]
-        reply_to_message_id = None # last_message_ids[symbol]
-        logging.info(f"Uploading Photo {image_file_name} to {channel_id}")
-        with open(image_file_name,"rb") as f:
-            msg = await bot.send_photo(chat_id=channel_id, photo=BufferedInputFile(f.read(), image_file_name) , caption=f"{symbol} {interval} chart")
-        
-        reply_to_message_id = msg.message_id
-        
-        logging.info(f"Sending message to {channel_id}")
-        for part in parts:
-            if reply_to_message_id:
-                try:
-                    msg = await bot.send_message(chat_id=channel_id, text=part, parse_mode='Markdown', reply_to_message_id=reply_to_message_id)
-                except:
-                    logging.exception(f"could not send formatted message: {part}")
-                    msg = await bot.send_message(chat_id=channel_id, text=part, reply_to_message_id=reply_to_message_id)
-                    
-            else:
-                try:
-                    msg = await bot.send_message(chat_id=channel_id, text=part, parse_mode='Markdown')
-                except:
+sender = get_sender(telegram_token)
+
+# Telegram allows about one edit per second in a chat and 20 messages per minute in a channel,
+# a streamed message is edited at most this often
+EDIT_INTERVAL = 3.0
+
+def send_message(message, symbol, interval, image_file_name, priority=PRIORITY_ANALYSIS):
+    """
+    Queue a chart with its analysis in the outbox, the analysis replying to the chart.
+
+    Returns at once, the outbox keeps a copy of the chart (the chart store may evict it), delivers the post and
+    retries it. The same chart and analysis queued again is not posted twice.
+
+    Returns:
+    list[int]: Outbox ids of the messages.
+    """
+    key = post_key('analysis', channel_id, symbol, interval, image_file_name, message)
+    messages = [photo_message(image_file_name, f"{symbol} {interval} chart"), *text_messages(message)]
+    ids = post(sender, channel_id, messages, key, priority)
+    logging.info(f"Queued analysis of {symbol} at interval {interval} for {channel_id}")
+    return ids
+
+def start_delivery():
+    """Deliver what is in the outbox, including posts queued before a restart."""
+    start_outbox(sender)
+
+async def send_photo_to_telegram(symbol, interval, image_file_name):
+    """
+    Post a chart through the outbox and wait until it is sent, returns its message id for the replies and for
+    replace_photo_in_telegram.
+    """
+    logging.info(f"Uploading Photo {image_file_name} to {channel_id}")
+    key = post_key('stream', channel_id, symbol, interval, image_file_name, time.time())
+    ids = await asyncio.to_thread(post, sender, channel_id, [photo_message(image_file_name, f"{symbol} {interval} chart")], key, PRIORITY_ANALYSIS)
+    return await wait_sent(sender, ids[0])
+
+async def replace_photo_in_telegram(message_id, symbol, interval, image_file_name):
+    logging.info(f"Replacing Photo {message_id} in {channel_id} with {image_file_name}")
+    media = InputMediaPhoto(media=FSInputFile(image_file_name), caption=f"{symbol} {interval} chart")
+    await throttle(sender, channel_id)
+    await sender.request('edit_message_media', chat_id=channel_id, message_id=message_id, media=media)
+
+async def delete_from_telegram(message_ids):
+    """Delete posted messages, e.g. of an analysis that failed while it was streamed."""
+    for message_id in message_ids:
+        try:
+            await throttle(sender, channel_id)
+            await sender.request('delete_message', chat_id=channel_id, message_id=message_id)
+        except Exception as e:
+            logging.error(f"Could not delete message {message_id} in {channel_id}: {e}")
+
+class StreamingMessage:
+    """
+    Message that is posted while its text is still being generated and edited in place as the text grows.
+    Its calls take the rate limits of the outbox, so streaming does not crowd out queued posts to the channel.
+
+    `update` shows the text so far as plain text, at most every `edit_interval` seconds, and continues
+    in a new reply when it outgrows one message. `finish` shows the final text with Markdown.
+    """
+
+    def __init__(self, reply_to_message_id=None, edit_interval=EDIT_INTERVAL):
+        self.reply_to_message_id = reply_to_message_id
+        self.edit_interval = edit_interval
+        self.message_ids = []
+        self.shown = []
+        self.next_edit = 0
+
+    async def update(self, text):
+        if not text.strip() or time.monotonic() < self.next_edit:
+            return
+        # A progress edit is skipped rather than waiting for its turn in the channel
+        wait = await rate_wait(sender, channel_id)
+        if wait > 0:
+            self.next_edit = time.monotonic() + wait
+            return
+        self.next_edit = time.monotonic() + self.edit_interval
+        try:
+            await self._show(split_message(text), parse_mode=None)
+        except TelegramRetryAfter as e:
+            # Progress edits are skipped, the final text is sent anyway
+            logging.warning(f"Telegram asks to retry after {e.retry_after}s, pausing edits")
+            await flood_wait(sender, channel_id, e.retry_after)
+            self.next_edit = time.monotonic() + e.retry_after
+
+    async def finish(self, text, parse_mode='Markdown'):
+        """Show the final text, returns the id of the last message."""
+        parts = split_message(text)
+        while True:
+            try:
+                await self._show(parts, parse_mode)
+                break
+            except TelegramRetryAfter as e:
+                logging.warning(f"Telegram asks to retry after {e.retry_after}s")
+                await flood_wait(sender, channel_id, e.retry_after)
+        # The formatted text may need fewer messages than the text while it was streamed
+        for message_id in self.message_ids[len(parts):]:
+            await throttle(sender, channel_id)
+            await sender.request('delete_message', chat_id=channel_id, message_id=message_id)
+        del self.message_ids[len(parts):], self.shown[len(parts):]
+        return self.message_ids[-1]
+
+    async def _show(self, parts, parse_mode):
+        for i, part in enumerate(parts):
+            if i < len(self.message_ids) and self.shown[i] == (part, parse_mode):
+                continue
+            try:
+                await self._send(i, part, parse_mode)
+            except TelegramBadRequest as e:
+                if 'message is not modified' in e.message:
+                    pass
+                elif parse_mode:
                     logging.exception(f"could not send formatted message: {part}")
-                    msg = await bot.send_message(chat_id=channel_id, text=part)
-            reply_to_message_id = msg.message_id
-        
-        last_message_ids[symbol] = reply_to_message_id
-        logging.info(f"Message sent to Telegram channel for {symbol}")
-    except Exception as e:
-        logging.exception(f"Error sending message to Telegram: {e}")
-    finally:
-        await bot.session.close()
-
-def send_message(message, symbol, interval, image_file_name):
-    try:
-        asyncio.run(send_message_to_telegram(message, symbol, interval, image_file_name))
-    except RuntimeError as e:
-        if str(e) == 'Event loop is closed':
-            new_loop = asyncio.new_event_loop()
-            asyncio.set_event_loop(new_loop)
-            new_loop.run_until_complete(send_message_to_telegram(message, symbol, interval, image_file_name))
\ No newline at end of file
+                    await self._send(i, part, None)
+                else:
+                    raise
+            self.shown[i] = (part, parse_mode)
+
+    async def _send(self, i, part, parse_mode):
+        await throttle(sender, channel_id)
+        if i < len(self.message_ids):
+            await sender.request('edit_message_text', text=part, chat_id=channel_id, message_id=self.message_ids[i], parse_mode=parse_mode)
+        else:
+            reply_to_message_id = self.message_ids[-1] if self.message_ids else self.reply_to_message_id
+            msg = await sender.request('send_message', chat_id=channel_id, text=part, parse_mode=parse_mode, reply_to_message_id=reply_to_message_id)
+            self.message_ids.append(msg.message_id)
+            self.shown.append(None)
@@ -0,0 +1,15 @@
+import multiprocessing
+
+# Start method of the worker processes of chart_pool and indicator_pool.
+# Workers are forked from a fork server rather than from the running process, whose sender, outbox and gateway
+# threads may hold locks at the time of the fork. The fork server imports only the modules the workers need,
+# instead of __main__. Each worker still imports the main script as __mp_main__, which is why chart/main.py
+# only starts scheduler.py.
+
+WORKER_MODULES = ['chart_pool', 'indicator_pool']
+
+def worker_context():
+    """The multiprocessing context for the pools, preloading WORKER_MODULES in the fork server."""
+    context = multiprocessing.get_context('forkserver')
+    context.set_forkserver_preload(WORKER_MODULES)
+    return context
@@ -0,0 +1,172 @@
+import json
+import logging
+import os
+import time
+import uuid
+
+import requests
+
+# Batch execution of chat completions for work that does not need an answer right away.
+# Requests are written to a JSONL file in the format of the OpenAI Batch API and handed to a transport,
+# which submits the file, reports the batch status and returns the answers by custom_id.
+# OpenAIBatchTransport talks to the Batch API, which costs half as much as interactive requests and does not
+# count against the per-minute limits. LocalBatchTransport answers from a directory and stands in for it in tests.
+
+OPENAI_API_URL = 'https://api.openai.com/v1'
+COMPLETION_WINDOW = '24h'
+
+PENDING_STATUSES = ('validating', 'in_progress', 'finalizing', 'cancelling')
+FAILED_STATUSES = ('failed', 'expired', 'cancelled')
+
+def batch_request(custom_id, model, messages, **params):
+    """One line of a batch input file."""
+    return {
+        'custom_id': custom_id,
+        'method': 'POST',
+        'url': '/v1/chat/completions',
+        'body': {'model': model, 'messages': messages, **params},
+    }
+
+def write_batch_file(path, batch_requests):
+    with open(path, 'w', encoding='utf-8') as f:
+        for request in batch_requests:
+            f.write(json.dumps(request, ensure_ascii=False) + '\n')
+
+def parse_batch_output(lines):
+    """
+    Read the lines of a batch output file.
+
+    Returns:
+    dict: custom_id -> message content, None for requests that failed.
+    """
+    results = {}
+    for line in lines:
+        if not line.strip():
+            continue
+        record = json.loads(line)
+        response = record.get('response') or {}
+        if record.get('error') or response.get('status_code') != 200:
+            logging.error(f"Batch request {record.get('custom_id')} failed: {record.get('error') or response.get('body')}")
+            results[record['custom_id']] = None
+            continue
+        results[record['custom_id']] = response['body']['choices'][0]['message']['content']
+    return results
+
+class OpenAIBatchTransport:
+
+    def __init__(self, api_key, base_url=OPENAI_API_URL, timeout=60):
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+        self.session = requests.Session()
+        self.session.headers['Authorization'] = f"Bearer {api_key}"
+
+    def submit(self, path):
+        """Upload a batch input file and start the batch, returns the batch id."""
+        with open(path, 'rb') as f:
+            response = self.session.post(f"{self.base_url}/files", data={'purpose': 'batch'}, files={'file': (os.path.basename(path), f)}, timeout=self.timeout)
+        response.raise_for_status()
+        response = self.session.post(f"{self.base_url}/batches", json={
+            'input_file_id': response.json()['id'],
+            'endpoint': '/v1/chat/completions',
+            'completion_window': COMPLETION_WINDOW,
+        }, timeout=self.timeout)
+        response.raise_for_status()
+        return response.json()['id']
+
+    def _batch(self, batch_id):
+        response = self.session.get(f"{self.base_url}/batches/{batch_id}", timeout=self.timeout)
+        response.raise_for_status()
+        return response.json()
+
+    def status(self, batch_id):
+        return self._batch(batch_id)['status']
+
+    def results(self, batch_id):
+        batch = self._batch(batch_id)
+        results = {}
+        for file_id in (batch.get('output_file_id'), batch.get('error_file_id')):
+            if not file_id:
+                continue
+            response = self.session.get(f"{self.base_url}/files/{file_id}/content", timeout=self.timeout)
+            response.raise_for_status()
+            results.update(parse_batch_output(response.text.splitlines()))
+        return results
+
+def echo_responder(body):
+    return f"echo: {body['messages'][-1]['content']}"
+
+class LocalBatchTransport:
+    """
+    File-based stand-in for the Batch API.
+
+    Submitted files are copied to `directory`. A batch completes once `{batch_id}.output.jsonl` exists:
+    either something else writes it, or, when a `responder` is given, it is written from
+    `responder(request_body) -> content` after `delay` seconds.
+    """
+
+    def __init__(self, directory, responder=echo_responder, delay=0):
+        self.directory = directory
+        self.responder = responder
+        self.delay = delay
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, batch_id, kind):
+        return os.path.join(self.directory, f"{batch_id}.{kind}.jsonl")
+
+    def submit(self, path):
+        batch_id = f"batch_{uuid.uuid4().hex}"
+        with open(path, encoding='utf-8') as source, open(self._path(batch_id, 'input'), 'w', encoding='utf-8') as target:
+            target.write(source.read())
+        return batch_id
+
+    def status(self, batch_id):
+        if os.path.exists(self._path(batch_id, 'output')):
+            return 'completed'
+        if not os.path.exists(self._path(batch_id, 'input')):
+            return 'failed'
+        if self.responder is None or time.time() - os.path.getmtime(self._path(batch_id, 'input')) < self.delay:
+            return 'in_progress'
+
+        with open(self._path(batch_id, 'input'), encoding='utf-8') as f:
+            lines = [json.loads(line) for line in f if line.strip()]
+        temporary = self._path(batch_id, 'output') + '.tmp'
+        with open(temporary, 'w', encoding='utf-8') as f:
+            for line in lines:
+                body = {'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': self.responder(line['body'])}}]}
+                f.write(json.dumps({'custom_id': line['custom_id'], 'response': {'status_code': 200, 'body': body}, 'error': None}, ensure_ascii=False) + '\n')
+        os.replace(temporary, self._path(batch_id, 'output'))
+        return 'completed'
+
+    def results(self, batch_id):
+        with open(self._path(batch_id, 'output'), encoding='utf-8') as f:
+            return parse_batch_output(f)
+
+def run_batch(transport, batch_requests, path, poll_interval=60, timeout=24 * 3600):
+    """
+    Submit `batch_requests` and block until the batch finishes.
+
+    Returns:
+    dict: custom_id -> message content, None for failed requests.
+    """
+    write_batch_file(path, batch_requests)
+    batch_id = transport.submit(path)
+    logging.info(f"Submitted batch {batch_id} with {len(batch_requests)} requests")
+    deadline = time.monotonic() + timeout
+    while True:
+        status = transport.status(batch_id)
+        if status == 'completed':
+            return transport.results(batch_id)
+        if status in FAILED_STATUSES:
+            raise RuntimeError(f"Batch {batch_id} ended with status {status}")
+        if time.monotonic() > deadline:
+            raise TimeoutError(f"Batch {batch_id} still {status} after {timeout}s")
+        time.sleep(poll_interval)
+
+def test(directory='batch_test'):
+    transport = LocalBatchTransport(directory, delay=1)
+    batch_requests = [batch_request(f"job-{i}", 'gpt-4o', [{'role': 'user', 'content': f"request {i}"}]) for i in range(3)]
+    results = run_batch(transport, batch_requests, os.path.join(directory, 'input.jsonl'), poll_interval=0.5)
+    assert results == {f"job-{i}": f"echo: request {i}" for i in range(3)}, results
+    print(f"Batch of {len(results)} requests completed")
+
+# test()
@@ -0,0 +1,151 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+from datetime import datetime, timedelta
+
+from sqlalchemy import create_engine, Column, String, Integer, DateTime, Text, Index, func
+from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.orm import sessionmaker
+
+# Content-addressed cache of chat completion responses, shared by chart, news, youtube and photo_download.
+# A response is stored under the SHA-256 of (model, messages, parameters), so an identical request made
+# by a retry, a re-run after a crash or a duplicate scheduled job is answered locally.
+
+CACHE_DATABASE_URL = 'sqlite:///' + os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'llm_cache.db')
+DEFAULT_TTL = timedelta(hours=12)
+DEFAULT_MAX_BYTES = 50 * 1024 * 1024
+
+Base = declarative_base()
+
+class CachedResponse(Base):
+    __tablename__ = 'llm_cache'
+    __table_args__ = (Index('ix_llm_cache_last_used_at', 'last_used_at'),)
+    key = Column(String, primary_key=True)
+    model = Column(String)
+    response = Column(Text)
+    size = Column(Integer)
+    created_at = Column(DateTime)
+    expires_at = Column(DateTime)
+    last_used_at = Column(DateTime)
+
+def cache_key(model, messages, **params):
+    """Hash of everything that determines a response, independent of dict ordering."""
+    payload = json.dumps({'model': model, 'messages': messages, 'params': params}, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+class LLMCache:
+    """
+    Response cache in a local SQLite database.
+
+    Entries expire after `ttl`, and when the stored responses exceed `max_bytes` the least
+    recently used ones are evicted. Hit and miss counts of this process are kept in `hits` and `misses`.
+    """
+
+    ttl: timedelta
+    max_bytes: int
+    enabled: bool
+
+    def __init__(self, database_url=CACHE_DATABASE_URL, ttl=DEFAULT_TTL, max_bytes=DEFAULT_MAX_BYTES, enabled=True):
+        self.engine = create_engine(database_url)
+        Base.metadata.create_all(self.engine)
+        self.Session = sessionmaker(bind=self.engine)
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.enabled = enabled
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        """Return the cached response for `key`, or None when it is missing or expired."""
+        now = datetime.utcnow()
+        session = self.Session()
+        try:
+            entry = session.get(CachedResponse, key)
+            if entry is not None and entry.expires_at <= now:
+                session.delete(entry)
+                entry = None
+            response = None
+            if entry is not None:
+                entry.last_used_at = now
+                response = entry.response
+            session.commit()
+        finally:
+            session.close()
+
+        with self.lock:
+            if response is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return response
+
+    def put(self, key, model, response, ttl=None):
+        now = datetime.utcnow()
+        session = self.Session()
+        try:
+            session.merge(CachedResponse(
+                key=key,
+                model=model,
+                response=response,
+                size=len(response.encode('utf-8')),
+                created_at=now,
+                expires_at=now + (ttl or self.ttl),
+                last_used_at=now
+            ))
+            session.query(CachedResponse).filter(CachedResponse.expires_at <= now).delete(synchronize_session=False)
+            self._evict(session)
+            session.commit()
+        except Exception:
+            session.rollback()
+            raise
+        finally:
+            session.close()
+
+    def _evict(self, session):
+        session.flush()
+        total = session.query(func.coalesce(func.sum(CachedResponse.size), 0)).scalar()
+        if total <= self.max_bytes:
+            return
+        evicted = 0
+        for key, size in session.query(CachedResponse.key, CachedResponse.size).order_by(CachedResponse.last_used_at).all():
+            if total <= self.max_bytes:
+                break
+            session.query(CachedResponse).filter(CachedResponse.key == key).delete(synchronize_session=False)
+            total -= size
+            evicted += 1
+        logging.info(f"Evicted {evicted} LLM responses from the cache")
+
+    def stats(self):
+        session = self.Session()
+        try:
+            entries, size = session.query(func.count(CachedResponse.key), func.coalesce(func.sum(CachedResponse.size), 0)).one()
+        finally:
+            session.close()
+        requests = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / requests if requests else 0.0,
+            'entries': entries,
+            'bytes': size,
+        }
+
+    def clear(self):
+        session = self.Session()
+        try:
+            session.query(CachedResponse).delete()
+            session.commit()
+        finally:
+            session.close()
+
+_cache = None
+
+def get_cache():
+    """Return the process-wide cache, created on first use."""
+    global _cache
+    if _cache is None:
+        _cache = LLMCache()
+    return _cache
@@ -0,0 +1,378 @@
+import asyncio
+import json
+import logging
+import random
+import threading
+import time
+
+from openai import AsyncOpenAI, APIConnectionError, APIStatusError, APITimeoutError, RateLimitError
+
+from llm.cache import cache_key, get_cache
+
+# Shared gateway for OpenAI calls of all subsystems.
+# Every request runs on one event loop owned by the gateway, where a semaphore bounds the requests
+# in flight and per-model token buckets keep requests and tokens per minute under the account limits.
+# Failed requests are retried with jittered exponential backoff. Synchronous code calls `chat_sync`,
+# coroutines on any other loop call `chat`; both end up on the gateway loop, so the limits are shared.
+
+MAX_CONCURRENCY = 6
+REQUEST_TIMEOUT = 180
+MAX_RETRIES = 5
+BACKOFF_BASE = 1.0
+BACKOFF_CAP = 60.0
+
+# Requests and tokens per minute, keep them a little under the limits of the account's usage tier
+MODEL_LIMITS = {
+    'gpt-4o': {'rpm': 450, 'tpm': 28000},
+    'whisper-1': {'rpm': 45, 'tpm': None},
+}
+DEFAULT_LIMITS = {'rpm': 450, 'tpm': 28000}
+
+# Completion tokens reserved for a request that does not set max_tokens, corrected from the usage afterwards
+COMPLETION_TOKENS_ESTIMATE = 1500
+IMAGE_TOKENS_ESTIMATE = 765
+
+def estimate_tokens(messages, max_tokens=None):
+    """Rough prompt size of chat messages (4 characters per token, a fixed cost per image) plus the completion."""
+    tokens = 0
+    for message in messages:
+        content = message.get('content')
+        parts = content if isinstance(content, list) else [content]
+        for part in parts:
+            if isinstance(part, dict) and part.get('type') == 'image_url':
+                tokens += 85 if part['image_url'].get('detail') == 'low' else IMAGE_TOKENS_ESTIMATE
+            elif isinstance(part, dict):
+                tokens += len(part.get('text', '')) // 4
+            elif part:
+                tokens += len(str(part)) // 4
+    return tokens + (max_tokens or COMPLETION_TOKENS_ESTIMATE)
+
+class TokenBucket:
+    """Async token bucket refilling `per_minute` tokens per minute, used on the gateway loop only."""
+
+    def __init__(self, per_minute):
+        self.capacity = per_minute
+        self.rate = per_minute / 60
+        self.tokens = float(per_minute)
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self, amount):
+        # A request larger than the whole bucket waits for a full bucket instead of forever
+        amount = min(amount, self.capacity)
+        while True:
+            self._refill()
+            if self.tokens >= amount:
+                self.tokens -= amount
+                return
+            await asyncio.sleep((amount - self.tokens) / self.rate)
+
+    def adjust(self, amount):
+        """Give back (negative amount) or take more tokens once the real usage is known."""
+        self._refill()
+        self.tokens = min(self.capacity, self.tokens - amount)
+
+class LLMGateway:
+
+    max_concurrency: int
+    timeout: float
+    max_retries: int
+
+    def __init__(self, api_key, base_url=None, max_concurrency=MAX_CONCURRENCY, limits=MODEL_LIMITS, timeout=REQUEST_TIMEOUT, max_retries=MAX_RETRIES, cache=None):
+        self.api_key = api_key
+        self.base_url = base_url
+        self.max_concurrency = max_concurrency
+        self.limits = limits
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.cache = cache
+        self.loop = None
+        self.loop_lock = threading.Lock()
+        self.client = None
+        self.semaphore = None
+        self.buckets = {}
+
+    def _get_loop(self):
+        with self.loop_lock:
+            if self.loop is None:
+                self.loop = asyncio.new_event_loop()
+                threading.Thread(target=self.loop.run_forever, name='llm_gateway', daemon=True).start()
+        return self.loop
+
+    def _setup(self):
+        # Runs on the gateway loop, so the client and the semaphore belong to it
+        if self.client is None:
+            # Retries and timeouts are handled here, not by the client
+            self.client = AsyncOpenAI(api_key=self.api_key, base_url=self.base_url, max_retries=0, timeout=self.timeout)
+            self.semaphore = asyncio.Semaphore(self.max_concurrency)
+
+    def _buckets(self, model):
+        if model not in self.buckets:
+            limits = self.limits.get(model, DEFAULT_LIMITS)
+            self.buckets[model] = (
+                TokenBucket(limits['rpm']) if limits.get('rpm') else None,
+                TokenBucket(limits['tpm']) if limits.get('tpm') else None,
+            )
+        return self.buckets[model]
+
+    def _retry_delay(self, attempt, error):
+        delay = random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * 2 ** attempt))
+        response = getattr(error, 'response', None)
+        retry_after = response.headers.get('retry-after') if response is not None else None
+        if retry_after:
+            try:
+                delay = max(delay, float(retry_after))
+            except ValueError:
+                pass
+        return delay
+
+    async def _call(self, model, request, tokens):
+        """Run `request()` under the concurrency and rate limits, retrying transient failures."""
+        self._setup()
+        requests_bucket, tokens_bucket = self._buckets(model)
+        for attempt in range(self.max_retries + 1):
+            if requests_bucket:
+                await requests_bucket.acquire(1)
+            if tokens_bucket:
+                await tokens_bucket.acquire(tokens)
+            try:
+                try:
+                    async with self.semaphore:
+                        return await asyncio.wait_for(request(), self.timeout)
+                except BaseException:
+                    # A failed or cancelled attempt reports no usage, a retry takes its estimate again
+                    if tokens_bucket:
+                        tokens_bucket.adjust(-tokens)
+                    raise
+            except (RateLimitError, APITimeoutError, APIConnectionError, asyncio.TimeoutError) as e:
+                error = e
+            except APIStatusError as e:
+                if e.status_code < 500:
+                    raise
+                error = e
+            if attempt == self.max_retries:
+                raise error
+            delay = self._retry_delay(attempt, error)
+            logging.warning(f"{model} request failed ({type(error).__name__}: {error}), retry {attempt + 1} in {delay:.1f}s")
+            await asyncio.sleep(delay)
+
+    async def _chat(self, model, messages, bypass_cache, ttl, params):
+        cache = self.cache or get_cache()
+        key = cache_key(model, messages, **params)
+        if cache.enabled and not bypass_cache:
+            response = await asyncio.to_thread(cache.get, key)
+            if response is not None:
+                logging.info(f"LLM cache hit for {model} ({key[:12]})")
+                return response
+            logging.info(f"LLM cache miss for {model} ({key[:12]})")
+
+        tokens = estimate_tokens(messages, params.get('max_tokens'))
+        started = time.perf_counter()
+        completion = await self._call(model, lambda: self.client.chat.completions.create(model=model, messages=messages, **params), tokens)
+        tokens_bucket = self._buckets(model)[1]
+        if tokens_bucket and completion.usage is not None:
+            tokens_bucket.adjust(completion.usage.total_tokens - tokens)
+        logging.info(f"{model} answered in {time.perf_counter() - started:.1f}s")
+
+        response = completion.choices[0].message.content
+        if cache.enabled and response is not None:
+            try:
+                await asyncio.to_thread(cache.put, key, model, response, ttl)
+            except Exception as e:
+                # A broken cache must not lose a paid response
+                logging.error(f"Error storing LLM response in the cache: {e}", exc_info=True)
+        return response
+
+    async def _stream(self, model, messages, bypass_cache, ttl, params, emit):
+        cache = self.cache or get_cache()
+        key = cache_key(model, messages, **params)
+        if cache.enabled and not bypass_cache:
+            response = await asyncio.to_thread(cache.get, key)
+            if response is not None:
+                logging.info(f"LLM cache hit for {model} ({key[:12]})")
+                emit(response)
+                return response
+            logging.info(f"LLM cache miss for {model} ({key[:12]})")
+
+        tokens = estimate_tokens(messages, params.get('max_tokens'))
+        started = time.perf_counter()
+        # Only opening the stream is retried, a stream that breaks after its first tokens fails the request
+        stream = await self._call(model, lambda: self.client.chat.completions.create(model=model, messages=messages, stream=True, **params), tokens)
+        parts = []
+
+        async def consume():
+            async for chunk in stream:
+                delta = chunk.choices[0].delta.content if chunk.choices else None
+                if delta:
+                    if not parts:
+                        logging.info(f"{model} started answering after {time.perf_counter() - started:.1f}s")
+                    parts.append(delta)
+                    emit(delta)
+
+        async with self.semaphore:
+            await asyncio.wait_for(consume(), self.timeout)
+        response = "".join(parts)
+        # Streamed completions carry no usage, count the answer like the estimate does
+        tokens_bucket = self._buckets(model)[1]
+        if tokens_bucket:
+            tokens_bucket.adjust(len(response) // 4 - (params.get('max_tokens') or COMPLETION_TOKENS_ESTIMATE))
+        logging.info(f"{model} answered in {time.perf_counter() - started:.1f}s")
+
+        if cache.enabled and response:
+            try:
+                await asyncio.to_thread(cache.put, key, model, response, ttl)
+            except Exception as e:
+                logging.error(f"Error storing LLM response in the cache: {e}", exc_info=True)
+        return response
+
+    async def _transcribe(self, model, path):
+        def read():
+            with open(path, 'rb') as f:
+                return f.read()
+        audio = await asyncio.to_thread(read)
+        name = path.replace('\\', '/').rsplit('/', 1)[-1]
+        return await self._call(model, lambda: self.client.audio.transcriptions.create(model=model, file=(name, audio)), 0)
+
+    def _submit(self, coroutine):
+        return asyncio.run_coroutine_threadsafe(coroutine, self._get_loop())
+
+    async def chat(self, model, messages, bypass_cache=False, ttl=None, **params):
+        """
+        Return the content of a chat completion, from the cache when the same request was made before.
+
+        Parameters:
+        bypass_cache (bool): Always call the API, the fresh response still replaces the cached one.
+        ttl (timedelta): Cache lifetime of this response, the cache default when None.
+        params: Further arguments of chat.completions.create, e.g. temperature.
+        """
+        return await asyncio.wrap_future(self._submit(self._chat(model, messages, bypass_cache, ttl, params)))
+
+    def chat_sync(self, model, messages, bypass_cache=False, ttl=None, **params):
+        """Blocking `chat` for synchronous code, safe to call from many threads at once."""
+        return self._submit(self._chat(model, messages, bypass_cache, ttl, params)).result()
+
+    async def chat_stream(self, model, messages, bypass_cache=False, ttl=None, **params):
+        """
+        Yield the text of a chat completion piece by piece while it is generated.
+
+        Takes the same arguments as `chat` and shares its cache, a cached response is yielded at once.
+        The gateway loop hands the pieces over to the caller's loop, so any loop may iterate.
+        """
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue()
+        done = object()
+        future = self._submit(self._stream(model, messages, bypass_cache, ttl, params, lambda delta: loop.call_soon_threadsafe(queue.put_nowait, delta)))
+        # Runs on the gateway loop after the last delta was handed over, so it is queued behind it
+        future.add_done_callback(lambda _: loop.call_soon_threadsafe(queue.put_nowait, done))
+        try:
+            while True:
+                delta = await queue.get()
+                if delta is done:
+                    break
+                yield delta
+            future.result()
+        finally:
+            if not future.done():
+                future.cancel()
+
+    async def transcribe(self, path, model='whisper-1'):
+        """Transcribe an audio file, returns the transcription object."""
+        return await asyncio.wrap_future(self._submit(self._transcribe(model, path)))
+
+_gateways = {}
+_gateways_lock = threading.Lock()
+
+def get_gateway(api_key, base_url=None):
+    """Return the process-wide gateway for an API key, created on first use."""
+    with _gateways_lock:
+        if (api_key, base_url) not in _gateways:
+            _gateways[(api_key, base_url)] = LLMGateway(api_key, base_url)
+        return _gateways[(api_key, base_url)]
+
+def test(requests=6, latency=1.0):
+    """Send concurrent requests to a local stand-in for chat completions that answers 429 to every 4th request."""
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+    from llm.cache import LLMCache
+
+    counter = {'requests': 0}
+    counter_lock = threading.Lock()
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+            with counter_lock:
+                counter['requests'] += 1
+                limited = counter['requests'] % 4 == 0
+            if limited:
+                self.send_response(429)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Retry-After', '0.5')
+                self.end_headers()
+                self.wfile.write(json.dumps({'error': {'message': 'Rate limit reached', 'type': 'requests'}}).encode())
+                return
+            time.sleep(latency)
+            content = f"echo: {body['messages'][-1]['content']}"
+            if body.get('stream'):
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/event-stream')
+                self.end_headers()
+                words = content.split(' ')
+                for piece in [words[0]] + [' ' + word for word in words[1:]]:
+                    chunk = {
+                        'id': 'chatcmpl-test', 'object': 'chat.completion.chunk', 'created': int(time.time()), 'model': body['model'],
+                        'choices': [{'index': 0, 'finish_reason': None, 'delta': {'content': piece}}],
+                    }
+                    self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode())
+                    self.wfile.flush()
+                    time.sleep(latency / 4)
+                self.wfile.write(b"data: [DONE]\n\n")
+                return
+            answer = {
+                'id': 'chatcmpl-test', 'object': 'chat.completion', 'created': int(time.time()), 'model': body['model'],
+                'choices': [{'index': 0, 'finish_reason': 'stop', 'message': {'role': 'assistant', 'content': content}}],
+                'usage': {'prompt_tokens': 10, 'completion_tokens': 5, 'total_tokens': 15},
+            }
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.end_headers()
+            self.wfile.write(json.dumps(answer).encode())
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        cache = LLMCache('sqlite://', enabled=False)
+        gateway = LLMGateway('test', base_url=f"http://127.0.0.1:{server.server_port}/v1", cache=cache)
+
+        async def run():
+            return await asyncio.gather(*[
+                gateway.chat('gpt-4o', [{'role': 'user', 'content': f"request {i}"}]) for i in range(requests)
+            ])
+
+        started = time.perf_counter()
+        answers = asyncio.run(run())
+        elapsed = time.perf_counter() - started
+        assert answers == [f"echo: request {i}" for i in range(requests)], answers
+        print(f"{requests} requests with {latency:.1f}s latency answered in {elapsed:.1f}s ({counter['requests']} HTTP calls)")
+
+        async def stream():
+            started = time.perf_counter()
+            deltas = []
+            async for delta in gateway.chat_stream('gpt-4o', [{'role': 'user', 'content': "streamed request"}]):
+                deltas.append((time.perf_counter() - started, delta))
+            return deltas
+
+        deltas = asyncio.run(stream())
+        assert "".join(delta for _, delta in deltas) == "echo: streamed request", deltas
+        print(f"Streamed {len(deltas)} pieces, first after {deltas[0][0]:.1f}s, last after {deltas[-1][0]:.1f}s")
+    finally:
+        server.shutdown()
+
+if __name__ == "__main__":
+    test()
@@ -0,0 +1,608 @@
+import asyncio
+import hashlib
+import logging
+import os
+import random
+import threading
+import time
+from datetime import datetime, timedelta
+
+from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError, TelegramRetryAfter
+from aiogram.types import BufferedInputFile
+from sqlalchemy import create_engine, Column, String, Integer, DateTime, Text, LargeBinary, Index, func, update
+from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.orm import sessionmaker, aliased
+
+from messaging.sender import split_message
+
+# Durable outbox for Telegram posts of chart, news and youtube.
+# Posts are written to a SQLite table first, one row per Telegram call (a photo, or one part of a long text),
+# and a drainer on the sender loop delivers them: by priority, paced by token buckets per chat and for the bot,
+# retried after `retry_after` or with backoff, in order within a chat. A post survives a crash because it is
+# on disk before the first request, and it is never delivered twice:
+#   - every row has a unique key, enqueueing the same post again does nothing
+#   - a row is claimed (pending -> sending) with a conditional update, so only one drainer sends it
+#   - the Telegram message id is recorded with status sent, sent rows are never picked again
+# Only a crash between Telegram accepting a call and the row being marked sent leaves a row in `sending`,
+# it is sent again on the next start (logged), as there is no way to ask Telegram whether it arrived.
+
+OUTBOX_DATABASE_URL = 'sqlite:///' + os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'outbox.db')
+
+# Lower goes first
+PRIORITY_SIGNAL = 0
+PRIORITY_ANALYSIS = 10
+PRIORITY_DIGEST = 20
+
+PENDING = 'pending'
+SENDING = 'sending'
+SENT = 'sent'
+FAILED = 'failed'
+
+# Telegram allows about 20 messages per minute in a group or channel and 30 per second for a bot
+CHAT_RATE = 20 / 60
+CHAT_BURST = 4
+BOT_RATE = 25
+BOT_BURST = 25
+
+MAX_ATTEMPTS = 8
+BACKOFF_BASE = 2.0
+BACKOFF_CAP = 300.0
+POLL_INTERVAL = 5.0
+# Delivered and failed messages are kept this long, for their keys and for replies to them
+SENT_RETENTION = timedelta(days=7)
+
+Base = declarative_base()
+
+class OutboxMessage(Base):
+    __tablename__ = 'telegram_outbox'
+    __table_args__ = (
+        Index('ix_telegram_outbox_due', 'bot_id', 'status', 'priority', 'id'),
+        Index('uq_telegram_outbox_key', 'key', unique=True),
+    )
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    key = Column(String)
+    bot_id = Column(String)
+    chat_id = Column(String)
+    priority = Column(Integer)
+    kind = Column(String)  # 'text' or 'photo'
+    text = Column(Text)  # message text, or caption of a photo
+    photo = Column(String)  # file name of the photo
+    # The photo itself, copied in when the post is enqueued: the file (e.g. in the chart store) may be gone by
+    # the time it is sent. Cleared once the message is sent or failed.
+    photo_content = Column(LargeBinary)
+    parse_mode = Column(String)
+    # Outbox id of the row this one replies to, resolved to its Telegram message id once it was sent
+    reply_to_id = Column(Integer)
+    reply_to_message_id = Column(Integer)
+    status = Column(String, default=PENDING)
+    attempts = Column(Integer, default=0)
+    next_attempt_at = Column(DateTime)
+    message_id = Column(Integer)
+    error = Column(Text)
+    created_at = Column(DateTime)
+    sent_at = Column(DateTime)
+
+def bot_id(token):
+    """The public numeric part of a bot token, which identifies the bot without storing the secret."""
+    return token.split(':', 1)[0]
+
+def text_messages(text, parse_mode='Markdown'):
+    """Messages of a text of any length, one per Telegram message."""
+    return [{'kind': 'text', 'text': part, 'parse_mode': parse_mode} for part in split_message(text)]
+
+def photo_message(photo, caption=None):
+    return {'kind': 'photo', 'photo': photo, 'text': caption}
+
+def post_key(*parts):
+    """Key of a post from whatever identifies it, e.g. post_key('analysis', symbol, interval, text)."""
+    return hashlib.sha256('\x1f'.join(map(str, parts)).encode('utf-8')).hexdigest()
+
+def _row(message):
+    return {column.name: getattr(message, column.name) for column in OutboxMessage.__table__.columns if column.name != 'photo_content'}
+
+def _read(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+class Outbox:
+    """Storage of the outbox, safe to use from many threads and processes."""
+
+    def __init__(self, database_url=OUTBOX_DATABASE_URL):
+        self.engine = create_engine(database_url)
+        Base.metadata.create_all(self.engine)
+        self.Session = sessionmaker(bind=self.engine)
+        self.lock = threading.Lock()
+
+    def enqueue(self, bot, chat_id, messages, key, priority=PRIORITY_ANALYSIS, reply_to_message_id=None, thread=True):
+        """
+        Store a post of one or more messages.
+
+        Parameters:
+        bot (str): bot_id of the sending bot.
+        messages (list[dict]): text_messages and photo_message entries, sent in this order.
+        key (str): Identity of the post, a post with a key that was enqueued before is not stored again.
+        reply_to_message_id (int): Telegram message the first message replies to.
+        thread (bool): Each message replies to the one before it.
+
+        Returns:
+        list[int]: Outbox ids of the messages.
+        """
+        now = datetime.utcnow()
+        with self.lock:
+            session = self.Session()
+            try:
+                first = session.query(OutboxMessage.id).filter(OutboxMessage.key == f"{key}:0").scalar()
+                if first is not None:
+                    logging.info(f"Post {key[:12]} is already in the outbox")
+                    return [row.id for row in session.query(OutboxMessage.id).filter(
+                        OutboxMessage.id >= first, OutboxMessage.key.startswith(f"{key}:")).order_by(OutboxMessage.id)]
+                ids = []
+                for index, message in enumerate(messages):
+                    row = OutboxMessage(
+                        key=f"{key}:{index}",
+                        bot_id=bot,
+                        chat_id=str(chat_id),
+                        priority=priority,
+                        kind=message['kind'],
+                        text=message.get('text'),
+                        photo=message.get('photo'),
+                        photo_content=_read(message['photo']) if message.get('photo') else None,
+                        parse_mode=message.get('parse_mode'),
+                        reply_to_id=ids[-1] if thread and ids else None,
+                        reply_to_message_id=reply_to_message_id if not ids or not thread else None,
+                        status=PENDING,
+                        attempts=0,
+                        next_attempt_at=now,
+                        created_at=now,
+                    )
+                    session.add(row)
+                    session.flush()
+                    ids.append(row.id)
+                session.commit()
+                return ids
+            except Exception:
+                session.rollback()
+                raise
+            finally:
+                session.close()
+
+    def due(self, bot, limit=100):
+        """
+        The most urgent pending message of each chat of a bot that may be sent now and whose reply target was sent,
+        most urgent first. One per chat, so a backlog in one chat never hides the messages of the others.
+        """
+        now = datetime.utcnow()
+        session = self.Session()
+        try:
+            parents = session.query(OutboxMessage.id).filter(OutboxMessage.status != SENT)
+            ranked = session.query(
+                OutboxMessage.id,
+                func.row_number().over(partition_by=OutboxMessage.chat_id, order_by=(OutboxMessage.priority, OutboxMessage.id)).label('rank'),
+            ).filter(
+                OutboxMessage.bot_id == bot,
+                OutboxMessage.status == PENDING,
+                OutboxMessage.next_attempt_at <= now,
+                (OutboxMessage.reply_to_id.is_(None)) | (~OutboxMessage.reply_to_id.in_(parents.scalar_subquery())),
+            ).subquery()
+            heads = aliased(OutboxMessage)
+            rows = session.query(heads).join(ranked, ranked.c.id == heads.id).filter(ranked.c.rank == 1).order_by(
+                heads.priority, heads.id).limit(limit).all()
+            result = [_row(row) for row in rows]
+            # Telegram message ids of the rows replied to
+            for row in result:
+                if row['reply_to_id'] is not None:
+                    row['reply_to_message_id'] = session.query(OutboxMessage.message_id).filter(OutboxMessage.id == row['reply_to_id']).scalar()
+            return result
+        finally:
+            session.close()
+
+    def get(self, message_id):
+        session = self.Session()
+        try:
+            return _row(session.get(OutboxMessage, message_id))
+        finally:
+            session.close()
+
+    def photo(self, message_id):
+        session = self.Session()
+        try:
+            return session.query(OutboxMessage.photo_content).filter(OutboxMessage.id == message_id).scalar()
+        finally:
+            session.close()
+
+    def _update(self, id, condition=None, **values):
+        session = self.Session()
+        try:
+            query = update(OutboxMessage).where(OutboxMessage.id == id)
+            if condition is not None:
+                query = query.where(condition)
+            updated = session.execute(query.values(**values)).rowcount
+            session.commit()
+            return updated == 1
+        finally:
+            session.close()
+
+    def claim(self, message_id):
+        """Mark a message as being sent, False when another drainer claimed it first."""
+        return self._update(message_id, OutboxMessage.status == PENDING, status=SENDING, attempts=OutboxMessage.attempts + 1)
+
+    def mark_sent(self, message_id, telegram_message_id):
+        self._update(message_id, status=SENT, message_id=telegram_message_id, sent_at=datetime.utcnow(), error=None, photo_content=None)
+
+    def mark_retry(self, message_id, delay, error):
+        self._update(message_id, status=PENDING, next_attempt_at=datetime.utcnow() + timedelta(seconds=delay), error=error)
+
+    def mark_failed(self, message_id, error):
+        self._update(message_id, status=FAILED, error=error, photo_content=None)
+        # Replies to a message that will never exist fail with it
+        session = self.Session()
+        try:
+            children = [row.id for row in session.query(OutboxMessage.id).filter(OutboxMessage.reply_to_id == message_id)]
+        finally:
+            session.close()
+        for child in children:
+            self.mark_failed(child, f"replied message {message_id} failed")
+
+    def recover(self, bot, retention=SENT_RETENTION):
+        """Put messages left in `sending` by a crashed drainer back in the queue, and drop old delivered ones."""
+        session = self.Session()
+        try:
+            session.query(OutboxMessage).filter(
+                OutboxMessage.bot_id == bot, OutboxMessage.status.in_((SENT, FAILED)),
+                OutboxMessage.created_at < datetime.utcnow() - retention,
+            ).delete(synchronize_session=False)
+            rows = session.query(OutboxMessage).filter(OutboxMessage.bot_id == bot, OutboxMessage.status == SENDING).all()
+            for row in rows:
+                logging.warning(f"Outbox message {row.id} to {row.chat_id} may or may not have been sent before a restart, sending it again")
+                row.status = PENDING
+            session.commit()
+            return len(rows)
+        finally:
+            session.close()
+
+    def stats(self):
+        session = self.Session()
+        try:
+            return dict(session.query(OutboxMessage.status, func.count(OutboxMessage.id)).group_by(OutboxMessage.status).all())
+        finally:
+            session.close()
+
+class RateBucket:
+    """Non-blocking token bucket, `take` returns 0 when a token was taken or the seconds until one is available."""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.capacity = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.resume_at = 0.0
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait(self):
+        now = time.monotonic()
+        self._refill(now)
+        return max(self.resume_at - now, (1 - self.tokens) / self.rate, 0.0)
+
+    def take(self):
+        wait = self.wait()
+        if wait == 0:
+            self.tokens -= 1
+        return wait
+
+    def pause(self, seconds):
+        """After a flood wait: nothing until `seconds` have passed, and then an empty bucket."""
+        self.resume_at = max(self.resume_at, time.monotonic() + seconds)
+        self.tokens = 0.0
+
+class OutboxDrainer:
+    """
+    Delivers the outbox messages of one bot, runs on the loop of its TelegramSender.
+
+    One message per chat is in flight at a time, which keeps the order within a chat, while other chats are served
+    in parallel. A chat that is throttled or in a flood wait is skipped, so it does not hold up the others.
+    """
+
+    def __init__(self, sender, outbox, chat_rate=CHAT_RATE, chat_burst=CHAT_BURST, bot_rate=BOT_RATE, bot_burst=BOT_BURST,
+                 max_attempts=MAX_ATTEMPTS, poll_interval=POLL_INTERVAL):
+        self.sender = sender
+        self.outbox = outbox
+        self.bot = bot_id(sender.token)
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.bot_bucket = RateBucket(bot_rate, bot_burst)
+        self.chat_buckets = {}
+        self.max_attempts = max_attempts
+        self.poll_interval = poll_interval
+        self.in_flight = set()
+        # The loop only keeps weak references to tasks, a delivery must not be collected while it runs
+        self.deliveries = set()
+        # Outbox id -> futures of wait_sent, woken when a delivery of the message ends
+        self.waiters = {}
+        self.wakeup = None
+        self.task = None
+
+    def _bucket(self, chat_id):
+        if chat_id not in self.chat_buckets:
+            self.chat_buckets[chat_id] = RateBucket(self.chat_rate, self.chat_burst)
+        return self.chat_buckets[chat_id]
+
+    def rate_wait(self, chat_id):
+        """Seconds until a call to the chat is allowed, runs on the sender loop."""
+        return max(self.bot_bucket.wait(), self._bucket(str(chat_id)).wait())
+
+    async def throttle(self, chat_id):
+        """
+        Wait for and take a token of the chat and of the bot, for a call made outside the outbox (e.g. an edit of a
+        streamed message), so it is paced together with the outbox messages. Runs on the sender loop.
+        """
+        while (wait := self.rate_wait(chat_id)) > 0:
+            await asyncio.sleep(wait)
+        self.bot_bucket.take()
+        self._bucket(str(chat_id)).take()
+
+    def flood_wait(self, chat_id, seconds):
+        """A flood wait of a call made outside the outbox holds back the outbox messages of the chat too."""
+        self._bucket(str(chat_id)).pause(seconds)
+
+    async def wait_sent(self, message_id):
+        """Telegram message id of an outbox message once it is sent, raises RuntimeError when it failed."""
+        while True:
+            row = await asyncio.to_thread(self.outbox.get, message_id)
+            if row['status'] == SENT:
+                return row['message_id']
+            if row['status'] == FAILED:
+                raise RuntimeError(f"Outbox message {message_id} failed: {row['error']}")
+            waiter = asyncio.get_running_loop().create_future()
+            self.waiters.setdefault(message_id, []).append(waiter)
+            try:
+                await asyncio.wait_for(waiter, self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    def start(self):
+        """Start draining on the sender loop, safe to call from any thread and more than once."""
+        async def start():
+            # A task of a loop that was closed with the sender is gone with it
+            if self.task is None or self.task.done() or self.task.get_loop() is not asyncio.get_running_loop():
+                self.wakeup = asyncio.Event()
+                self.task = asyncio.create_task(self._run())
+        self.sender.run(start()).result()
+
+    def notify(self):
+        """Look at the outbox now instead of at the next poll, e.g. after enqueueing."""
+        loop = self.sender.loop
+        if loop is not None and self.wakeup is not None:
+            loop.call_soon_threadsafe(self.wakeup.set)
+
+    async def _run(self):
+        recovered = await asyncio.to_thread(self.outbox.recover, self.bot)
+        if recovered:
+            logging.info(f"Recovered {recovered} outbox messages of bot {self.bot}")
+        while True:
+            try:
+                timeout = await self._dispatch()
+            except Exception as e:
+                logging.error(f"Error draining the Telegram outbox: {e}", exc_info=True)
+                timeout = self.poll_interval
+            self.wakeup.clear()
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _dispatch(self):
+        """Start the sends that are allowed now, returns how long to wait before looking again."""
+        timeout = self.poll_interval
+        for row in await asyncio.to_thread(self.outbox.due, self.bot):
+            chat_id = row['chat_id']
+            if chat_id in self.in_flight:
+                continue
+            wait = max(self.bot_bucket.wait(), self._bucket(chat_id).wait())
+            if wait > 0:
+                timeout = min(timeout, wait)
+                continue
+            if not await asyncio.to_thread(self.outbox.claim, row['id']):
+                continue
+            self.bot_bucket.take()
+            self._bucket(chat_id).take()
+            self.in_flight.add(chat_id)
+            delivery = asyncio.create_task(self._deliver(row))
+            self.deliveries.add(delivery)
+            delivery.add_done_callback(self.deliveries.discard)
+        return timeout
+
+    async def _send(self, row, parse_mode):
+        bot = self.sender._get_bot()
+        if row['kind'] == 'photo':
+            photo = BufferedInputFile(await asyncio.to_thread(self.outbox.photo, row['id']), os.path.basename(row['photo']))
+            return await bot.send_photo(chat_id=row['chat_id'], photo=photo, caption=row['text'],
+                                        reply_to_message_id=row['reply_to_message_id'])
+        return await bot.send_message(chat_id=row['chat_id'], text=row['text'], parse_mode=parse_mode,
+                                      reply_to_message_id=row['reply_to_message_id'])
+
+    async def _deliver(self, row):
+        chat_id = row['chat_id']
+        try:
+            try:
+                msg = await self._send(row, row['parse_mode'])
+            except TelegramBadRequest:
+                if not row['parse_mode']:
+                    raise
+                logging.exception(f"could not send formatted message: {row['text']}")
+                msg = await self._send(row, None)
+        except TelegramRetryAfter as e:
+            # Flood wait: nothing goes to the chat until it is over
+            logging.warning(f"Telegram asks to retry after {e.retry_after}s in chat {chat_id}")
+            self._bucket(chat_id).pause(e.retry_after)
+            await asyncio.to_thread(self.outbox.mark_retry, row['id'], e.retry_after, str(e))
+        except (TelegramBadRequest, TelegramForbiddenError) as e:
+            logging.error(f"Outbox message {row['id']} to {chat_id} cannot be sent: {e}")
+            await asyncio.to_thread(self.outbox.mark_failed, row['id'], str(e))
+        except Exception as e:
+            attempts = row['attempts'] + 1
+            if attempts >= self.max_attempts:
+                logging.error(f"Giving up on outbox message {row['id']} to {chat_id} after {attempts} attempts: {e}")
+                await asyncio.to_thread(self.outbox.mark_failed, row['id'], str(e))
+            else:
+                delay = min(BACKOFF_CAP, BACKOFF_BASE * 2 ** (attempts - 1)) * random.uniform(0.5, 1.5)
+                logging.warning(f"Outbox message {row['id']} to {chat_id} failed ({type(e).__name__}: {e}), retry {attempts} in {delay:.1f}s")
+                await asyncio.to_thread(self.outbox.mark_retry, row['id'], delay, str(e))
+        else:
+            # Outside the retries: a message Telegram accepted is never sent again, if it cannot be marked
+            # it stays in `sending` until the next start
+            try:
+                await asyncio.to_thread(self.outbox.mark_sent, row['id'], msg.message_id)
+            except Exception as e:
+                logging.error(f"Outbox message {row['id']} was sent as {msg.message_id} but could not be marked: {e}")
+        finally:
+            self.in_flight.discard(chat_id)
+            for waiter in self.waiters.pop(row['id'], []):
+                if not waiter.done():
+                    waiter.set_result(None)
+            self.wakeup.set()
+
+_outbox = None
+_drainers = {}
+_outbox_lock = threading.Lock()
+
+def get_outbox():
+    """Return the process-wide outbox, created on first use."""
+    global _outbox
+    with _outbox_lock:
+        if _outbox is None:
+            _outbox = Outbox()
+        return _outbox
+
+def start_outbox(sender):
+    """Start delivering the outbox messages of a sender's bot, including those left over from before a restart."""
+    outbox = get_outbox()
+    with _outbox_lock:
+        if sender not in _drainers:
+            _drainers[sender] = OutboxDrainer(sender, outbox)
+        drainer = _drainers[sender]
+    drainer.start()
+    return drainer
+
+def post(sender, chat_id, messages, key, priority=PRIORITY_ANALYSIS, reply_to_message_id=None, thread=True):
+    """
+    Enqueue a post of `sender`'s bot and make sure it is being delivered.
+
+    Returns:
+    list[int]: Outbox ids of the messages, see Outbox.enqueue.
+    """
+    ids = get_outbox().enqueue(bot_id(sender.token), chat_id, messages, key, priority, reply_to_message_id, thread)
+    start_outbox(sender).notify()
+    return ids
+
+# Calls made outside the outbox with the same sender, from coroutines on any loop
+
+async def _drainer(sender):
+    return await asyncio.to_thread(start_outbox, sender)
+
+async def _call(function, *args):
+    # The buckets are only touched on the sender loop
+    return function(*args)
+
+async def throttle(sender, chat_id):
+    """Wait until a call to the chat fits the rate limits shared with the outbox, see OutboxDrainer.throttle."""
+    drainer = await _drainer(sender)
+    await sender._await(drainer.throttle(chat_id))
+
+async def rate_wait(sender, chat_id):
+    """Seconds until a call to the chat would fit the rate limits shared with the outbox."""
+    drainer = await _drainer(sender)
+    return await sender._await(_call(drainer.rate_wait, chat_id))
+
+async def flood_wait(sender, chat_id, seconds):
+    drainer = await _drainer(sender)
+    await sender._await(_call(drainer.flood_wait, chat_id, seconds))
+
+async def wait_sent(sender, message_id):
+    """Telegram message id of an outbox message of `sender`'s bot once it is sent."""
+    drainer = await _drainer(sender)
+    return await sender._await(drainer.wait_sent(message_id))
+
+def test_queue(path='outbox_test.png'):
+    """A backlog in one chat does not hide the other chats, and a photo survives the removal of its file."""
+    outbox = Outbox('sqlite://')
+    for i in range(5):
+        outbox.enqueue('1', -100, text_messages(f"post {i}"), post_key('busy', i))
+    outbox.enqueue('1', -101, text_messages("quiet"), post_key('quiet'))
+    assert [row['chat_id'] for row in outbox.due('1', limit=2)] == ['-100', '-101']
+
+    with open(path, 'wb') as f:
+        f.write(b'\x89PNG\r\n\x1a\nchart')
+    [photo_id] = outbox.enqueue('1', -102, [photo_message(path)], post_key('photo'), PRIORITY_SIGNAL)
+    os.unlink(path)
+    assert outbox.due('1')[0]['id'] == photo_id and outbox.photo(photo_id) == b'\x89PNG\r\n\x1a\nchart'
+    outbox.mark_sent(photo_id, 1)
+    assert outbox.photo(photo_id) is None
+
+def test(chats=3, posts=4):
+    """Post to several chats of a local stand-in for the Bot API that answers every 7th call with a flood wait."""
+    import json
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    test_queue()
+    from messaging.sender import TelegramSender
+
+    calls = []
+    calls_lock = threading.Lock()
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers['Content-Length'])).decode()
+            with calls_lock:
+                calls.append(body)
+                count = len(calls)
+            if count % 7 == 0:
+                answer = {'ok': False, 'error_code': 429, 'description': 'Too Many Requests: retry after 1', 'parameters': {'retry_after': 1}}
+                self.send_response(429)
+            else:
+                answer = {'ok': True, 'result': {'message_id': count, 'date': int(time.time()), 'chat': {'id': -1, 'type': 'channel'}, 'text': 'ok'}}
+                self.send_response(200)
+            answer = json.dumps(answer).encode()
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(answer)))
+            self.end_headers()
+            self.wfile.write(answer)
+
+        def log_message(self, *args):
+            pass
+
+    global _outbox
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    _outbox = Outbox('sqlite:///outbox_test.db')
+    try:
+        _outbox.engine.dispose()
+        Base.metadata.drop_all(_outbox.engine)
+        Base.metadata.create_all(_outbox.engine)
+        sender = TelegramSender('123456:test', api_url=f"http://127.0.0.1:{server.server_port}")
+        started = time.perf_counter()
+        for i in range(posts):
+            for chat in range(chats):
+                priority = PRIORITY_SIGNAL if i == posts - 1 else PRIORITY_DIGEST
+                post(sender, -100 - chat, text_messages(f"post {i} " + "x" * 5000), post_key('test', chat, i), priority)
+        # The same post again is not stored twice
+        post(sender, -100, text_messages("post 0 " + "x" * 5000), post_key('test', 0, 0), PRIORITY_DIGEST)
+
+        while _outbox.stats().get(SENT, 0) < chats * posts * 2:
+            assert time.perf_counter() - started < 120, _outbox.stats()
+            time.sleep(0.2)
+        elapsed = time.perf_counter() - started
+        stats = _outbox.stats()
+        assert stats == {SENT: chats * posts * 2}, stats
+        print(f"{chats * posts} posts of 2 messages to {chats} chats in {elapsed:.1f}s, {len(calls)} calls "
+              f"({len(calls) - chats * posts * 2} flood waits)")
+        sender.close()
+    finally:
+        server.shutdown()
+        _outbox = None
+
+# test()
@@ -0,0 +1,193 @@
+import asyncio
+import atexit
+import logging
+import threading
+import time
+
+from aiogram import Bot
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from aiogram.exceptions import TelegramBadRequest
+
+# Long-lived Telegram sender shared by chart, news and youtube.
+# One event loop on its own thread owns the aiogram Bot and its HTTP session for the lifetime of the process,
+# so connections and TLS are set up once instead of per message. Synchronous code submits work with
+# `submit`/`submit_text` and gets a concurrent.futures.Future back, coroutines on any other loop await
+# `request`/`send_text`; everything runs on the sender loop.
+
+MAX_MESSAGE_LENGTH = 4096  # Telegram's maximum message length
+
+def split_message(message, max_length=MAX_MESSAGE_LENGTH):
+    return [message[i:i + max_length] for i in range(0, len(message), max_length)] or ['']
+
+class TelegramSender:
+
+    def __init__(self, token, api_url=None):
+        self.token = token
+        self.api_url = api_url
+        self.loop = None
+        self.loop_lock = threading.Lock()
+        self.bot = None
+
+    def _get_loop(self):
+        with self.loop_lock:
+            if self.loop is None:
+                self.loop = asyncio.new_event_loop()
+                threading.Thread(target=self.loop.run_forever, name='telegram_sender', daemon=True).start()
+        return self.loop
+
+    def _get_bot(self):
+        # Runs on the sender loop, so the HTTP session of the bot belongs to it
+        if self.bot is None:
+            session = AiohttpSession(api=TelegramAPIServer.from_base(self.api_url)) if self.api_url else None
+            self.bot = Bot(token=self.token, session=session)
+        return self.bot
+
+    async def _request(self, method, params):
+        return await getattr(self._get_bot(), method)(**params)
+
+    def run(self, coroutine):
+        """Run a coroutine on the sender loop (e.g. several dependent requests), returns a concurrent future."""
+        return asyncio.run_coroutine_threadsafe(coroutine, self._get_loop())
+
+    async def _await(self, coroutine):
+        if asyncio.get_running_loop() is self.loop:
+            return await coroutine
+        return await asyncio.wrap_future(self.run(coroutine))
+
+    def submit(self, method, **params):
+        """
+        Call a Bot method, e.g. submit('send_photo', chat_id=..., photo=...), from synchronous code.
+
+        Returns:
+        Future: The result of the call, or its exception (TelegramRetryAfter, TelegramBadRequest, ...).
+        """
+        return self.run(self._request(method, params))
+
+    async def request(self, method, **params):
+        """Call a Bot method from a coroutine on any loop."""
+        return await self._await(self._request(method, params))
+
+    async def _send_text(self, chat_id, text, parse_mode, reply_to_message_id, thread):
+        message_ids = []
+        for part in split_message(text):
+            try:
+                msg = await self._get_bot().send_message(chat_id=chat_id, text=part, parse_mode=parse_mode, reply_to_message_id=reply_to_message_id)
+            except TelegramBadRequest:
+                if not parse_mode:
+                    raise
+                logging.exception(f"could not send formatted message: {part}")
+                msg = await self._get_bot().send_message(chat_id=chat_id, text=part, reply_to_message_id=reply_to_message_id)
+            if thread:
+                # Each part replies to the one before, so a long text stays a thread
+                reply_to_message_id = msg.message_id
+            message_ids.append(msg.message_id)
+        return message_ids
+
+    def submit_text(self, chat_id, text, parse_mode='Markdown', reply_to_message_id=None, thread=True):
+        """
+        Send a text of any length as several messages, falling back to plain text when Markdown is rejected.
+
+        Parameters:
+        thread (bool): Each part replies to the part before it, otherwise all reply to `reply_to_message_id`.
+
+        Returns:
+        Future: The message ids of the parts.
+        """
+        return self.run(self._send_text(chat_id, text, parse_mode, reply_to_message_id, thread))
+
+    async def send_text(self, chat_id, text, parse_mode='Markdown', reply_to_message_id=None, thread=True):
+        """`submit_text` for coroutines on any loop."""
+        return await self._await(self._send_text(chat_id, text, parse_mode, reply_to_message_id, thread))
+
+    def close(self, timeout=10):
+        """Close the HTTP session and stop the loop, the sender starts again on the next request."""
+        with self.loop_lock:
+            loop, bot = self.loop, self.bot
+            self.loop = None
+            self.bot = None
+        if loop is None:
+            return
+        async def shutdown():
+            # Background work on the loop (e.g. an outbox drainer) stops with it
+            tasks = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            if bot is not None:
+                await bot.session.close()
+        try:
+            asyncio.run_coroutine_threadsafe(shutdown(), loop).result(timeout)
+        except Exception as e:
+            logging.error(f"Error closing the Telegram session: {e}")
+        loop.call_soon_threadsafe(loop.stop)
+
+_senders = {}
+_senders_lock = threading.Lock()
+
+def get_sender(token, api_url=None):
+    """Return the process-wide sender for a bot token, created on first use."""
+    with _senders_lock:
+        if (token, api_url) not in _senders:
+            _senders[(token, api_url)] = TelegramSender(token, api_url)
+        return _senders[(token, api_url)]
+
+@atexit.register
+def close_senders():
+    with _senders_lock:
+        senders = list(_senders.values())
+    for sender in senders:
+        sender.close()
+
+def test(messages=20, threads=4):
+    """Send from several threads to a local stand-in for the Bot API and count the connections it accepted."""
+    import json
+    from concurrent.futures import ThreadPoolExecutor
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    counter = {'messages': 0, 'connections': set()}
+    counter_lock = threading.Lock()
+
+    class Handler(BaseHTTPRequestHandler):
+        # Keep-alive, so reused connections show up as one client port
+        protocol_version = 'HTTP/1.1'
+
+        def do_POST(self):
+            self.rfile.read(int(self.headers['Content-Length']))
+            with counter_lock:
+                counter['messages'] += 1
+                counter['connections'].add(self.client_address[1])
+                message_id = counter['messages']
+            body = json.dumps({'ok': True, 'result': {
+                'message_id': message_id, 'date': int(time.time()), 'chat': {'id': -100, 'type': 'channel'}, 'text': 'ok',
+            }}).encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        sender = TelegramSender('123456:test', api_url=f"http://127.0.0.1:{server.server_port}")
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=threads) as executor:
+            ids = list(executor.map(lambda i: sender.submit_text(-100, f"message {i}").result(10), range(messages)))
+        elapsed = time.perf_counter() - started
+        assert sorted(message_id for part_ids in ids for message_id in part_ids) == list(range(1, messages + 1)), ids
+        # At most one request per thread is in flight, each needs one connection that is then reused
+        assert len(counter['connections']) <= threads, counter['connections']
+
+        async def from_another_loop():
+            return await sender.send_text(-100, "x" * (MAX_MESSAGE_LENGTH + 1))
+        assert len(asyncio.run(from_another_loop())) == 2
+        sender.close()
+        print(f"{messages} messages from {threads} threads in {elapsed:.2f}s over {len(counter['connections'])} connections")
+    finally:
+        server.shutdown()
+
+# test()
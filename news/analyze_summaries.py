@@ -4,11 +4,15 @@ import logging
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
 from models import Base, SummarizedNews, AnalyzedNews
-from openai import OpenAI
 import schedule
 import time
 import re
+import os
+import sys
 from credentials import openai_api_key
+# The shared llm package lives at the repository root
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from llm.gateway import get_gateway
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -19,8 +23,8 @@ engine = create_engine(DATABASE_URL)
 Base.metadata.create_all(engine)
 Session = sessionmaker(bind=engine)
 
-# Initialize OpenAI client
-client = OpenAI(api_key=openai_api_key)
+# Initialize OpenAI gateway
+gateway = get_gateway(openai_api_key)
 
 def analyze_summaries_with_gpt4(summaries):
     try:
@@ -51,14 +55,13 @@ def analyze_summaries_with_gpt4(summaries):
         اینجا خلاصه اخبار هستند: {combined_summaries}
         """
         
-        completion = client.chat.completions.create(
+        analysis = gateway.chat_sync(
             model="gpt-4o",
             messages=[
                 {"role": "system", "content": "You are a crypto fundamental analyzer."},
                 {"role": "user", "content": instruction}
             ]
         )
-        analysis = completion.choices[0].message.content
         logging.info("Received analysis from GPT-4")
         analysis = re.sub(r'#(\w+)', lambda m: '#' + m.group(1).replace('_', '\\_'), analysis)
         
@@ -5,7 +5,7 @@ import time
 import logging
 from fetch_news import fetch_and_store_news, process_news
 from analyze_summaries import job as analyze_summaries_job
-from telegram_bot import fetch_and_send_latest_analysis
+from telegram_bot import fetch_and_send_latest_analysis, start_delivery
 import threading
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -24,6 +24,7 @@ def start_fetch_news_scheduler():
         time.sleep(10)
 
 def main():
+    start_delivery()
     # Use threading to run the schedulers concurrently
     fetch_thread = threading.Thread(target=start_fetch_news_scheduler)
     # telegram_thread = threading.Thread(target=start_telegram_bot_scheduler)
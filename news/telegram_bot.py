@@ -1,22 +1,22 @@
 import logging
 import os
-from aiogram import Bot, Dispatcher
-import asyncio
+import sys
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
 from models import Base, AnalyzedNews
-import schedule
-import time
 from credentials import telegram_bot_token_news, telegram_channel_id
+# The shared messaging package lives at the repository root
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from messaging.sender import get_sender
+from messaging.outbox import post, text_messages, start_outbox, PRIORITY_DIGEST
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
-# Telegram bot configuration
+# Telegram bot configuration, one loop and one HTTP session for the whole process
 telegram_token = telegram_bot_token_news
 channel_id = telegram_channel_id
-bot = Bot(token=telegram_token)
-dp = Dispatcher()
+sender = get_sender(telegram_token)
 
 # Database configuration
 DATABASE_URL = 'sqlite:///news_data.db'
@@ -24,32 +24,14 @@ engine = create_engine(DATABASE_URL)
 Base.metadata.create_all(engine)
 Session = sessionmaker(bind=engine)
 
-async def send_message_to_telegram(message):
-    try:
-        max_length = 4096
-        parts = [message[i:i + max_length] for i in range(0, len(message), max_length)]
-        
-        for part in parts:
-            try:
-                await bot.send_message(chat_id=channel_id, text=part, parse_mode='Markdown')
-            except:
-                logging.exception(f"could not send formatted message: {part}")
-                await bot.send_message(chat_id=channel_id, text=part)
-        
-        logging.info("Message sent to Telegram channel")
-    except Exception as e:
-        logging.error(f"Error sending message to Telegram: {e}")
-    finally:
-        await bot.session.close()
+def send_message(message, key):
+    """Queue a message of any length in the outbox, which delivers and retries it after the signals."""
+    post(sender, channel_id, text_messages(message), key, PRIORITY_DIGEST, thread=False)
+    logging.info("Message queued for the Telegram channel")
 
-def send_message(message):
-    try:
-        asyncio.run(send_message_to_telegram(message))
-    except RuntimeError as e:
-        if str(e) == 'Event loop is closed':
-            new_loop = asyncio.new_event_loop()
-            asyncio.set_event_loop(new_loop)
-            new_loop.run_until_complete(send_message_to_telegram(message))
+def start_delivery():
+    """Deliver what is in the outbox, including messages queued before a restart."""
+    start_outbox(sender)
 
 def fetch_and_send_latest_analysis():
     session = Session()
@@ -62,7 +44,8 @@ def fetch_and_send_latest_analysis():
         if latest_analysis:
             logging.info(f"Latest analysis found with id {latest_analysis.id}")
             message = f"Analysis: {latest_analysis.analysis}"
-            send_message(message)
+            # One post per analysis, even when it is picked up again
+            send_message(message, f"news:{channel_id}:{latest_analysis.id}")
             logging.info("Latest analysis sent to Telegram")
         else:
             logging.info("No analysis found")
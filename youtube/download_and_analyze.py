@@ -1,14 +1,18 @@
 import logging
 import asyncio
 import os
+import sys
 import subprocess
 import cv2
 import base64
 from datetime import datetime
 from yt_dlp import YoutubeDL
-from openai import OpenAI
-from aiogram import Dispatcher, Bot
 from youtube_rss import YoutubeFeedParser
+# The shared llm package lives at the repository root
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from llm.gateway import get_gateway
+from messaging.sender import get_sender
+from messaging.outbox import post, post_key, text_messages, start_outbox, PRIORITY_DIGEST
 from credentials import (
     telegram_youtube_bot_token,
     telegram_channel_id,
@@ -30,8 +34,7 @@ from credentials import (
 
 telegram_token = telegram_youtube_bot_token
 channel_id = telegram_channel_id
-bot = Bot(token=telegram_token)
-dp = Dispatcher()
+sender = get_sender(telegram_token)
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -39,7 +42,7 @@ logger = logging.getLogger(__name__)
 
 # OpenAI configuration
 MODEL = "gpt-4o"
-client = OpenAI(api_key=openai_api_key)
+gateway = get_gateway(openai_api_key)
 
 channel_id_post = telegram_channel_id # Channel ID for posting the final summary
 
@@ -113,29 +116,16 @@ def process_video(video_path, max_frames=100):
         logger.error(f"Error processing video: {e}", exc_info=True)
         return []
 
-# Function to send message to a Telegram channel
-async def send_message_to_telegram_channel(message, channel_id, reply_to_message_id=None):
+# Function to queue a message for a Telegram channel
+async def send_message_to_telegram_channel(message, channel_id, key, reply_to_message_id=None):
     try:
-        logger.info(f"Attempting to send message to Telegram channel {channel_id}")
-        message_chunks = [message[i:i+4096] for i in range(0, len(message), 4096)]
-
-        first_message_id = None
-        for chunk in message_chunks:
-            try:
-                sent_message = await bot.send_message(chat_id=channel_id, text=chunk, reply_to_message_id=reply_to_message_id, parse_mode='Markdown')
-            except:
-                sent_message = await bot.send_message(chat_id=channel_id, text=chunk, reply_to_message_id=reply_to_message_id)
-
-            if first_message_id is None:
-                first_message_id = sent_message.message_id
-
-            # Set reply_to_message_id to the ID of the last sent message to chain the messages
-            reply_to_message_id = sent_message.message_id
-
-        logger.info(f"Message sent to Telegram channel {channel_id}")
-        return first_message_id
+        logger.info(f"Queueing message for Telegram channel {channel_id}")
+        # Chunks are chained as replies, each to the one before, and delivered by the outbox after the signals
+        ids = await asyncio.to_thread(post, sender, channel_id, text_messages(message), key, PRIORITY_DIGEST, reply_to_message_id)
+        logger.info(f"Message queued for Telegram channel {channel_id}")
+        return ids[0]
     except Exception as e:
-        logger.error(f"Error sending message to Telegram: {e}", exc_info=True)
+        logger.error(f"Error queueing message for Telegram: {e}", exc_info=True)
     return None
 
 # Function to send audio to Whisper for transcription and then summarize
@@ -146,17 +136,13 @@ async def send_audio_to_whisper_and_summarize(author, audio_path, video_frames,
             return
 
         # Transcribe the audio
-        with open(audio_path, "rb") as audio_file:
-            transcription = client.audio.transcriptions.create(
-                model="whisper-1",
-                file=audio_file,
-            )
+        transcription = await gateway.transcribe(audio_path, model="whisper-1")
         logger.info(f"Transcription object: {transcription}a")
         transcription_text = transcription.text
         logger.info(f"Transcription: {transcription_text}")
 
         # Summarize the audio transcription in Farsi
-        response = client.chat.completions.create(
+        audio_summary = await gateway.chat(
             model=MODEL,
             messages=[
                 {"role": "system", "content": "شما یک خلاصه برای یک ویدیو تحلیل تکنیکال یا تحلیل فاندامنتال فارکس است تولید می‌کنید. خلاصه را به فارسی بنویسید و نکات مهم را برجسته کنید."},
@@ -164,11 +150,10 @@ async def send_audio_to_whisper_and_summarize(author, audio_path, video_frames,
             ],
             temperature=0,
         )
-        audio_summary = response.choices[0].message.content
         logger.info(f"Audio Summary: {audio_summary}")
 
         # Summarize the video frames and audio transcription in Farsi
-        response = client.chat.completions.create(
+        full_summary = await gateway.chat(
             model=MODEL,
             messages=[
                 {"role": "system", "content": " شما در حال تولید خلاصه‌ای از یک ویدیو تحلیل تکنیکال یا بررسی بازار فارکس و طا و اخبار آن هستید. تولید کننده ویدیو یک متخصص بازار فارکس است.ویدیو را کمی خلاصه کنید خلاصه را به فارسی بنویسید و نکات مهم را برجسته کنید و از دیدن کل ویدیو مارا بی نیاز کنید و تاجای ممکن تمامی نکات و قیمت هارا بگو و همجنین بگو که چه فایده‌ای برای ما خواهد داشت این ویدیو."},
@@ -180,14 +165,14 @@ async def send_audio_to_whisper_and_summarize(author, audio_path, video_frames,
             ],
             temperature=0,
         )
-        full_summary = response.choices[0].message.content
         logger.info(f"Full Summary: {full_summary}")
 
         # Add the video link and source text to the summary
         full_summary += f"\nمنبع: [{author}]({video_url})"
 
         # Send the summary to the Telegram channel as a reply
-        await send_message_to_telegram_channel(full_summary, channel_id_post, reply_to_message_id)
+        # One summary per video and channel, even when the video is seen again
+        await send_message_to_telegram_channel(full_summary, channel_id_post, post_key('youtube', channel_id_post, video_url), reply_to_message_id)
 
     except Exception as e:
         logger.error(f"Error in summarization: {e}", exc_info=True)
@@ -222,6 +207,9 @@ async def main():
         ivan_on_tech_channel_id
     ]
 
+    # Summaries queued before a restart are delivered too
+    start_outbox(sender)
+
     feeds = [ YoutubeFeedParser(channel_id) for channel_id in channel_ids ]
     tasks = [ fp.check_always_async(on_new_video) for fp in feeds ]
     await asyncio.gather(*tasks)